@@ -0,0 +1,280 @@
+import time
+import copy
+import tempfile
+import functools
+import argparse
+import timeit
+import numpy as np
+import torch
+import gym
+from source.agents.dqn import DQN
+from source.agents.stacked import StackedCritic, SAMPLE_ARGUMENTS
+from source.utils.buffer import ReplayBuffer, PrioritizedReplayBuffer, SAMPLERS
+from source.utils.sampling import Prefetcher, BlockSampler
+from source.utils.vec_env import VecEnv, collect
+from source.utils.classic_control import NUMPY_ENVS
+from source.utils.logger import Logger
+from source.utils.evaluation import evaluate
+from torch.utils.tensorboard import SummaryWriter
+
+
+def time_call(fn, repeats):
+    # best of three, reported in microseconds per call
+    return min(timeit.repeat(fn, number=repeats, repeat=3)) / repeats * 1e6
+
+
+def fill(buffer, size):
+    # contents do not matter for timing, the buffer only needs its rows
+    buffer._reserve(size)
+    buffer.current_size = size
+
+
+def bench_sampling(obs_space=4, batch_size=128, repeats=200):
+    sizes = [10000, 100000, 1000000, 10000000]
+
+    print(f"ReplayBuffer.sample, batch size {batch_size}, us per call")
+    print(f"{'buffer_size':>12}" + "".join(f"{sampler:>12}" for sampler in SAMPLERS))
+    for size in sizes:
+        buffer = ReplayBuffer(obs_space, size, batch_size, seed=42)
+        fill(buffer, size)
+
+        timings = []
+        for sampler in SAMPLERS:
+            buffer.sampler = sampler
+            timings.append(time_call(buffer.sample, repeats))
+        print(f"{size:>12}" + "".join(f"{t:>12.1f}" for t in timings))
+
+        del buffer
+
+
+def bench_priorities(obs_space=4, batch_size=128, repeats=20):
+    sizes = [100000, 1000000]
+
+    print(f"Prioritized sampling, batch size {batch_size}, us per call")
+    print(f"{'buffer_size':>12}{'probas':>12}{'sum-tree':>12}{'update':>12}")
+    for size in sizes:
+        buffer = ReplayBuffer(obs_space, size, batch_size, seed=42)
+        fill(buffer, size)
+        t_probas = time_call(lambda: buffer.sample(use_probas=True), repeats)
+        del buffer
+
+        buffer = PrioritizedReplayBuffer(obs_space, size, batch_size, seed=42)
+        fill(buffer, size)
+        buffer.reset_priorities()
+        buffer.update_priorities(np.random.default_rng(42).exponential(size=size), np.arange(size))
+        td_errors = np.random.default_rng(42).exponential(size=batch_size)
+
+        t_tree = time_call(lambda: buffer.sample(use_probas=True), repeats)
+        t_update = time_call(lambda: buffer.update_priorities(td_errors), repeats)
+        print(f"{size:>12}{t_probas:>12.1f}{t_tree:>12.1f}{t_update:>12.1f}")
+        del buffer
+
+
+def bench_prefetch(obs_space=4, batch_size=128, iterations=2000):
+    sizes = [100000, 1000000]
+
+    print(f"DQN updates with and without prefetching, batch size {batch_size}, ms per update")
+    print(f"{'buffer_size':>12}{'serial':>12}{'prefetch':>12}{'sample':>12}{'wait':>12}{'hidden':>12}")
+    for size in sizes:
+        buffer = ReplayBuffer(obs_space, size, batch_size, seed=42)
+        fill(buffer, size)
+
+        timings, writer = [], Logger()
+        for prefetch in [0, 4]:
+            torch.manual_seed(42)
+            agent = DQN(obs_space, 2, 0.99, seed=42)
+            source = Prefetcher(buffer, [(None, None)] * iterations, depth=prefetch) if prefetch > 0 else buffer
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                agent.train(source, writer)
+            timings.append((time.perf_counter() - start) / iterations * 1e3)
+
+        stats = source.stats()
+        source.close()
+        print(f"{size:>12}{timings[0]:>12.3f}{timings[1]:>12.3f}{stats['sample_ms']:>12.3f}"
+              f"{stats['wait_ms']:>12.3f}{stats['hidden']:>12.2f}")
+        del buffer
+
+
+def bench_sample_many(obs_space=4, batch_size=128, size=1000000, iterations=2048):
+    ks = [1, 4, 16, 64]
+
+    print(f"Batches drawn k at a time, buffer size {size}, batch size {batch_size}, us per batch / ms per DQN update")
+    print(f"{'sampler':>12}" + "".join(f"{f'k={k}':>12}" for k in ks) + f"{'update k=1':>12}{f'k={ks[-1]}':>12}")
+    buffer = ReplayBuffer(obs_space, size, batch_size, seed=42)
+    fill(buffer, size)
+    writer = Logger()
+
+    for sampler in SAMPLERS:
+        buffer.sampler = sampler
+        timings = [time_call(BlockSampler(buffer, k).sample, iterations) for k in ks]
+
+        updates = []
+        for k in [1, ks[-1]]:
+            torch.manual_seed(42)
+            agent, source = DQN(obs_space, 2, 0.99, seed=42), BlockSampler(buffer, k)
+            start = time.perf_counter()
+            for _ in range(iterations // 4):
+                agent.train(source, writer)
+            updates.append((time.perf_counter() - start) / (iterations // 4) * 1e3)
+
+        print(f"{sampler:>12}" + "".join(f"{t:>12.1f}" for t in timings) + "".join(f"{t:>12.3f}" for t in updates))
+
+
+def bench_rollout(envid="CartPole-v1", transitions=20000):
+    counts = [1, 4, 16, 64]
+
+    print(f"Dataset collection on {envid} with a DQN policy, transitions per second")
+    print(f"{'num_envs':>12}{'sync':>12}{'async':>12}{'numpy':>12}")
+    env = gym.make(envid)
+    agent = DQN(env.observation_space.shape[0], env.action_space.n, 0.99, seed=42)
+
+    for num_envs in counts:
+        vec_envs = [lambda: VecEnv([functools.partial(gym.make, envid)] * num_envs, asynchronous=False),
+                    lambda: VecEnv([functools.partial(gym.make, envid)] * num_envs, asynchronous=True),
+                    lambda: NUMPY_ENVS[envid](num_envs)]
+
+        timings = []
+        for make_vec_env in vec_envs:
+            buffer = ReplayBuffer(env.observation_space.shape[0], transitions, 32, seed=42)
+            with make_vec_env() as vec_env:
+                vec_env.seed(42)
+                start = time.perf_counter()
+                collect(vec_env, buffer, transitions, lambda states: agent.policy_batch(states, eval=True)[0])
+                timings.append(transitions / (time.perf_counter() - start))
+        print(f"{num_envs:>12}" + "".join(f"{t:>12.0f}" for t in timings))
+
+
+def bench_simulation(steps=200):
+    counts = [1, 64, 1024]
+
+    print("Stepping with random actions, steps per second")
+    print(f"{'env':>16}{'num_envs':>12}{'gym':>12}{'numpy':>12}")
+    rng = np.random.default_rng(42)
+    for envid, cls in NUMPY_ENVS.items():
+        for num_envs in counts:
+            timings = []
+            for vec_env in [VecEnv([functools.partial(gym.make, envid)] * num_envs), cls(num_envs)]:
+                vec_env.seed(42)
+                vec_env.reset()
+                actions = rng.integers(vec_env.action_space.n, size=(steps, num_envs))
+                try:
+                    start = time.perf_counter()
+                    for step in range(steps):
+                        vec_env.step(actions[step])
+                    timings.append(steps * num_envs / (time.perf_counter() - start))
+                except AttributeError:
+                    # gym's Acrobot does not run with NumPy 2
+                    timings.append(np.nan)
+                vec_env.close()
+            print(f"{envid:>16}{num_envs:>12}" + "".join(f"{t:>12.0f}" for t in timings))
+
+
+def bench_logging(calls=2000):
+    # fewer calls than the Logger holds, the time the caller spends, not the throughput of the background thread
+    print(f"add_scalar of a float and of a loss tensor, {calls} calls, us per call")
+    print(f"{'writer':>16}{'float':>12}{'tensor':>12}{'close':>12}")
+    loss = torch.ones(128).mean()
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        for name, make_writer in [("SummaryWriter", lambda: SummaryWriter(log_dir=log_dir)),
+                                  ("Logger", lambda: Logger(log_dir=log_dir)),
+                                  ("Logger (no-op)", lambda: Logger())]:
+            writer = make_writer()
+            timings = []
+            for value in [1., loss]:
+                start = time.perf_counter()
+                for i in range(calls):
+                    writer.add_scalar("bench/value", value, i)
+                timings.append((time.perf_counter() - start) / calls * 1e6)
+
+            # a SummaryWriter writes on close, the Logger on its background thread until then
+            start = time.perf_counter()
+            writer.close()
+            close = (time.perf_counter() - start) * 1e3
+            print(f"{name:>16}{timings[0]:>12.2f}{timings[1]:>12.2f}{close:>10.1f}ms")
+
+
+def bench_seeds(obs_space=4, batch_size=128, size=100000, iterations=200):
+    counts = [1, 2, 4, 8]
+
+    print(f"Updates of S seeds, serial and stacked, batch size {batch_size}, ms per update of all seeds")
+    print(f"{'agent':>12}{'seeds':>12}{'serial':>12}{'stacked':>12}{'speedup':>12}")
+    buffer = ReplayBuffer(obs_space, size, batch_size, seed=42)
+    fill(buffer, size)
+    buffer.calc_remaining_reward(discount=0.99)
+    writer = Logger()
+
+    for agent_type in SAMPLE_ARGUMENTS:
+        for seeds in counts:
+            buffers = []
+            for seed in range(seeds):
+                buffers.append(copy.copy(buffer))
+                buffers[-1].set_seed(seed)
+
+            agents = [agent_type(obs_space, 2, 0.99, 1e-4, seed=seed) for seed in range(seeds)]
+            start = time.perf_counter()
+            for _ in range(iterations):
+                for agent, source in zip(agents, buffers):
+                    agent.train(source, writer)
+            serial = (time.perf_counter() - start) / iterations * 1e3
+
+            stacked = StackedCritic([agent_type(obs_space, 2, 0.99, 1e-4, seed=seed) for seed in range(seeds)])
+            start = time.perf_counter()
+            for _ in range(iterations):
+                stacked.train(buffers, [writer] * seeds)
+            together = (time.perf_counter() - start) / iterations * 1e3
+            print(f"{agent_type.__name__:>12}{seeds:>12}{serial:>12.3f}{together:>12.3f}{serial / together:>11.2f}x")
+
+
+def bench_evaluation(envid="CartPole-v1", repeats=3):
+    counts = [1, 8, 32]
+
+    print(f"Evaluation of K greedy episodes of a DQN policy on {envid}, ms per episode")
+    print(f"{'episodes':>12}{'serial':>12}{'VecEnv':>12}{'numpy':>12}")
+    env = gym.make(envid)
+    agent = DQN(env.observation_space.shape[0], env.action_space.n, 0.99, seed=42)
+    writer = Logger()
+
+    for episodes in counts:
+        def serial():
+            results = ([], [], [])
+            for i in range(episodes):
+                env.seed(42 + i)
+                results = evaluate(env, agent, writer, *results)
+            return results
+
+        timings = []
+        for run in [serial,
+                    lambda: evaluate(VecEnv([functools.partial(gym.make, envid)] * episodes), agent, writer, [], [], []),
+                    lambda: evaluate(NUMPY_ENVS[envid](episodes), agent, writer, [], [], [])]:
+            start = time.perf_counter()
+            for _ in range(repeats):
+                run()
+            timings.append((time.perf_counter() - start) / (repeats * episodes) * 1e3)
+        print(f"{episodes:>12}" + "".join(f"{t:>12.3f}" for t in timings))
+
+
+benchmarks = {
+    "sampling": bench_sampling,
+    "priorities": bench_priorities,
+    "prefetch": bench_prefetch,
+    "sample_many": bench_sample_many,
+    "rollout": bench_rollout,
+    "simulation": bench_simulation,
+    "logging": bench_logging,
+    "seeds": bench_seeds,
+    "evaluation": bench_evaluation
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", default="all", choices=["all"] + list(benchmarks.keys()))
+    args = parser.parse_args()
+
+    for name, bench in benchmarks.items():
+        if args.b in ("all", name):
+            bench()
+            print()
@@ -0,0 +1,18 @@
+import os
+import glob
+import argparse
+from source.utils.buffer import convert_dataset
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-e", default=0, type=int)  # experiment to convert, 0 converts all
+parser.add_argument("--delete", action="store_true")  # remove the pickles after conversion
+args = parser.parse_args()
+
+# convert pickled ReplayBuffers to the memory mappable directory format
+pattern = "ex*" if args.e == 0 else f"ex{args.e}"
+for file in sorted(glob.glob(os.path.join("data", pattern, "*_run*.pkl"))):
+    path = file[:-len(".pkl")]
+    print(f"{file} -> {path}")
+    convert_dataset(path)
+    if args.delete:
+        os.remove(file)
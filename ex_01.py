@@ -1,10 +1,12 @@
 from source.train_online import train_online
-from source.train_offline import train_offline
+from source.train_offline import train_offline_shared
 from source.offline_ds_evaluation.evaluator import Evaluator
+from source.utils.buffer import load_dataset
+from source.utils.utils import dataset_path
+from source.utils.scheduler import Manifest, manifest_path, run_jobs, grid, by_dataset
 from source.offline_ds_evaluation.latex import create_latex_table
 from multiprocessing import Pool
 import os
-import pickle
 import numpy as np
 
 
@@ -34,32 +36,44 @@ def create_ds(args):
 
     train_online(experiment=experiment, agent_type=behavioral, discount=discount, envid=envid,
                  transitions=transitions_online, buffer_size=50000,
-                 run=1, seed=seed)
+                 run=1, seed=seed, parallel_datasets=True)
 
 def train(args):
-    envid, discount = args
+    envid, agents, buffer_type, run = args
+
+    # the agents train on the dataset together, on the same batches
+    results = train_offline_shared(experiment=experiment, envid=envid, agent_types=agents, buffer_type=buffer_type,
+                                   discount=discounts[envs.index(envid)], transitions=transitions_offline,
+                                   batch_size=batch_size, lr=[lr[agent_types.index(agent)] for agent in agents],
+                                   use_run=1, run=run, seed=seed+run, use_remaining_reward=("EVMCP" in agents),
+                                   use_cache=True)
+    # agents that failed are not marked as done
+    return [(experiment, envid, agent, buffer_type, run) for agent, result in results.items()
+            if isinstance(result, Exception)]
 
-    for run in range(1, multiple_runs + 1):
-        for a, agent in enumerate(agent_types):
-            for bt in range(len(buffer_types)):
-                train_offline(experiment=experiment, envid=envid, agent_type=agent, buffer_type=buffer_types[bt],
-                              discount=discount, transitions=transitions_offline, batch_size=batch_size, lr=lr[a],
-                              use_run=1, run=run, seed=seed+run, use_remaining_reward=(agent == "EVMCP"))
+def train_jobs(manifest):
+    # one job per dataset and run with the agents that did not finish on it yet
+    keys = grid(experiment, envs, agent_types, buffer_types, range(1, multiple_runs + 1))
+    return [(group, (envid, [key[2] for key in group], buffer_type, run))
+            for (_, envid, buffer_type, run), group in by_dataset(keys, manifest).items()]
 
 def assess_ds(args):
     use_run = 1
     envid, buffer_type, random_reward, optimal_reward = args
 
-    with open(os.path.join("data", f"ex{experiment}", f"{envid}_run{use_run}_{buffer_type}.pkl"), "rb") as f:
-        buffer = pickle.load(f)
+    buffer = load_dataset(dataset_path(experiment, envid, use_run, buffer_type))
 
     os.makedirs(os.path.join("results", "ds_eval"), exist_ok=True)
-    evaluator = Evaluator(envid, buffer_type, buffer.state, buffer.action, buffer.reward, np.invert(buffer.not_done))
+    evaluator = Evaluator(envid, buffer_type, buffer.decoded_state(), buffer.action, buffer.reward, np.invert(buffer.not_done))
 
     path = os.path.join("results", "ds_eval", f"{envid}_{buffer_type}")
     return evaluator.evaluate(path, random_reward, optimal_reward, epochs=2)
 
 if __name__ == '__main__':
+    # finished jobs are recorded in the manifest and skipped when the script is started again
+    #manifest = Manifest(manifest_path(experiment))
+    #run_jobs(train, train_jobs(manifest), manifest)
+
     # assess all datasets
     results = []
     for e, env in enumerate(envs):
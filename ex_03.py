@@ -1,6 +1,9 @@
 from source.train_online import train_online
 from source.train_offline import train_offline
 from source.offline_ds_evaluation.evaluator import Evaluator
+from source.utils.buffer import load_dataset
+from source.utils.utils import dataset_path
+from source.utils.scheduler import Manifest, manifest_path, run_jobs, grid, NestablePool
 from source.offline_ds_evaluation.metrics_manager import MetricsManager
 from source.offline_ds_evaluation.latex import create_latex_table
 from multiprocessing import Pool
@@ -35,36 +38,42 @@ def create_ds(args):
 
     train_online(experiment=experiment, agent_type=behavioral, discount=discount, envid=envid,
                  transitions=transitions_online, buffer_size=50000,
-                 run=1, seed=seed)
+                 run=1, seed=seed, parallel_datasets=True)
 
 def train(args):
-    envid, discount = args
+    _, envid, agent, buffer_type, run = args
+
+    train_offline(experiment=experiment, envid=envid, agent_type=agent, buffer_type=buffer_type,
+                  discount=discounts[envs.index(envid)], transitions=transitions_offline, batch_size=batch_size,
+                  lr=lr[agent_types.index(agent)], use_run=1, run=run, seed=seed+run,
+                  use_remaining_reward=(agent == "MCE"), use_cache=True)
 
-    for run in range(1, multiple_runs + 1):
-        for a, agent in enumerate(agent_types):
-            for bt in range(len(buffer_types)):
-                train_offline(experiment=experiment, envid=envid, agent_type=agent, buffer_type=buffer_types[bt],
-                              discount=discount, transitions=transitions_offline, batch_size=batch_size, lr=lr[a],
-                              use_run=1, run=run, seed=seed+run, use_remaining_reward=(agent == "MCE"))
+def train_jobs():
+    # one job per (env, agent, buffer type, run), the job key is its argument
+    return [([key], key) for key in grid(experiment, envs, agent_types, buffer_types, range(1, multiple_runs + 1))]
 
 def assess_ds(args):
     use_run = 1
     envid, buffer_type, random_reward, optimal_reward = args
 
-    with open(os.path.join("data", f"ex{experiment}", f"{envid}_run{use_run}_{buffer_type}.pkl"), "rb") as f:
-        buffer = pickle.load(f)
+    buffer = load_dataset(dataset_path(experiment, envid, use_run, buffer_type))
 
     os.makedirs(os.path.join("results", "ds_eval"), exist_ok=True)
-    evaluator = Evaluator(envid, buffer_type, buffer.state, buffer.action, buffer.reward, np.invert(buffer.not_done))
+    evaluator = Evaluator(envid, buffer_type, buffer.decoded_state(), buffer.action, buffer.reward, np.invert(buffer.not_done))
 
     path = os.path.join("results", "ds_eval", f"{envid}_{buffer_type}")
     return evaluator.evaluate(path, random_reward, optimal_reward, epochs=5)
 
 if __name__ == '__main__':
 
-    with Pool(len(envs), maxtasksperchild=1) as p:
-        #p.map(create_ds, zip(envs, discounts))
-        p.map(train, zip(envs, discounts))
+    # the workers generate their datasets in pools of their own
+    #with NestablePool(len(envs), maxtasksperchild=1) as p:
+    #    p.map(create_ds, zip(envs, discounts))
+
+    # as many jobs in parallel as there are cores, finished jobs are recorded in the manifest and skipped when the
+    # script is started again
+    manifest = Manifest(manifest_path(experiment))
+    run_jobs(train, train_jobs(), manifest)
     """
 
     # assess all datasets
@@ -1,6 +1,10 @@
 from source.train_online import train_online
-from source.train_offline import train_offline
+from source.train_offline import train_offline_shared
 from source.offline_ds_evaluation.evaluator import Evaluator
+from source.utils.buffer import load_dataset
+from source.utils.shared import DatasetBroker
+from source.utils.scheduler import Manifest, manifest_path, run_jobs, grid, by_dataset, NestablePool
+from source.utils.utils import dataset_path
 from source.offline_ds_evaluation.metrics_manager import MetricsManager
 from source.offline_ds_evaluation.latex import create_latex_table
 from multiprocessing import Pool
@@ -34,17 +38,30 @@ def create_ds(args):
 
     train_online(experiment=experiment, agent_type=behavioral, discount=discount, envid=envid,
                  transitions=transitions_online, buffer_size=50000,
-                 run=1, seed=seed)
+                 run=1, seed=seed, parallel_datasets=True)
 
 def train(args):
-    envid, discount = args
-
-    for run in range(1, multiple_runs + 1):
-        for a, agent in enumerate(agent_types):
-            for bt in range(len(buffer_types)):
-                train_offline(experiment=experiment, envid=envid, agent_type=agent, buffer_type=buffer_types[bt],
-                              discount=discount, transitions=transitions_offline, batch_size=batch_size, lr=lr[a],
-                              use_run=1, run=run, seed=seed+run, use_remaining_reward=(agent == "MCE"))
+    envid, agents, buffer_type, run, dataset = args
+
+    # the agents train on the dataset together, on the same batches
+    results = train_offline_shared(experiment=experiment, envid=envid, agent_types=agents, buffer_type=buffer_type,
+                                   discount=discounts[envs.index(envid)], transitions=transitions_offline,
+                                   batch_size=batch_size, lr=[lr[agent_types.index(agent)] for agent in agents],
+                                   use_run=1, run=run, seed=seed+run, use_remaining_reward=("MCE" in agents),
+                                   dataset=dataset.attach(), use_cache=True)
+    # agents that failed are not marked as done
+    return [(experiment, envid, agent, buffer_type, run) for agent, result in results.items()
+            if isinstance(result, Exception)]
+
+def train_jobs(broker, manifest):
+    # one job per dataset and run with the agents that did not finish on it yet, all jobs of a dataset attach to
+    # the same shared memory
+    jobs = []
+    keys = grid(experiment, envs, agent_types, buffer_types, range(1, multiple_runs + 1))
+    for (_, envid, buffer_type, run), group in by_dataset(keys, manifest).items():
+        dataset = broker.load(dataset_path(experiment, envid, 1, buffer_type))
+        jobs.append((group, (envid, [key[2] for key in group], buffer_type, run, dataset)))
+    return jobs
 
 def assess_env(args):
     e, envid = args
@@ -54,10 +71,9 @@ def assess_env(args):
     results = []
     mm = MetricsManager(experiment)
     for buffer_type in buffer_types:
-        with open(os.path.join("data", f"ex{experiment}", f"{envid}_run1_{buffer_type}.pkl"), "rb") as f:
-            buffer = pickle.load(f)
+        buffer = load_dataset(dataset_path(experiment, envid, 1, buffer_type))
 
-        evaluator = Evaluator(envid, buffer_type, buffer.state, buffer.action, buffer.reward,
+        evaluator = Evaluator(envid, buffer_type, buffer.decoded_state(), buffer.action, buffer.reward,
                               np.invert(buffer.not_done))
 
         path = os.path.join("results", "ds_eval", f"{envid}_{buffer_type}")
@@ -78,7 +94,15 @@ def assess_env(args):
 
 if __name__ == '__main__':
 
+    # the workers generate their datasets in pools of their own
+    #with NestablePool(len(envs), maxtasksperchild=1) as p:
+    #    p.map(create_ds, zip(envs, discounts))
+
+    # datasets are loaded once, so the pool can be as large as the machine allows. Finished jobs are recorded in
+    # the manifest and skipped when the script is started again
+    #manifest = Manifest(manifest_path(experiment))
+    #with DatasetBroker() as broker:
+    #    run_jobs(train, train_jobs(broker, manifest), manifest)
+
     with Pool(len(envs), maxtasksperchild=1) as p:
-        #p.map(create_ds, zip(envs, discounts))
-        #p.map(train, zip(envs, discounts))
         p.map(assess_env, zip(range(len(envs)), envs))
@@ -4,7 +4,6 @@ import pickle
 import warnings
 import numpy as np
 from tqdm import tqdm
-from torch.utils.tensorboard import SummaryWriter
 
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -12,6 +11,7 @@ sns.set()
 
 from source.utils.buffer import ReplayBuffer
 from source.utils.evaluation import evaluate
+from source.utils.logger import Logger
 from source.offline_ds_evaluation.evaluator import Evaluator
 from source.utils.utils import get_agent, make_env
 from gym_minigrid.wrappers import ReseedWrapper
@@ -30,8 +30,8 @@ mean_over = 100
 train_every = 1
 train_start_iter = batch_size
 
-writer = SummaryWriter(log_dir=os.path.join("runs", "ex_corr", "MiniGrid-LavaGapS7-v0", "online", "DQN",
-                                            f"{len(seeds)}_seeds"))
+writer = Logger(log_dir=os.path.join("runs", "ex_corr", "MiniGrid-LavaGapS7-v0", "online", "DQN",
+                                    f"{len(seeds)}_seeds"))
 env = make_env("MiniGrid-LavaGapS7-v0")
 eval_env = make_env("MiniGrid-LavaGapS7-v0")
 if len(seeds) > 0:
@@ -119,6 +119,7 @@ for iteration in tqdm(range(transitions), desc=f"Behavioral policy"):
     if (iteration+1) % evaluate_every == 0:
         all_rewards, all_dev_mean, all_dev_std = evaluate(eval_env, agent, writer, all_rewards,
                                                           all_dev_mean, all_dev_std, over_episodes=mean_over)
+writer.close()
 
 # save ER-buffer for further processing
 os.makedirs(os.path.join("data", "ex_corr", f"{len(seeds)}_seeds"), exist_ok=True)
@@ -153,7 +154,7 @@ for name in names:
     with open(os.path.join("data", "ex_corr", f"{len(seeds)}_seeds", name + ".pkl"), "rb") as f:
         buffer = pickle.load(f)
 
-    evaluator = Evaluator("MiniGrid-LavaGapS7-v0", name, buffer.state, buffer.action, buffer.reward,
+    evaluator = Evaluator("MiniGrid-LavaGapS7-v0", name, buffer.decoded_state(), buffer.action, buffer.reward,
                           np.invert(buffer.not_done))
 
     evaluator.train_state_embedding(epochs=10)
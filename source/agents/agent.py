@@ -24,6 +24,27 @@ class Agent(ABC):
         This function returns the action given the observation.
         """
 
+    def policy_batch(self, states, eval=False):
+        """
+        Batched version of policy for an [N, obs] array of observations, e.g. from a VecEnv.
+        Returns the actions [N], action values [N, actions] and entropies [N] as numpy arrays,
+        values and entropies are nan where policy would return nan.
+        Agents with a network override this with a single forward pass.
+        """
+        actions, values, entropies = zip(*[self.policy(state, eval=eval) for state in states])
+        values = [np.full(self.action_space, np.nan) if np.isscalar(value) else value.numpy().reshape(-1)
+                  for value in values]
+        return np.array(actions), np.stack(values), np.array(entropies, dtype=float)
+
+    def explore_batch(self, actions, eps):
+        """
+        Replaces every action by a random one with probability eps, as the epsilon greedy policies do.
+        Returns the actions and a mask of the replaced ones.
+        """
+        explore = self.rng.uniform(0, 1, size=len(actions)) <= eps
+        actions[explore] = self.rng.integers(self.action_space, size=np.count_nonzero(explore))
+        return actions, explore
+
     @abstractmethod
     def train(self, buffer):
         """
@@ -5,7 +5,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.distributions import Categorical
 from .agent import Agent
-from ..utils.evaluation import entropy
+from ..utils.evaluation import entropy, entropy_batch
 from ..networks.actor import Actor
 
 
@@ -43,6 +43,20 @@ class BehavioralCloning(Agent):
 
             return dist.sample().item(), torch.FloatTensor([np.nan]), entropy(actions)
 
+    def policy_batch(self, states, eval=False):
+        # set networks to eval mode
+        self.actor.eval()
+
+        # one forward pass for all states
+        with torch.no_grad():
+            states = torch.FloatTensor(states).to(self.device)
+            actions = self.actor(states).cpu()
+            actions = F.softmax(actions, dim=1)
+
+            sampled = Categorical(actions).sample().numpy()
+
+        return sampled, np.full((len(sampled), self.action_space), np.nan), entropy_batch(actions)
+
     def train(self, buffer, writer, minimum=None, maximum=None, use_probas=False):
         # Sample replay buffer
         state, action, _, _, _ = buffer.sample(minimum, maximum, use_probas)
@@ -56,9 +70,15 @@ class BehavioralCloning(Agent):
         # calculate CE-loss
         loss = self.ce(pred_action, action.squeeze(1))
 
+        # feed the losses of the single samples back into prioritized buffers
+        if use_probas:
+            with torch.no_grad():
+                losses = F.cross_entropy(pred_action, action.squeeze(1), reduction="none")
+            buffer.update_priorities(losses.cpu().numpy())
+
         # log cross entropy loss
         if self.iterations % 100 == 0:
-            writer.add_scalar("train/policy-loss", torch.mean(loss).detach().cpu().item(), self.iterations)
+            writer.add_scalar("train/policy-loss", torch.mean(loss).detach(), self.iterations)
 
         # Optimize the policy
         self.optimizer.zero_grad()
@@ -5,7 +5,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from .agent import Agent
-from ..utils.evaluation import entropy
+from ..utils.evaluation import entropy, entropy_batch
 from ..networks.critic import Critic
 from ..networks.actor import Actor
 
@@ -77,6 +77,35 @@ class BCQ(Agent):
         else:
             return self.rng.integers(self.action_space), np.nan, np.nan
 
+    def policy_batch(self, states, eval=False):
+
+        # set networks to eval mode
+        self.actor.eval()
+        self.Q.eval()
+
+        if eval:
+            eps = self.eval_eps
+        else:
+            eps = max(self.slope * self.iterations + self.initial_eps, self.end_eps)
+
+        # epsilon greedy policy, one forward pass for all states
+        with torch.no_grad():
+            states = torch.FloatTensor(states).to(self.device)
+
+            q_val = self.Q(states).cpu()
+            actions = self.actor(states).cpu()
+
+            sm = F.log_softmax(actions, dim=1).exp()
+            mask = ((sm / sm.max(1, keepdim=True)[0]) > self.threshold).float()
+
+            # masking non-eligible values with -9e9 to be sure they are not sampled
+            greedy = (mask * q_val + (1. - mask) * -9e9).argmax(dim=1).numpy()
+
+        actions, explore = self.explore_batch(greedy, eps)
+        q_val, entropies = q_val.numpy(), entropy_batch(sm)
+        q_val[explore], entropies[explore] = np.nan, np.nan
+        return actions, q_val, entropies
+
     def train(self, buffer, writer, minimum=None, maximum=None, use_probas=False):
         # Sample replay buffer
         state, action, next_state, reward, not_done = buffer.sample(minimum, maximum, use_probas)
@@ -103,14 +132,18 @@ class BCQ(Agent):
 
         # Compute Q loss (Huber loss)
         Q_loss = self.huber(current_Q, target_Q)
+
+        # feed TD-errors back into prioritized buffers
+        if use_probas:
+            buffer.update_priorities((target_Q - current_Q).detach().cpu().numpy())
         A_loss = self.nll(F.log_softmax(actions, dim=1), action.reshape(-1))
         # third term is
         loss = Q_loss + A_loss + 1e-2 * actions.pow(2).mean()
 
         # log temporal difference error
         if self.iterations % 100 == 0:
-            writer.add_scalar("train/TD-error", torch.mean(Q_loss).detach().cpu().item(), self.iterations)
-            writer.add_scalar("train/CE-loss", torch.mean(A_loss).detach().cpu().item(), self.iterations)
+            writer.add_scalar("train/TD-error", torch.mean(Q_loss).detach(), self.iterations)
+            writer.add_scalar("train/CE-loss", torch.mean(A_loss).detach(), self.iterations)
 
         # Optimize the Q
         self.optimizer.zero_grad()
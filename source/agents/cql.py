@@ -68,6 +68,25 @@ class CQL(Agent):
         else:
             return self.rng.integers(self.action_space), np.nan, np.nan
 
+    def policy_batch(self, states, eval=False):
+
+        # set networks to eval mode
+        self.Q.eval()
+
+        if eval:
+            eps = self.eval_eps
+        else:
+            eps = max(self.slope * self.iterations + self.initial_eps, self.end_eps)
+
+        # epsilon greedy policy, one forward pass for all states
+        with torch.no_grad():
+            states = torch.FloatTensor(states).to(self.device)
+            q_val = self.Q(states).cpu().numpy()
+
+        actions, explore = self.explore_batch(q_val.argmax(axis=1), eps)
+        q_val[explore] = np.nan
+        return actions, q_val, np.full(len(actions), np.nan)
+
     def train(self, buffer, writer, minimum=None, maximum=None, use_probas=False):
         # Sample replay buffer
         state, action, next_state, reward, not_done = buffer.sample(minimum, maximum, use_probas)
@@ -91,16 +110,20 @@ class CQL(Agent):
         # Compute Q loss (Huber loss)
         Q_loss = self.huber(current_Q, target_Q)
 
+        # feed TD-errors back into prioritized buffers
+        if use_probas:
+            buffer.update_priorities((target_Q - current_Q).detach().cpu().numpy())
+
         # log temporal difference error
         if self.iterations % 100 == 0:
-            writer.add_scalar("train/TD-error", torch.mean(Q_loss).detach().cpu().item(), self.iterations)
+            writer.add_scalar("train/TD-error", torch.mean(Q_loss).detach(), self.iterations)
 
         # calculate regularizing loss
         R_loss = torch.mean(self.alpha * (torch.logsumexp(current_Qs, dim=1) - current_Qs.gather(1, action).squeeze(1)))
 
         # log regularizer error
         if self.iterations % 100 == 0:
-            writer.add_scalar("train/R-error", torch.mean(R_loss).detach().cpu().item(), self.iterations)
+            writer.add_scalar("train/R-error", torch.mean(R_loss).detach(), self.iterations)
 
         # Optimize the Q
         self.optimizer.zero_grad()
@@ -6,7 +6,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.distributions import Categorical
 from .agent import Agent
-from ..utils.evaluation import entropy
+from ..utils.evaluation import entropy, entropy_batch
 from ..networks.critic import Critic
 from ..networks.actor import Actor
 
@@ -81,6 +81,32 @@ class CRR(Agent):
         else:
             return self.rng.integers(self.action_space), np.nan, np.nan
 
+    def policy_batch(self, states, eval=False):
+
+        # set networks to eval mode
+        self.actor.eval()
+        self.Q.eval()
+
+        if eval:
+            eps = self.eval_eps
+        else:
+            eps = max(self.slope * self.iterations + self.initial_eps, self.end_eps)
+
+        # epsilon greedy policy, one forward pass for all states
+        with torch.no_grad():
+            states = torch.FloatTensor(states).to(self.device)
+            q_val = self.Q(states).cpu()
+
+            actions = self.actor(states).cpu()
+            actions = F.softmax(actions, dim=1)
+
+            sampled = Categorical(actions).sample().numpy()
+
+        sampled, explore = self.explore_batch(sampled, eps)
+        q_val, entropies = q_val.numpy(), entropy_batch(actions)
+        q_val[explore], entropies[explore] = np.nan, np.nan
+        return sampled, q_val, entropies
+
     def train(self, buffer, writer, minimum=None, maximum=None, use_probas=False):
         # Sample replay buffer
         state, action, next_state, reward, not_done = buffer.sample(minimum, maximum, use_probas)
@@ -120,7 +146,7 @@ class CRR(Agent):
                 torch.heaviside(advantage, values=torch.zeros(1).to(self.device)).gather(1, action)).mean()
 
         if self.iterations % 100 == 0:
-            writer.add_scalar("train/policy-loss", torch.mean(loss).detach().cpu().item(), self.iterations)
+            writer.add_scalar("train/policy-loss", torch.mean(loss).detach(), self.iterations)
 
         # optimize policy
         self.p_optim.zero_grad()
@@ -150,9 +176,13 @@ class CRR(Agent):
         # Compute Q loss (Huber loss)
         Q_loss = self.huber(current_Q, target_Q)
 
+        # feed TD-errors back into prioritized buffers
+        if use_probas:
+            buffer.update_priorities((target_Q - current_Q).detach().cpu().numpy())
+
         # log temporal difference error
         if self.iterations % 100 == 0:
-            writer.add_scalar("train/TD-error", torch.mean(Q_loss).detach().cpu().item(), self.iterations)
+            writer.add_scalar("train/TD-error", torch.mean(Q_loss).detach(), self.iterations)
 
         # Optimize the Q
         self.optimizer.zero_grad()
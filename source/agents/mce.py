@@ -47,6 +47,22 @@ class MCE(Agent):
         else:
             return self.rng.integers(self.action_space), np.nan, np.nan
 
+    def policy_batch(self, states, eval=False):
+
+        # set networks to eval mode
+        self.Q.eval()
+
+        eps = self.eval_eps
+
+        # epsilon greedy policy, one forward pass for all states
+        with torch.no_grad():
+            states = torch.FloatTensor(states).to(self.device)
+            q_val = self.Q(states).cpu().numpy()
+
+        actions, explore = self.explore_batch(q_val.argmax(axis=1), eps)
+        q_val[explore] = np.nan
+        return actions, q_val, np.full(len(actions), np.nan)
+
     def train(self, buffer, writer, minimum=None, maximum=None, use_probas=False):
         # Sample replay buffer
         state, action, next_state, reward, not_done = buffer.sample(minimum, maximum, use_probas, use_remaining_reward=True)
@@ -60,9 +76,13 @@ class MCE(Agent):
         # Compute Q loss (Huber loss)
         Q_loss = self.huber(current_Q, reward)
 
+        # feed TD-errors back into prioritized buffers
+        if use_probas:
+            buffer.update_priorities((reward - current_Q).detach().cpu().numpy())
+
         # log temporal difference error
         if self.iterations % 100 == 0:
-            writer.add_scalar("train/TD-error", torch.mean(Q_loss).detach().cpu().item(), self.iterations)
+            writer.add_scalar("train/TD-error", torch.mean(Q_loss).detach(), self.iterations)
 
         # Optimize the Q
         self.optimizer.zero_grad()
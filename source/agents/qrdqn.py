@@ -65,6 +65,25 @@ class QRDQN(Agent):
         else:
             return self.rng.integers(self.action_space), np.nan, np.nan
 
+    def policy_batch(self, states, eval=False):
+
+        # set networks to eval mode
+        self.Q.eval()
+
+        if eval:
+            eps = self.eval_eps
+        else:
+            eps = max(self.slope * self.iterations + self.initial_eps, self.end_eps)
+
+        # epsilon greedy policy, one forward pass for all states
+        with torch.no_grad():
+            states = torch.FloatTensor(states).to(self.device)
+            q_val = self.Q(states).cpu().numpy()
+
+        actions, explore = self.explore_batch(q_val.argmax(axis=1), eps)
+        q_val[explore] = np.nan
+        return actions, q_val, np.full(len(actions), np.nan)
+
     def train(self, buffer, writer, minimum=None, maximum=None, use_probas=False):
         # Sample replay buffer
         state, action, next_state, reward, not_done = buffer.sample(minimum, maximum, use_probas)
@@ -106,10 +125,14 @@ class QRDQN(Agent):
         quantile_loss = abs(self.quantile_tau - (td_error.detach() < 0).float()) * huber_l
         quantile_loss = quantile_loss.sum(dim=1).mean(dim=1).mean()
 
+        # feed TD-errors back into prioritized buffers
+        if use_probas:
+            buffer.update_priorities(td_error.abs().mean(dim=(1, 2)).detach().cpu().numpy())
+
         # log temporal difference error and quantile loss
         if self.iterations % 100 == 0:
-            writer.add_scalar("train/TD-error", torch.mean(huber_l).detach().cpu().item(), self.iterations)
-            writer.add_scalar("train/quantile_loss", torch.mean(quantile_loss).detach().cpu().item(), self.iterations)
+            writer.add_scalar("train/TD-error", torch.mean(huber_l).detach(), self.iterations)
+            writer.add_scalar("train/quantile_loss", torch.mean(quantile_loss).detach(), self.iterations)
 
         # Optimize the Q
         self.optimizer.zero_grad()
@@ -1,7 +1,7 @@
 import torch
 import numpy as np
 from .agent import Agent
-from ..utils.evaluation import entropy
+from ..utils.evaluation import entropy, entropy_batch
 
 
 class Random(Agent):
@@ -23,6 +23,13 @@ class Random(Agent):
         return self.rng.choice(possible), torch.FloatTensor([np.nan]), \
                entropy((torch.ones(self.action_space) / self.action_space).float().view(1,-1))
 
+    def policy_batch(self, states, eval=False):
+        possible = np.arange(self.action_space)
+        uniform = (torch.ones(len(states), self.action_space) / self.action_space).float()
+
+        return self.rng.choice(possible, size=len(states)), np.full((len(states), self.action_space), np.nan), \
+               entropy_batch(uniform)
+
     def train(self, buffer, writer, minimum=None, maximum=None, use_probas=False):
         pass
 
@@ -6,7 +6,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.distributions import Categorical
 from .agent import Agent
-from ..utils.evaluation import entropy
+from ..utils.evaluation import entropy, entropy_batch
 from ..networks.critic import Critic
 from ..networks.actor import Actor
 
@@ -81,6 +81,31 @@ class SAC(Agent):
         else:
             return self.rng.integers(self.action_space), np.nan, np.nan
 
+    def policy_batch(self, states, eval=False):
+
+        # set networks to eval mode
+        self.actor.eval()
+        self.Q1.eval()
+
+        if eval:
+            eps = self.eval_eps
+        else:
+            eps = max(self.slope * self.iterations + self.initial_eps, self.end_eps)
+
+        # one forward pass for all states
+        with torch.no_grad():
+            states = torch.FloatTensor(states).to(self.device)
+            actions = self.actor(states).cpu()
+            actions = F.softmax(actions, dim=1)
+            q_val = torch.min(self.Q1(states).cpu(), self.Q2(states).cpu())
+
+            sampled = Categorical(actions).sample().numpy()
+
+        sampled, explore = self.explore_batch(sampled, eps)
+        q_val, entropies = q_val.numpy(), entropy_batch(actions)
+        q_val[explore], entropies[explore] = np.nan, np.nan
+        return sampled, q_val, entropies
+
     def train(self, buffer, writer, minimum=None, maximum=None, use_probas=False):
         # Sample replay buffer
         state, action, next_state, reward, not_done = buffer.sample(minimum, maximum, use_probas)
@@ -111,10 +136,14 @@ class SAC(Agent):
         Q1_loss = self.huber(current_Q1, target_Q)
         Q2_loss = self.huber(current_Q2, target_Q)
 
+        # feed TD-errors back into prioritized buffers
+        if use_probas:
+            buffer.update_priorities((target_Q - torch.min(current_Q1, current_Q2)).detach().cpu().numpy())
+
         # log temporal difference error
         if self.iterations % 100 == 0:
-            writer.add_scalar("train/TD-error 1", torch.mean(Q1_loss).detach().cpu().item(), self.iterations)
-            writer.add_scalar("train/TD-error 2", torch.mean(Q2_loss).detach().cpu().item(), self.iterations)
+            writer.add_scalar("train/TD-error 1", torch.mean(Q1_loss).detach(), self.iterations)
+            writer.add_scalar("train/TD-error 2", torch.mean(Q2_loss).detach(), self.iterations)
 
         # Optimize the Q's
         self.Q_optimizer.zero_grad()
@@ -135,7 +164,7 @@ class SAC(Agent):
 
         # log policy loss
         if self.iterations % 100 == 0:
-            writer.add_scalar("train/policy-loss", torch.mean(policy_loss).detach().cpu().item(), self.iterations)
+            writer.add_scalar("train/policy-loss", torch.mean(policy_loss).detach(), self.iterations)
 
         # Optimize the policy
         self.actor_optimizer.zero_grad()
@@ -160,8 +189,8 @@ class SAC(Agent):
 
         # log alpha loss
         if self.iterations % 100 == 0:
-            writer.add_scalar("train/alpha", self.alpha.detach().cpu().item(), self.iterations)
-            writer.add_scalar("train/alpha-loss", torch.mean(alpha_loss).detach().cpu().item(), self.iterations)
+            writer.add_scalar("train/alpha", self.alpha.detach(), self.iterations)
+            writer.add_scalar("train/alpha-loss", torch.mean(alpha_loss).detach(), self.iterations)
 
 
 
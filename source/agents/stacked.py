@@ -0,0 +1,128 @@
+import copy
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from .dqn import DQN
+from .bve import BVE
+from .mce import MCE
+from .cql import CQL
+
+# agents that train a single Critic, the ones StackedCritic can stack, with the arguments they sample with
+SAMPLE_ARGUMENTS = {DQN: {}, BVE: {"give_next_action": True}, MCE: {"use_remaining_reward": True}, CQL: {}}
+
+
+class StackedCritic():
+    """
+    Trains S independent agents of one type with a single Critic (DQN, BVE, MCE or CQL, e.g. different seeds) in one
+    process. The parameters of their Q-networks are stacked along a leading dimension and every forward pass runs for
+    all agents at once, as batched matmuls. A single Adam over the stacked parameters updates every slice exactly
+    like the agent's own Adam would, as it works element wise. The agents' networks are views on their slice, so
+    policy() and evaluate work as usual. close() hands each agent its own parameters and Adam state again.
+    """
+    def __init__(self, agents):
+        assert len(set(type(agent) for agent in agents)) == 1 and type(agents[0]) in SAMPLE_ARGUMENTS, \
+            f"Only agents of one type out of {[t.__name__ for t in SAMPLE_ARGUMENTS]} can be stacked"
+        self.agents = agents
+        agent = agents[0]
+        self.agent_type = type(agent)
+        self.discount = agent.discount
+        self.iterations = agent.iterations
+
+        self.params = {name: torch.stack([dict(agent.Q.named_parameters())[name].detach() for agent in agents])
+                       .requires_grad_() for name, _ in agent.Q.named_parameters()}
+        for i, agent in enumerate(agents):
+            for name, param in agent.Q.named_parameters():
+                param.data = self.params[name].data[i]
+
+        # only DQN and CQL bootstrap from a target network
+        self.target_params = None
+        if self.agent_type in (DQN, CQL):
+            self.target_update_freq = agents[0].target_update_freq
+            self.target_params = {name: param.detach().clone() for name, param in self.params.items()}
+            for i, agent in enumerate(agents):
+                for name, param in agent.Q_target.named_parameters():
+                    param.data = self.target_params[name][i]
+
+        # the layers of the Critic in order, Linear layers are replaced by batched matmuls with the stacked parameters
+        self.layers = [(f"backbone.{i}", module) for i, module in enumerate(agents[0].Q.backbone)]
+        self.layers.append(("out", agents[0].Q.out))
+        self.optimizer = torch.optim.Adam(params=self.params.values(), lr=agents[0].lr)
+
+    def Q(self, params, state):
+        for name, module in self.layers:
+            if isinstance(module, nn.Linear):
+                state = torch.baddbmm(params[name + ".bias"].unsqueeze(1), state,
+                                      params[name + ".weight"].transpose(1, 2))
+            else:
+                state = module(state)
+        return state
+
+    def train(self, buffers, writers, minimum=None, maximum=None):
+        # one batch per agent from its own buffer (and rng), stacked to [S, batch_size, ...]
+        batches = [buffer.sample(minimum, maximum, **SAMPLE_ARGUMENTS[self.agent_type]) for buffer in buffers]
+        fields = [torch.stack(field) for field in zip(*batches)]
+
+        # Compute the target Q value, as the agent's own train() does
+        with torch.no_grad():
+            if self.agent_type is BVE:
+                state, action, next_state, next_action, reward, not_done = fields
+                target_Q = reward + not_done * self.discount * self.Q(self.params, next_state).gather(2, next_action)
+            elif self.agent_type is MCE:
+                # the reward is the remaining reward of the episode
+                state, action, _, target_Q, _ = fields
+            else:
+                state, action, next_state, reward, not_done = fields
+                q_val = self.Q(self.params, next_state)
+                next_action = q_val.argmax(dim=2, keepdim=True)
+                target_Q = reward + not_done * self.discount * \
+                    self.Q(self.target_params, next_state).gather(2, next_action)
+
+        # Get current Q estimate
+        current_Qs = self.Q(self.params, state)
+        current_Q = current_Qs.gather(2, action)
+
+        # Huber loss of every agent, their sum has each agent's own gradient in its slice
+        Q_loss = F.smooth_l1_loss(current_Q, target_Q, reduction="none").mean(dim=(1, 2))
+        loss = Q_loss
+
+        # log temporal difference error
+        if self.iterations % 100 == 0:
+            for writer, agent_loss in zip(writers, Q_loss):
+                writer.add_scalar("train/TD-error", agent_loss.detach(), self.iterations)
+
+        # CQL's regularizing loss per agent
+        if self.agent_type is CQL:
+            alpha = self.agents[0].alpha
+            R_loss = (alpha * (torch.logsumexp(current_Qs, dim=2) - current_Q.squeeze(2))).mean(dim=1)
+            loss = loss + R_loss
+
+            # log regularizer error
+            if self.iterations % 100 == 0:
+                for writer, agent_loss in zip(writers, R_loss):
+                    writer.add_scalar("train/R-error", agent_loss.detach(), self.iterations)
+
+        # Optimize the Q
+        self.optimizer.zero_grad()
+        loss.sum().backward()
+        self.optimizer.step()
+
+        self.iterations += 1
+        for agent in self.agents:
+            agent.iterations = self.iterations
+        # Update target network by full copy every X iterations.
+        if self.target_params is not None and self.iterations % self.target_update_freq == 0:
+            for name, param in self.params.items():
+                self.target_params[name].copy_(param.detach())
+
+    def close(self):
+        # the agents' parameters are no longer views, and their own optimizers get their slices of the stacked Adam
+        # state, so every agent can go on training on its own as if it had been trained alone
+        for i, agent in enumerate(self.agents):
+            for name, param in agent.Q.named_parameters():
+                param.data = param.data.clone()
+                agent.optimizer.state[param] = {
+                    key: value[i].clone() if torch.is_tensor(value) and value.dim() > 0 else copy.deepcopy(value)
+                    for key, value in self.optimizer.state[self.params[name]].items()}
+            if self.target_params is not None:
+                for param in agent.Q_target.parameters():
+                    param.data = param.data.clone()
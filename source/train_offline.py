@@ -1,11 +1,18 @@
 import os
-import pickle
+import copy
+import time
+import traceback
 import torch
 import numpy as np
 from tqdm import tqdm
-from torch.utils.tensorboard import SummaryWriter
 from .utils.evaluation import evaluate
-from .utils.utils import get_agent, make_env
+from .utils.buffer import load_dataset, PrioritizedReplayBuffer
+from .utils.sampling import Prefetcher, BlockSampler, SharedSampler
+from .utils.logger import Logger
+from .utils.cache import result_key, load_result, save_result
+from .agents.stacked import StackedCritic, SAMPLE_ARGUMENTS
+from .utils.classic_control import NUMPY_ENVS
+from .utils.utils import get_agent, make_env, dataset_path, BColors
 
 
 def train_offline(experiment, envid, agent_type="DQN", buffer_type="er", discount=0.95, transitions=100000,
@@ -13,7 +20,8 @@ def train_offline(experiment, envid, agent_type="DQN", buffer_type="er", discoun
                   use_run=1, run=1, seed=42,
                   use_subset=False, lower=None, upper=None,
                   use_progression=False, buffer_size=None,
-                  use_remaining_reward=False):
+                  use_remaining_reward=False, on_device=False, sampler="choice", dataset=None,
+                  use_priorities=False, prefetch=0, sample_many=1, seeds=1, use_cache=False, eval_episodes=1):
 
     # over how many episodes do we take average and how much gradient updates to next
     mean_over = 100
@@ -23,45 +31,295 @@ def train_offline(experiment, envid, agent_type="DQN", buffer_type="er", discoun
     obs_space = len(env.observation_space.high)
     agent = get_agent(agent_type, obs_space, env.action_space.n, discount, lr, seed)
 
-    # load saved buffer
-    with open(os.path.join("data", f"ex{experiment}", f"{envid}_run{use_run}_{buffer_type}.pkl"), "rb") as f:
-        buffer = pickle.load(f)
+    # seeds that cannot be stacked (see train_seeds) are trained one after the other, each on its own copy of a given
+    # dataset, as prepare_buffer changes it
+    if seeds > 1 and (type(agent) not in SAMPLE_ARGUMENTS or use_priorities or prefetch > 0 or sample_many > 1):
+        return [train_offline(experiment, envid, agent_type, buffer_type, discount, transitions, batch_size, lr,
+                              use_run, run + i, seed + i, use_subset, lower, upper, use_progression, buffer_size,
+                              use_remaining_reward, on_device, sampler, None if dataset is None else copy.copy(dataset),
+                              use_priorities, prefetch, sample_many, seeds=1, use_cache=use_cache,
+                              eval_episodes=eval_episodes) for i in range(seeds)]
+
+    buffer = prepare_buffer(experiment, envid, buffer_type, discount, batch_size, use_run, use_subset, lower, upper,
+                            use_remaining_reward, sampler, dataset)
+
+    # runs with the same dataset, agent, arguments, seed and code were trained before, restore them from the cache
+    cache_dir, keys = os.path.join("data", f"ex{experiment}", "cache"), None
+    if use_cache:
+        keys = cache_keys(buffer, agent_type, [seed + i for i in range(seeds)], envid=envid, discount=discount,
+                          transitions=transitions, batch_size=batch_size, lr=lr, use_subset=use_subset, lower=lower,
+                          upper=upper, use_progression=use_progression, buffer_size=buffer_size,
+                          use_remaining_reward=use_remaining_reward, sampler=sampler, use_priorities=use_priorities,
+                          sample_many=sample_many, eval_episodes=eval_episodes)
+        agents = restore(cache_dir, keys, [run_dir(experiment, envid, buffer_type, agent_type, run + i)
+                                           for i in range(seeds)])
+        if agents is not None:
+            return agents[0] if seeds == 1 else agents
+
+    # sample proportional to TD-errors, fed back by the agents
+    if use_priorities: buffer = PrioritizedReplayBuffer.from_buffer(buffer)
+
+    #######################
+
+    # keep the dataset as torch tensors on the agent's device to speed up sampling
+    if on_device: buffer.to_device(agent.device)
+
+    # train runs run, ..., run+seeds-1 with seeds seed, ..., seed+seeds-1 together
+    if seeds > 1:
+        return train_seeds(experiment, envid, agent_type, buffer_type, discount, transitions, batch_size, lr, run,
+                           seed, seeds, buffer, agent, use_progression, buffer_size, mean_over, evaluate_every,
+                           eval_episodes, cache_dir, keys)
+
+    # seeding
+    env = make_eval_env(envid, eval_episodes, seed)
+    np.random.seed(seed)
+    buffer.set_seed(seed)
+    torch.manual_seed(seed)
+
+    writer = Logger(log_dir=run_dir(experiment, envid, buffer_type, agent_type, run), record=use_cache)
+
+    all_rewards, all_dev_mean, all_dev_std = [], [], []
+
+    # sampling window for each iteration
+    def windows():
+        for iter in range(transitions):
+            if use_progression:
+                yield max(0, iter - buffer_size), max(batch_size, iter)
+            else:
+                yield None, None
+
+    # draw the batches on a background thread, while the agent trains on the previous ones
+    source = Prefetcher(buffer, windows(), depth=prefetch) if prefetch > 0 else buffer
+    # or draw the batches of the next sample_many updates in one go
+    if sample_many > 1:
+        assert prefetch == 0, "Use either prefetch or sample_many"
+        source = BlockSampler(buffer, sample_many)
+
+    for iter, (minimum, maximum) in enumerate(tqdm(windows(), total=transitions,
+                                                   desc=f"{agent_type} ({envid}) {buffer_type}, run {run}")):
+        agent.train(source, writer, minimum, maximum, use_probas=use_priorities)
+
+        if (iter+1) % evaluate_every == 0:
+            all_rewards, all_dev_mean, all_dev_std = evaluate(env, agent, writer, all_rewards,
+                                                              all_dev_mean, all_dev_std, over_episodes=mean_over)
+
+    if prefetch > 0:
+        source.close()
+        for key, value in source.stats().items():
+            writer.add_scalar(f"prefetch/{key}", value, transitions)
+    writer.close()
+
+    if use_cache:
+        save_result(cache_dir, keys[0], agent, writer.records)
+
+    return agent
+
+
+def make_eval_env(envid, eval_episodes, seed):
+    # eval_episodes copies of the environment play their evaluation episodes together, see evaluate_batch
+    if eval_episodes > 1:
+        env = make_env(envid, num_envs=eval_episodes, numpy_sim=envid in NUMPY_ENVS)
+    else:
+        env = make_env(envid)
+    env.seed(seed)
+    return env
+
+
+def run_dir(experiment, envid, buffer_type, agent_type, run):
+    return os.path.join("runs", f"ex{experiment}", f"{envid}", f"{buffer_type}", f"{agent_type}", f"run{run}")
+
+
+def cache_keys(buffer, agent_type, seeds, **arguments):
+    # one key per seed, arguments that only name the run or decide where the data is kept are left out
+    checksum = buffer.checksum()
+    return [result_key(checksum, agent_type, seed, **arguments) for seed in seeds]
+
+
+def restore(cache_dir, keys, log_dirs):
+    # the cached agents with their TensorBoard logs written again, None unless every run is cached
+    results = [load_result(cache_dir, key) for key in keys]
+    if any(result is None for result in results):
+        return None
+
+    for (_, records), log_dir in zip(results, log_dirs):
+        with Logger(log_dir=log_dir) as writer:
+            writer.replay(records)
+    print(f"Restored {len(keys)} run(s) from the cache, e.g. {log_dirs[0]}")
+    return [agent for agent, _ in results]
+
+def prepare_buffer(experiment, envid, buffer_type, discount, batch_size, use_run=1, use_subset=False, lower=None,
+                   upper=None, use_remaining_reward=False, sampler="choice", dataset=None):
+    # load saved buffer, unless it was already loaded (e.g. attached from shared memory)
+    if dataset is None:
+        buffer = load_dataset(dataset_path(experiment, envid, use_run, buffer_type))
+    else:
+        buffer = dataset
 
     # configure buffer
     buffer.batch_size = batch_size
+    buffer.sampler = sampler
 
     #######################
     # experiment specific #
     #######################
 
-    if use_remaining_reward: buffer.calc_remaining_reward(discount=discount)
+    if use_remaining_reward: buffer.calc_remaining_reward(discount=discount,
+                                                          cache_dir=os.path.join("data", f"ex{experiment}", "cache"))
     if use_subset: buffer.subset(lower, upper)
 
     #######################
 
-    # seeding
-    env.seed(seed)
+    return buffer
+
+
+def train_seeds(experiment, envid, agent_type, buffer_type, discount, transitions, batch_size, lr, run, seed, seeds,
+                buffer, agent, use_progression, buffer_size, mean_over, evaluate_every, eval_episodes=1, cache_dir=None,
+                keys=None):
+    # every seed has its own agent, environment, batch stream and run directory, as if it was trained on its own
+    agents, envs, buffers, writers = [agent], [], [], []
+    for i in range(seeds):
+        if i > 0:
+            agents.append(get_agent(agent_type, agent.obs_space, agent.action_space, discount, lr, seed + i))
+        envs.append(make_eval_env(envid, eval_episodes, seed + i))
+        # shares the dataset, only the rng is replaced
+        buffers.append(copy.copy(buffer))
+        buffers[i].set_seed(seed + i)
+        writers.append(Logger(log_dir=run_dir(experiment, envid, buffer_type, agent_type, run + i),
+                              record=keys is not None))
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+    stacked = StackedCritic(agents)
+    results = [([], [], []) for _ in range(seeds)]
+
+    start = time.perf_counter()
+    for iter in tqdm(range(transitions), desc=f"{agent_type} ({envid}) {buffer_type}, runs {run}-{run + seeds - 1}"):
+        if use_progression:
+            stacked.train(buffers, writers, max(0, iter - buffer_size), max(batch_size, iter))
+        else:
+            stacked.train(buffers, writers)
+
+        if (iter+1) % evaluate_every == 0:
+            for i in range(seeds):
+                results[i] = evaluate(envs[i], agents[i], writers[i], *results[i], over_episodes=mean_over)
+    stacked.close()
+
+    # updates of all seeds per second, `python benchmark.py -b seeds` measures stacked against serial updates
+    updates_per_second = seeds * transitions / (time.perf_counter() - start)
+    for writer in writers:
+        writer.add_scalar("stacked/updates_per_second", updates_per_second, transitions)
+        writer.close()
+
+    if keys is not None:
+        for key, agent, writer in zip(keys, agents, writers):
+            save_result(cache_dir, key, agent, writer.records)
+
+    return agents
+
+
+def train_offline_shared(experiment, envid, agent_types, buffer_type="er", discount=0.95, transitions=100000,
+                         batch_size=128, lr=1e-4,
+                         use_run=1, run=1, seed=42,
+                         use_subset=False, lower=None, upper=None,
+                         use_progression=False, buffer_size=None,
+                         use_remaining_reward=False, on_device=False, sampler="choice", dataset=None,
+                         use_cache=False, eval_episodes=1):
+    # trains all agent_types on one dataset in lock-step, every iteration they train on the same batch.
+    # lr is a single learning rate or one per agent. An agent that raises is dropped, the others continue.
+    # Every agent draws from its own torch rng, so each trains exactly like on its own with train_offline and
+    # shares its cached results.
+    # Returns {agent_type: agent}, with the exception instead of the agent for agents that failed.
+
+    # over how many episodes do we take average and how much gradient updates to next
+    mean_over = 100
+    evaluate_every = 100
+
+    lrs = lr if isinstance(lr, (list, tuple)) else [lr] * len(agent_types)
+    buffer = prepare_buffer(experiment, envid, buffer_type, discount, batch_size, use_run, use_subset, lower, upper,
+                            use_remaining_reward, sampler, dataset)
+
+    # agents trained before with the same dataset, arguments, seed and code are restored from the cache. Only MCE
+    # needs the remaining reward, the others are keyed like their train_offline runs without it.
+    cache_dir, keys, restored = os.path.join("data", f"ex{experiment}", "cache"), {}, {}
+    if use_cache:
+        for agent_type, agent_lr in zip(agent_types, lrs):
+            keys[agent_type] = cache_keys(buffer, agent_type, [seed], envid=envid, discount=discount,
+                                          transitions=transitions, batch_size=batch_size, lr=agent_lr,
+                                          use_subset=use_subset, lower=lower, upper=upper,
+                                          use_progression=use_progression, buffer_size=buffer_size,
+                                          use_remaining_reward=(agent_type == "MCE"), sampler=sampler,
+                                          use_priorities=False, sample_many=1, eval_episodes=eval_episodes)
+            agents = restore(cache_dir, keys[agent_type], [run_dir(experiment, envid, buffer_type, agent_type, run)])
+            if agents is not None:
+                restored[agent_type] = agents[0]
+    trained = [agent_type for agent_type in agent_types if agent_type not in restored]
+
+    if len(trained) == 0:
+        return restored
+
+    # every agent has its own environment and run directory, as if it was trained on its own
+    agents, envs, writers, results = {}, {}, {}, {}
+    for agent_type, agent_lr in zip(agent_types, lrs):
+        if agent_type in restored:
+            continue
+        env = make_eval_env(envid, eval_episodes, seed)
+        envs[agent_type] = env
+        agents[agent_type] = get_agent(agent_type, len(env.observation_space.high), env.action_space.n, discount,
+                                       agent_lr, seed)
+        writers[agent_type] = Logger(log_dir=run_dir(experiment, envid, buffer_type, agent_type, run),
+                                     record=use_cache)
+        results[agent_type] = ([], [], [])
+
+    # keep the dataset as torch tensors on the agents' device to speed up sampling
+    if on_device: buffer.to_device(agents[trained[0]].device)
+
+    # seeding, every agent continues its own torch rng
     np.random.seed(seed)
     buffer.set_seed(seed)
     torch.manual_seed(seed)
+    rng_states = {agent_type: torch.get_rng_state() for agent_type in trained}
 
-    writer = SummaryWriter(log_dir=os.path.join("runs", f"ex{experiment}", f"{envid}", f"{buffer_type}", f"{agent_type}", f"run{run}"))
+    source = SharedSampler(buffer)
+    failed = {}
 
-    all_rewards, all_dev_mean, all_dev_std = [], [], []
+    def run_isolated(agent_type, fn, *args):
+        # an agent that raises is reported and dropped, without affecting the other agents
+        torch.set_rng_state(rng_states[agent_type])
+        try:
+            fn(*args)
+        except Exception as e:
+            print(BColors.WARNING + f"{agent_type} failed, continuing without it:\n" + traceback.format_exc()
+                  + BColors.ENDC)
+            failed[agent_type] = e
+            writers[agent_type].close()
+        rng_states[agent_type] = torch.get_rng_state()
+
+    def evaluate_agent(agent_type):
+        results[agent_type] = evaluate(envs[agent_type], agents[agent_type], writers[agent_type],
+                                       *results[agent_type], over_episodes=mean_over)
 
-    for iter in tqdm(range(transitions), desc=f"{agent_type} ({envid}) {buffer_type}, run {run}"):
+    for iter in tqdm(range(transitions), desc=f"{len(trained)} agents ({envid}) {buffer_type}, run {run}"):
         if use_progression:
-            minimum = max(0, iter - buffer_size)
-            maximum = max(batch_size, iter)
+            minimum, maximum = max(0, iter - buffer_size), max(batch_size, iter)
         else:
-            minimum = None
-            maximum = None
+            minimum, maximum = None, None
+        source.advance(minimum, maximum)
 
-        agent.train(buffer, writer, maximum, minimum)
+        for agent_type in trained:
+            if agent_type not in failed:
+                run_isolated(agent_type, agents[agent_type].train, source, writers[agent_type], minimum, maximum)
 
+        # interleaved, one agent after the other
         if (iter+1) % evaluate_every == 0:
-            all_rewards, all_dev_mean, all_dev_std = evaluate(env, agent, writer, all_rewards,
-                                                              all_dev_mean, all_dev_std, over_episodes=mean_over)
+            for agent_type in trained:
+                if agent_type not in failed:
+                    run_isolated(agent_type, evaluate_agent, agent_type)
 
+    for agent_type in trained:
+        if agent_type not in failed:
+            writers[agent_type].close()
+            if use_cache:
+                save_result(cache_dir, keys[agent_type][0], agents[agent_type], writers[agent_type].records)
 
-    return agent
\ No newline at end of file
+    return {agent_type: restored.get(agent_type, failed.get(agent_type, agents.get(agent_type)))
+            for agent_type in agent_types}
@@ -1,18 +1,29 @@
 import os
+import copy
+import time
+import queue
 import torch
-import pickle
 import warnings
 import numpy as np
 from tqdm import tqdm
-from torch.utils.tensorboard import SummaryWriter
+from multiprocessing import Pool
 
-from .utils.buffer import ReplayBuffer
-from .utils.evaluation import evaluate
-from .utils.utils import get_agent, make_env
+from .utils.buffer import ReplayBuffer, DatasetWriter, load_dataset, dataset_complete
+from .utils.evaluation import evaluate, RunningStats
+from .utils.checkpoint import save_checkpoint, load_checkpoint, remove_checkpoint, env_state, restore_env_state
+from .utils.actor import Actor, drain
+from .utils.logger import Logger
+from .utils.utils import get_agent, make_env, get_codec, dataset_path, checkpoint_path
+from .utils.vec_env import collect
+
+# exploration rate of the trained agent per generated dataset type, None is the uniform random policy
+DATASET_POLICIES = {"fully": 0., "noisy": 0.2, "random": None}
 
 
 def train_online(experiment, agent_type="DQN", discount=0.95, envid='CartPole-v1', transitions=100000,
-                 buffer_size=50000, run=1, seed=42):
+                 buffer_size=50000, run=1, seed=42, num_envs=1, async_envs=False, parallel_datasets=False,
+                 numpy_sim=False, checkpoint_every=10000, resume=False, actors=0, replay_ratio=1., sync_every=100,
+                 chunk_size=10000):
 
     # keep training parameters for online training fixed, the experiment does not interfere here.
     batch_size = 32
@@ -22,7 +33,7 @@ def train_online(experiment, agent_type="DQN", discount=0.95, envid='CartPole-v1
     train_every = 1
     train_start_iter = batch_size
 
-    writer = SummaryWriter(log_dir=os.path.join("runs", f"ex{experiment}", f"{envid}", "online", f"{agent_type}", f"run{run}"))
+    writer = Logger(log_dir=os.path.join("runs", f"ex{experiment}", f"{envid}", "online", f"{agent_type}", f"run{run}"))
 
     env = make_env(envid)
     eval_env = make_env(envid)
@@ -30,12 +41,9 @@ def train_online(experiment, agent_type="DQN", discount=0.95, envid='CartPole-v1
 
     agent = get_agent(agent_type, obs_space, env.action_space.n, discount, lr, seed)
 
-    # two buffers, one for learning, one for storing all transitions!
-    buffer = ReplayBuffer(obs_space, buffer_size, batch_size, seed=seed)
-    er_buffer = ReplayBuffer(obs_space, transitions, batch_size, seed=seed)
-    final_policy_buffer = ReplayBuffer(obs_space, transitions, batch_size, seed=seed)
-    noisy_policy_buffer = ReplayBuffer(obs_space, transitions, batch_size, seed=seed)
-    random_buffer = ReplayBuffer(obs_space, transitions, batch_size, seed=seed)
+    # two buffers, one for learning, one for storing all transitions! The latter is written to disk in chunks.
+    codec = get_codec(env)
+    buffer = ReplayBuffer(obs_space, buffer_size, batch_size, seed=seed, codec=codec)
 
     # seeding
     env.seed(seed)
@@ -44,30 +52,52 @@ def train_online(experiment, agent_type="DQN", discount=0.95, envid='CartPole-v1
     torch.manual_seed(seed)
 
     ep_rewards, all_rewards, all_dev_mean, all_dev_std = [], [], [], []
+    ep_stats = RunningStats()
     done = True
     ep = 0
+    start, phase = 0, "train"
+
+    # everything the rest of the run depends on is restored from the checkpoint, the state of the environments
+    # is set on the fresh ones
+    checkpoint = checkpoint_path(experiment, envid, run)
+    restored = load_checkpoint(checkpoint) if resume else None
+    if restored is not None:
+        phase, agent = restored["phase"], restored["agent"]
+        if phase == "train":
+            assert actors == 0, "Behavioral training with actors is not checkpointed, resume it without actors"
+            start, buffer, er_buffer = restored["iteration"], restored["buffer"], restored["er_buffer"]
+            # the ER dataset may hold chunks written after the checkpoint
+            er_buffer.truncate()
+            restore_env_state(env, restored["env"])
+            restore_env_state(eval_env, restored["eval_env"])
+            state, done, ep, ep_reward, ep_stats = restored["episode"]
+            ep_rewards, all_rewards, all_dev_mean, all_dev_std = restored["rewards"]
+            np.random.set_state(restored["np_rng"])
+            torch.set_rng_state(restored["torch_rng"])
+    else:
+        er_buffer = DatasetWriter(dataset_path(experiment, envid, run, "er"), obs_space, batch_size,
+                                  chunk_size=chunk_size, codec=codec)
+
+    # actors step their own environments in threads while the agent trains, not checkpointed
+    if actors > 0 and phase == "train":
+        train_async(agent, buffer, er_buffer, eval_env, writer, envid, transitions, actors, replay_ratio, sync_every,
+                    train_start_iter, evaluate_every, mean_over, seed, desc=f"Behavioral policy ({envid}), run {run}")
+        start = transitions
 
     #####################################
     # train agent
     #####################################
-    for iteration in tqdm(range(transitions), desc=f"Behavioral policy ({envid}), run {run}"):
+    for iteration in tqdm(range(start if phase == "train" else transitions, transitions), initial=start,
+                          total=transitions, desc=f"Behavioral policy ({envid}), run {run}"):
         # Reset if environment is done
         if done:
             if iteration > 0:
                 ep_rewards.append(ep_reward)
-
-                with warnings.catch_warnings():
-                    warnings.simplefilter("ignore", category=RuntimeWarning)
-                    writer.add_scalar("train/Reward (SMA)", np.mean(ep_rewards[-100:]), ep)
-                    writer.add_scalar("train/Reward", ep_reward, ep)
-                    writer.add_scalar("train/Max-Action-Value (mean)", np.nanmean(action_values), ep)
-                    writer.add_scalar("train/Max-Action-Value (std)", np.nanstd(action_values), ep)
-                    writer.add_scalar("train/Values", np.nanmean(values), ep)
-                    writer.add_scalar("train/Action-Values std", np.nanmean(values_std), ep)
-                    writer.add_scalar("train/Entropy", np.nanmean(entropies), ep)
+                log_episode(writer, ep, ep_rewards, ep_stats)
 
             state = env.reset()
-            ep_reward, values, values_std, action_values, entropies = 0, [], [], [], []
+            ep_reward = 0
+            ep_stats.reset()
             ep += 1
 
         # obtain action
@@ -82,15 +112,7 @@ def train_online(experiment, agent_type="DQN", discount=0.95, envid='CartPole-v1
 
         # add reward, value and entropy of current step for means over episode
         ep_reward += reward
-        try:
-            values.append(value.numpy().mean())
-            values_std.append(value.numpy().std())
-            action_values.append(value.max().item())
-        except AttributeError:
-            values.append(value)
-            values_std.append(value)
-            action_values.append(value)
-        entropies.append(entropy)
+        ep_stats.add(value, entropy)
 
         # now next state is the new state
         state = next_state
@@ -104,80 +126,195 @@ def train_online(experiment, agent_type="DQN", discount=0.95, envid='CartPole-v1
             all_rewards, all_dev_mean, all_dev_std = evaluate(eval_env, agent, writer, all_rewards,
                                                               all_dev_mean, all_dev_std, over_episodes=mean_over)
 
-    # save ER-buffer for offline training
-    os.makedirs(os.path.join("data", f"ex{experiment}"), exist_ok=True)
-    with open(os.path.join("data", f"ex{experiment}", f"{envid}_run{run}_er.pkl"), "wb") as f:
-        pickle.dump(er_buffer, f)
-    # free memory
-    del er_buffer
-
-    #####################################
-    # generate transitions from trained agent
-    #####################################
-    done, n_actions = True, env.action_space.n
-    for _ in tqdm(range(transitions), desc=f"Evaluate final policy ({envid}), run {run}"):
-        if done:
-            state = env.reset()
-
-        action, _, _ = agent.policy(state, eval=True)
-
-        next_state, reward, done, _ = env.step(action)
-
-        final_policy_buffer.add(state, action, reward, done)
-
-        state = next_state
-
-    os.makedirs(os.path.join("data", f"ex{experiment}"), exist_ok=True)
-    with open(os.path.join("data", f"ex{experiment}", f"{envid}_run{run}_fully.pkl"), "wb") as f:
-        pickle.dump(final_policy_buffer, f)
-
-    #####################################
-    # generate noisy transitions from trained agent
-    #####################################
-    done, n_actions = True, env.action_space.n
-    # make agent noisy
-    agent.eval_eps = 0.2
-    for _ in tqdm(range(transitions), desc=f"Evaluate noisy final policy ({envid}), run {run}"):
-        if done:
-            state = env.reset()
-
-        action, _, _ = agent.policy(state, eval=True)
-
-        next_state, reward, done, _ = env.step(action)
-
-        noisy_policy_buffer.add(state, action, reward, done)
-
-        state = next_state
-
-    os.makedirs(os.path.join("data", f"ex{experiment}"), exist_ok=True)
-    with open(os.path.join("data", f"ex{experiment}", f"{envid}_run{run}_noisy.pkl"), "wb") as f:
-        pickle.dump(noisy_policy_buffer, f)
+        if (iteration+1) % checkpoint_every == 0 and iteration+1 < transitions:
+            save_checkpoint(checkpoint, {
+                "phase": "train", "iteration": iteration+1, "agent": agent,
+                "buffer": buffer, "er_buffer": er_buffer,
+                "env": env_state(env), "eval_env": env_state(eval_env),
+                "episode": (state, done, ep, ep_reward, ep_stats),
+                "rewards": (ep_rewards, all_rewards, all_dev_mean, all_dev_std),
+                "np_rng": np.random.get_state(), "torch_rng": torch.get_rng_state()
+            })
+
+    writer.close()
+
+    if phase == "train":
+        # ER-buffer for offline training is complete
+        er_buffer.close()
+        # free memory
+        del buffer, er_buffer
+        # from here on only the trained agent is needed, the datasets act as checkpoints themselves
+        save_checkpoint(checkpoint, {"phase": "generate", "agent": agent})
 
     #####################################
-    # generate random transitions
+    # generate transitions from trained agent (fully), noisy trained agent (noisy) and random policy (random)
     #####################################
-    done, rng, n_actions  = True, np.random.default_rng(seed), env.action_space.n
-    for _ in tqdm(range(transitions), desc=f"Evaluate random policy ({envid}), run {run}"):
-        if done:
-            state = env.reset()
-
-        action = rng.integers(n_actions)
-        next_state, reward, done, _ = env.step(action)
-
-        random_buffer.add(state, action, reward, done)
-
-        state = next_state
-
-    os.makedirs(os.path.join("data", f"ex{experiment}"), exist_ok=True)
-    with open(os.path.join("data", f"ex{experiment}", f"{envid}_run{run}_random.pkl"), "wb") as f:
-        pickle.dump(random_buffer, f)
+    # each dataset type has its own copy of the agent, environment and seed, they can be generated in parallel
+    # worker processes with the same result. Inside a pool, train_online needs a NestablePool worker (e.g. run_jobs).
+    # An incomplete dataset is generated again from the start, its episodes depend on the state of the generator,
+    # the environments and the policy, which are not checkpointed.
+    jobs = [(experiment, envid, agent, buffer_type, transitions, batch_size, run, seed,
+             num_envs, async_envs, numpy_sim, chunk_size) for buffer_type in DATASET_POLICIES
+            if not (resume and dataset_complete(dataset_path(experiment, envid, run, buffer_type)))]
+    if parallel_datasets and len(jobs) > 0:
+        with Pool(len(jobs)) as p:
+            p.map(generate_dataset, jobs)
+    else:
+        for job in jobs:
+            generate_dataset(job)
 
     #####################################
     # generate mixed transitions (random + fully)
     #####################################
-    random_buffer.mix(buffer = final_policy_buffer, p_orig = 0.8)
-    os.makedirs(os.path.join("data", f"ex{experiment}"), exist_ok=True)
-    with open(os.path.join("data", f"ex{experiment}", f"{envid}_run{run}_mixed.pkl"), "wb") as f:
-        pickle.dump(random_buffer, f)
-
-    return agent
\ No newline at end of file
+    random_buffer = load_dataset(dataset_path(experiment, envid, run, "random"))
+    final_policy_buffer = load_dataset(dataset_path(experiment, envid, run, "fully"))
+    random_buffer.mixed(final_policy_buffer, p_orig=0.8).save(dataset_path(experiment, envid, run, "mixed"))
+
+    remove_checkpoint(checkpoint)
+
+    return agent
+
+
+def generate_dataset(args):
+    experiment, envid, agent, buffer_type, transitions, batch_size, run, seed, \
+        num_envs, async_envs, numpy_sim, chunk_size = args
+
+    # the datasets are generated with num_envs copies of the environment stepped together
+    vec_env = make_env(envid, num_envs=num_envs, asynchronous=async_envs, numpy_sim=numpy_sim)
+    # written to disk while collecting, whatever an interrupted run left behind is overwritten
+    dataset = DatasetWriter(dataset_path(experiment, envid, run, buffer_type), len(vec_env.observation_space.high),
+                            batch_size, chunk_size=chunk_size, codec=get_codec(vec_env))
+
+    # seeds only depend on the run seed and the dataset type, not on the order the datasets are generated in
+    entropy = [seed, list(DATASET_POLICIES).index(buffer_type)]
+    phase_seed = int(np.random.SeedSequence(entropy).generate_state(1)[0])
+    torch.manual_seed(phase_seed)
+    rng = np.random.default_rng(phase_seed)
+    vec_env.seed(phase_seed)
+
+    eps = DATASET_POLICIES[buffer_type]
+    if eps is None:
+        n_actions = vec_env.action_space.n
+        policy = lambda states: rng.integers(n_actions, size=len(states))
+    else:
+        # frozen copy of the agent, exploring with eps
+        agent = copy.deepcopy(agent)
+        agent.eval_eps, agent.rng = eps, rng
+        policy = lambda states: agent.policy_batch(states, eval=True)[0]
+
+    collect(vec_env, dataset, transitions, policy,
+            desc=f"Generate {buffer_type} dataset ({envid}), run {run}")
+    vec_env.close()
+
+    dataset.close()
+
+
+def train_async(agent, buffer, er_buffer, eval_env, writer, envid, transitions, actors, replay_ratio, sync_every,
+                train_start_iter, evaluate_every, mean_over, seed, desc=None):
+    """
+    Asynchronous variant of the training loop in train_online. Actor threads step `actors` environments with
+    copies of the agent that are synced every sync_every updates, the learner adds their transitions to the
+    buffers and trains on them. The learner keeps replay_ratio updates per environment step, and each actor may be
+    at most sync_every steps ahead of its share, so results stay comparable to the sequential loop (replay_ratio=1).
+    """
+    transition_queue = queue.SimpleQueue()
+    steps = [transitions // actors + (i < transitions % actors) for i in range(actors)]
+    workers = []
+    for i in range(actors):
+        env = make_env(envid)
+        env.seed(seed + i)
+        workers.append(Actor(i, env, agent, transition_queue, steps[i], seed=seed + i))
+
+    # per actor, transitions of the running episode. These are written to the buffers in one piece when the episode
+    # ends, so that the next state of a transition is always the following row (with one actor right away).
+    # The unfinished episode an actor ends with is followed by another actor's episode, its last transition is
+    # marked terminal.
+    episodes = [[] for _ in range(actors)]
+    ep_reward = [0] * actors
+    ep_stats = [RunningStats() for _ in range(actors)]
+    ep_rewards, all_rewards, all_dev_mean, all_dev_std = [], [], [], []
+    # steps received from the actors and written to the buffers
+    received, step, written, updates, ep, learner_time = 0, 0, [0] * actors, 0, 0, 0.
+
+    for worker in workers:
+        worker.allow(int(train_start_iter / actors) + sync_every)
+        worker.start()
+
+    with tqdm(total=transitions, desc=desc) as pbar:
+        while step < transitions:
+            for item in drain(transition_queue):
+                if item is None:
+                    raise RuntimeError("Actor failed") from next(w.error for w in workers if w.error is not None)
+
+                actor_id, state, action, reward, done, value, entropy = item
+                received += 1
+                episodes[actor_id].append((state, action, reward, done))
+                ep_reward[actor_id] += reward
+                ep_stats[actor_id].add(value, entropy)
+
+                # the last, unfinished episodes are written once the actors are done
+                last = workers[actor_id].steps - written[actor_id] == len(episodes[actor_id])
+                if done or actors == 1 or last:
+                    if last and actors > 1:
+                        episodes[actor_id][-1] = (state, action, reward, True)
+                    for transition in episodes[actor_id]:
+                        buffer.add(*transition)
+                        er_buffer.add(*transition)
+                    step += len(episodes[actor_id])
+                    written[actor_id] += len(episodes[actor_id])
+                    pbar.update(len(episodes[actor_id]))
+                    episodes[actor_id] = []
+
+                if done:
+                    ep += 1
+                    ep_rewards.append(ep_reward[actor_id])
+                    log_episode(writer, ep, ep_rewards, ep_stats[actor_id])
+                    ep_reward[actor_id] = 0
+                    ep_stats[actor_id].reset()
+
+            # catch up with the actors, the buffer has to hold enough transitions first. Until then, the actors
+            # continue their (possibly long) first episodes.
+            if step <= train_start_iter:
+                for worker in workers:
+                    worker.allow(int(received / actors) + sync_every)
+                continue
+            start = time.perf_counter()
+            while updates < replay_ratio * (received - train_start_iter):
+                agent.train(buffer, writer)
+                updates += 1
+
+                if updates % sync_every == 0:
+                    for worker in workers:
+                        worker.sync(agent)
+
+                # test agent on environment if executed greedily
+                if updates % evaluate_every == 0:
+                    all_rewards, all_dev_mean, all_dev_std = evaluate(eval_env, agent, writer, all_rewards,
+                                                                      all_dev_mean, all_dev_std,
+                                                                      over_episodes=mean_over)
+                    writer.add_scalar("async/Actor steps per second",
+                                      sum(worker.steps_per_second() for worker in workers), updates)
+                    writer.add_scalar("async/Learner updates per second", updates / max(learner_time, 1e-9), updates)
+            learner_time += time.perf_counter() - start
+
+            for worker in workers:
+                worker.allow(int((train_start_iter + updates / replay_ratio) / actors) + sync_every)
+
+    for worker in workers:
+        worker.close()
+
+    # throughput over the whole run
+    writer.add_scalar("async/Actor steps per second", sum(worker.steps_per_second() for worker in workers), updates)
+    writer.add_scalar("async/Learner updates per second", updates / max(learner_time, 1e-9), updates)
+
+
+def log_episode(writer, ep, ep_rewards, ep_stats):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        writer.add_scalar("train/Reward (SMA)", np.mean(ep_rewards[-100:]), ep)
+        writer.add_scalar("train/Reward", ep_rewards[-1], ep)
+        writer.add_scalar("train/Max-Action-Value (mean)", ep_stats.mean("action_values"), ep)
+        writer.add_scalar("train/Max-Action-Value (std)", ep_stats.std("action_values"), ep)
+        writer.add_scalar("train/Values", ep_stats.mean("values"), ep)
+        writer.add_scalar("train/Action-Values std", ep_stats.mean("values_std"), ep)
+        writer.add_scalar("train/Entropy", ep_stats.mean("entropies"), ep)
@@ -0,0 +1,93 @@
+import copy
+import time
+import queue
+import threading
+import numpy as np
+import torch.nn as nn
+
+
+class Actor(threading.Thread):
+    """
+    Steps its own environment with a copy of the learner's agent and puts every transition into a queue, as
+    (actor id, state, action, reward, done, value, entropy). The learner updates the copy's networks with sync().
+    Each actor explores with its own rng, so actors do not repeat each other's random actions. With allow(), the
+    learner limits the number of steps an actor may take, so the actors do not run ahead of the policy updates.
+    """
+    def __init__(self, actor_id, env, agent, transitions, steps, seed=None):
+        super(Actor, self).__init__(daemon=True)
+        self.actor_id = actor_id
+        self.env = env
+        self.transitions = transitions
+        self.steps = steps
+        self.rng = np.random.default_rng(seed)
+
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        # steps the actor may take, unlimited if None
+        self.allowed = None
+        self.allowed_changed = threading.Condition()
+        self.error = None
+        self.policy = copy.deepcopy(agent)
+        self.policy.rng = self.rng
+
+        # timing, in seconds and environment steps
+        self.start_time, self.end_time = None, None
+        self.done_steps = 0
+
+    def sync(self, agent):
+        # only the weights of the networks policy() uses and the iterations of the exploration schedule,
+        # optimizers and target networks are not needed by the actor
+        with self.lock:
+            for name, module in vars(self.policy).items():
+                if isinstance(module, nn.Module) and not name.endswith("_target"):
+                    module.load_state_dict(getattr(agent, name).state_dict())
+            if hasattr(agent, "iterations"):
+                self.policy.iterations = agent.iterations
+
+    def allow(self, steps):
+        with self.allowed_changed:
+            self.allowed = steps
+            self.allowed_changed.notify()
+
+    def close(self):
+        self.stop.set()
+        self.allow(None)
+        self.join()
+
+    def run(self):
+        try:
+            state, self.start_time = self.env.reset(), time.perf_counter()
+            for _ in range(self.steps):
+                with self.allowed_changed:
+                    while self.allowed is not None and self.done_steps >= self.allowed and not self.stop.is_set():
+                        self.allowed_changed.wait()
+                if self.stop.is_set():
+                    break
+                with self.lock:
+                    action, value, entropy = self.policy.policy(state)
+                next_state, reward, done, _ = self.env.step(action)
+                self.done_steps += 1
+                self.transitions.put((self.actor_id, state, action, reward, done, value, entropy))
+
+                state = self.env.reset() if done else next_state
+            self.end_time = time.perf_counter()
+        except Exception as e:
+            self.error = e
+            # wake up the learner, it re-raises the error
+            self.transitions.put(None)
+
+    def steps_per_second(self):
+        if self.start_time is None:
+            return 0.
+        end_time = time.perf_counter() if self.end_time is None else self.end_time
+        return self.done_steps / max(end_time - self.start_time, 1e-9)
+
+
+def drain(transitions, block=True):
+    # everything currently in the queue, waits for at least one item if block
+    items = [transitions.get()] if block else []
+    while True:
+        try:
+            items.append(transitions.get_nowait())
+        except queue.Empty:
+            return items
@@ -1,12 +1,35 @@
+import os
+import json
+import hashlib
+import pickle
+import tempfile
 import numpy as np
 import torch
+from .codec import AffineCodec
+
+
+# how indices are drawn in ReplayBuffer.sample:
+#   choice    - without replacement via rng.choice over the whole window, O(buffer_size) per batch
+#   uniform   - with replacement, O(batch_size) per batch
+#   rejection - without replacement, redraws duplicates, O(batch_size) per batch for batch_size << buffer_size
+SAMPLERS = ["choice", "uniform", "rejection"]
+
+# fields written by ReplayBuffer.save, everything else is rebuilt from the header
+FIELDS = ["state", "action", "reward", "not_done"]
+HEADER = "header.json"
+
+# rows a ReplayBuffer allocates at first, it grows geometrically up to buffer_size as transitions are added
+INITIAL_ROWS = 1024
 
 
 class ReplayBuffer():
 
-    def __init__(self, obs_space, buffer_size, batch_size, seed=None):
+    def __init__(self, obs_space, buffer_size, batch_size, seed=None, on_device=False, sampler="choice", codec=None):
+        assert sampler in SAMPLERS, f"sampler must be one of {SAMPLERS}, is {sampler}"
+
         self.buffer_size = buffer_size
         self.batch_size = batch_size
+        self.sampler = sampler
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
 
         self.rng = np.random.default_rng(seed=seed)
@@ -14,37 +37,108 @@ class ReplayBuffer():
         self.idx = 0
         self.current_size = 0
 
-        self.state = np.zeros((self.buffer_size + 1, obs_space), dtype=np.float32)
-        self.action = np.zeros((self.buffer_size + 1, 1), dtype=np.uint8)
-        self.reward = np.zeros((self.buffer_size, 1))
-        self.not_done = np.zeros((self.buffer_size, 1), dtype=np.bool_)
-
-        # probas is uniform until updated by experiments
-        self.probas = np.ones((self.buffer_size)) / self.buffer_size
+        # states are stored compressed if the environment provides a codec, see utils.get_codec
+        self.codec = codec
+        # the arrays hold the first rows of the buffer's capacity, the rest is allocated as the buffer fills up.
+        # States and actions keep one more row, for the next state of the last transition
+        self.capacity = buffer_size
+        rows = min(buffer_size, INITIAL_ROWS)
+        self.state = np.zeros((rows + 1, obs_space), dtype=np.float32 if codec is None else codec.dtype)
+        self.action = np.zeros((rows + 1, 1), dtype=np.uint8)
+        self.reward = np.zeros((rows, 1))
+        self.not_done = np.zeros((rows, 1), dtype=np.bool_)
+
+        # probas is uniform until updated by experiments, created on first use
+        self._probas = None
+
+        # optional torch copies of all fields, kept on the device for sampling
+        self.on_device = False
+        self.tensors = None
+        if on_device:
+            self.to_device()
+
+    def __getstate__(self):
+        # tensors are rebuilt from the numpy arrays, datasets on disk stay the same
+        state = self.__dict__.copy()
+        state["tensors"] = None
+        return state
+
+    def __setstate__(self, state):
+        # datasets pickled before device storage existed lack these attributes
+        state.setdefault("on_device", False)
+        state.setdefault("tensors", None)
+        state.setdefault("sampler", "choice")
+        state.setdefault("codec", None)
+        state.setdefault("capacity", len(state["reward"]))
+        state["_probas"] = state.pop("probas", state.get("_probas"))
+        self.__dict__.update(state)
+        self._sync_tensors()
+
+    @property
+    def probas(self):
+        if self._probas is None:
+            self._probas = np.ones((self.capacity)) / self.capacity
+        return self._probas
+
+    @probas.setter
+    def probas(self, probas):
+        self._probas = probas
+
+    def _reserve(self, rows):
+        # grows the arrays to at least rows transitions, doubling their size to keep adding amortised O(1)
+        allocated = len(self.reward)
+        if rows <= allocated:
+            return
+        rows = min(self.capacity, max(rows, 2 * allocated))
+        for field in FIELDS:
+            array = getattr(self, field)
+            grown = np.zeros((rows + len(array) - allocated, ) + array.shape[1:], dtype=array.dtype)
+            grown[:len(array)] = array
+            setattr(self, field, grown)
+        self._sync_tensors()
+
+    def _rows(self, field):
+        # rows of a field over the whole capacity, as saved
+        return self.capacity + 1 if field in ("state", "action") else self.capacity
 
     def add(self, state, action, reward, done):
+        if self.codec is not None:
+            state = self.codec.encode(state)
 
+        if self.idx >= len(self.reward):
+            self._reserve(self.idx + 1)
         self.state[self.idx] = state
         self.action[self.idx] = action
         self.reward[self.idx] = reward
         self.not_done[self.idx] = not done
 
+        if self.on_device:
+            self.tensors["state"][self.idx] = torch.as_tensor(state, dtype=self.tensors["state"].dtype)
+            self.tensors["action"][self.idx] = int(action)
+            self.tensors["reward"][self.idx] = float(reward)
+            self.tensors["not_done"][self.idx] = float(not done)
+
         self.idx = (self.idx + 1) % self.buffer_size
         self.current_size = min(self.current_size + 1, self.buffer_size)
 
     def sample(self, minimum=None, maximum=None, use_probas=False, use_remaining_reward=False, give_next_action=False):
 
-        # we can set custom min/max to e.g. iterate over the dataset
-        if minimum != None and maximum != None:
-            ind = np.arange(minimum, maximum)
-        else:
-            ind = np.arange(0, self.current_size)
+        ind = self._sample_indices(minimum, maximum, use_probas)
+        return self._gather(ind, use_remaining_reward, give_next_action)
 
-        # we can use custom sampling probabilities
-        if use_probas:
-            ind = self.rng.choice(ind, size=self.batch_size, replace=False, p=self.probas)
-        else:
-            ind = self.rng.choice(ind, size=self.batch_size, replace=False)
+    def sample_many(self, k, minimum=None, maximum=None, use_probas=False, use_remaining_reward=False,
+                    give_next_action=False):
+        # k batches in one gather, every field as a contiguous [k, batch_size, ...] block
+        ind = self._sample_indices_many(k, minimum, maximum, use_probas)
+        return self._gather_many(ind, use_remaining_reward, give_next_action)
+
+    def _gather_many(self, ind, use_remaining_reward=False, give_next_action=False):
+        batch = self._gather(ind.reshape(-1), use_remaining_reward, give_next_action)
+        return tuple(field.view(ind.shape + field.shape[1:]) for field in batch)
+
+    def _gather(self, ind, use_remaining_reward=False, give_next_action=False):
+        if self.on_device:
+            return self._gather_tensors(ind, use_remaining_reward, give_next_action)
 
         if use_remaining_reward:
             reward = self.remaining_reward[ind]
@@ -52,25 +146,203 @@ class ReplayBuffer():
             reward = self.reward[ind]
 
         if give_next_action:
-            return (torch.FloatTensor(self.state[ind]).to(self.device),
+            return (torch.FloatTensor(self._decode(self.state[ind])).to(self.device),
                     torch.LongTensor(self.action[ind]).to(self.device),
-                    torch.FloatTensor(self.state[ind+1]).to(self.device),
+                    torch.FloatTensor(self._decode(self.state[ind+1])).to(self.device),
                     torch.LongTensor(self.action[ind+1]).to(self.device),
                     torch.FloatTensor(reward).to(self.device),
                     torch.FloatTensor(self.not_done[ind]).to(self.device)
                     )
 
         else:
-            return (torch.FloatTensor(self.state[ind]).to(self.device),
+            return (torch.FloatTensor(self._decode(self.state[ind])).to(self.device),
                     torch.LongTensor(self.action[ind]).to(self.device),
-                    torch.FloatTensor(self.state[ind+1]).to(self.device),
+                    torch.FloatTensor(self._decode(self.state[ind+1])).to(self.device),
                     torch.FloatTensor(reward).to(self.device),
                     torch.FloatTensor(self.not_done[ind]).to(self.device)
                     )
 
+    def _decode(self, state):
+        return state if self.codec is None else self.codec.decode(state)
+
+    def decoded_state(self):
+        # all states as float32, like the agents get them from sample
+        return self._decode(self.state)
+
+    def _sample_indices(self, minimum, maximum, use_probas):
+        # we can set custom min/max to e.g. iterate over the dataset
+        if minimum != None and maximum != None:
+            low, high = minimum, maximum
+        else:
+            low, high = 0, self.current_size
+
+        # we can use custom sampling probabilities, renormalised to the window
+        if use_probas:
+            p = self.probas[low:high]
+            return self.rng.choice(np.arange(low, high), size=self.batch_size, replace=False, p=p / np.sum(p))
+
+        if self.sampler == "uniform":
+            return self.rng.integers(low, high, size=self.batch_size)
+        # rejection only pays off if duplicates are rare, otherwise fall back to a full permutation
+        if self.sampler == "rejection" and 2 * self.batch_size <= high - low:
+            return self._rejection_sample(low, high)
+
+        return self.rng.choice(np.arange(low, high), size=self.batch_size, replace=False)
+
+    def _sample_indices_many(self, k, minimum, maximum, use_probas):
+        # (k, batch_size) indices, every row is a batch on its own
+        if minimum != None and maximum != None:
+            low, high = minimum, maximum
+        else:
+            low, high = 0, self.current_size
+
+        if not use_probas and self.sampler == "uniform":
+            return self.rng.integers(low, high, size=(k, self.batch_size))
+        if not use_probas and self.sampler == "rejection" and 2 * self.batch_size <= high - low:
+            return self._rejection_sample(low, high, k)
+
+        # full permutations and priorities are drawn batch by batch
+        return np.stack([self._sample_indices(minimum, maximum, use_probas) for _ in range(k)])
+
+    def _rejection_sample(self, low, high, k=None):
+        ind = self.rng.integers(low, high, size=(1 if k is None else k, self.batch_size))
+        while True:
+            # a stable sort keeps the first occurrence of an index in front of its repetitions
+            order = np.argsort(ind, axis=1, kind="stable")
+            sorted_ind = np.take_along_axis(ind, order, axis=1)
+            repeated = np.zeros(ind.shape, dtype=np.bool_)
+            repeated[:, 1:] = sorted_ind[:, 1:] == sorted_ind[:, :-1]
+            if not np.any(repeated):
+                return ind[0] if k is None else ind
+            # redraw every repeated index after its first occurrence, in its own batch
+            duplicate = np.zeros(ind.shape, dtype=np.bool_)
+            np.put_along_axis(duplicate, order, repeated, axis=1)
+            ind[duplicate] = self.rng.integers(low, high, size=np.count_nonzero(duplicate))
+
+    def _gather_tensors(self, ind, use_remaining_reward, give_next_action):
+        # one index_select per field, no numpy -> torch conversion of the batch
+        ind = torch.from_numpy(ind).to(self.device)
+        next_ind = ind + 1
+
+        reward = self.tensors["remaining_reward"] if use_remaining_reward else self.tensors["reward"]
+
+        state, next_state = self.tensors["state"].index_select(0, ind), self.tensors["state"].index_select(0, next_ind)
+        if self.codec is not None:
+            state, next_state = self.tensors["lut"][state.long()], self.tensors["lut"][next_state.long()]
+
+        batch = (state,
+                 self.tensors["action"].index_select(0, ind),
+                 next_state)
+        if give_next_action:
+            batch += (self.tensors["action"].index_select(0, next_ind), )
+
+        return batch + (reward.index_select(0, ind),
+                        self.tensors["not_done"].index_select(0, ind))
+
+    def to_device(self, device=None):
+        # store all fields as preallocated float32/int64 tensors on the device, sampling then only gathers
+        if device is not None:
+            self.device = device
+        self.on_device = True
+        self._sync_tensors()
+
+    def _sync_tensors(self):
+        # (re)build the torch copies after the numpy arrays have been replaced
+        if not self.on_device:
+            return
+
+        # encoded states stay uint8 on the device and are decoded after the gather
+        self.tensors = {
+            "state": as_tensor(self.state, torch.float32 if self.codec is None else torch.uint8, self.device),
+            "action": as_tensor(self.action, torch.int64, self.device),
+            "reward": as_tensor(self.reward, torch.float32, self.device),
+            "not_done": as_tensor(self.not_done, torch.float32, self.device)
+        }
+        if self.codec is not None:
+            self.tensors["lut"] = as_tensor(self.codec.lut, torch.float32, self.device)
+        if hasattr(self, "remaining_reward"):
+            self.tensors["remaining_reward"] = as_tensor(self.remaining_reward, torch.float32, self.device)
+
+    def save(self, path):
+        # one raw binary file per field plus a small json header, can be memory mapped by ReplayBuffer.open
+        os.makedirs(path, exist_ok=True)
+
+        header = self.header()
+        for field in FIELDS:
+            array = getattr(self, field)
+            with open(os.path.join(path, f"{field}.bin"), "wb") as f:
+                np.ascontiguousarray(array).tofile(f)
+                # rows that were never allocated are zeros
+                f.truncate(self._rows(field) * array[:1].nbytes)
+
+        write_header(path, header)
+
+    @classmethod
+    def open(cls, path, mmap=True, seed=None):
+        # with mmap the fields are read-only views on the files, shared through the page cache between processes
+        with open(os.path.join(path, HEADER), "r") as f:
+            header = json.load(f)
+
+        fields = {}
+        for field, spec in header["fields"].items():
+            file, shape = os.path.join(path, f"{field}.bin"), tuple(spec["shape"])
+            # files of a dataset that is being written may be longer than the header says
+            if mmap:
+                fields[field] = np.memmap(file, dtype=np.dtype(spec["dtype"]), mode="r", shape=shape)
+            else:
+                fields[field] = np.fromfile(file, dtype=np.dtype(spec["dtype"]),
+                                            count=int(np.prod(shape))).reshape(shape)
+
+        return cls.from_fields(header, fields, seed=seed)
+
+    @classmethod
+    def from_fields(cls, header, fields, seed=None):
+        # build a buffer around existing arrays (e.g. memory mapped or shared), described by a header from save
+        state = {key: header[key] for key in ["buffer_size", "batch_size", "idx", "current_size"]}
+        state["device"] = "cuda" if torch.cuda.is_available() else "cpu"
+        state["rng"] = np.random.default_rng(seed=seed)
+        state["capacity"] = header["fields"]["reward"]["shape"][0]
+        state["codec"] = AffineCodec.from_dict(header["codec"]) if "codec" in header else None
+        state.update(fields)
+
+        buffer = cls.__new__(cls)
+        buffer.__setstate__(state)
+        return buffer
+
+    def header(self):
+        header = {"buffer_size": self.buffer_size, "batch_size": self.batch_size,
+                  "idx": self.idx, "current_size": self.current_size, "fields": {}}
+        for field in FIELDS:
+            array = getattr(self, field)
+            header["fields"][field] = {"dtype": array.dtype.str, "shape": [self._rows(field)] + list(array.shape[1:])}
+        if self.codec is not None:
+            header["codec"] = self.codec.to_dict()
+        return header
+
     def set_seed(self, seed):
         self.rng = np.random.default_rng(seed=seed)
 
+    def _parts(self, field):
+        # the stored rows of a field, states and actions keep one more row for the last next state
+        rows = self.current_size + 1 if field in ("state", "action") else self.current_size
+        return [getattr(self, field)[:rows]]
+
+    def checksum(self):
+        # sha1 of the stored transitions and the way states are stored, identifies the dataset's content
+        key = hashlib.sha1()
+        for field in FIELDS:
+            parts = self._parts(field)
+            key.update(parts[0].dtype.str.encode())
+            for part in parts:
+                key.update(np.ascontiguousarray(part).tobytes())
+        if self.codec is not None:
+            key.update(json.dumps(self.codec.to_dict(), sort_keys=True).encode())
+        return key.hexdigest()
+
+    def update_priorities(self, priorities, ind=None):
+        # plain buffers keep their fixed probas, see PrioritizedReplayBuffer
+        pass
+
     def subset(self, minimum, maximum, retain_last=True):
         add = 1 if retain_last else 0
         self.state = self.state[minimum:maximum+add]
@@ -80,8 +352,12 @@ class ReplayBuffer():
 
         self.idx = 0
         self.current_size = maximum - minimum
+        self.capacity = len(self.reward)
+
+        self._sync_tensors()
 
     def rand_subset(self, samples):
+        self._reserve(self.capacity)
         ind = np.arange(0, self.buffer_size)
         ind = self.rng.choice(ind, size=samples, replace=False)
 
@@ -95,12 +371,17 @@ class ReplayBuffer():
 
         self.idx = 0
         self.current_size = samples
+        self.capacity = len(self.reward)
+
+        self._sync_tensors()
 
     def mix(self, buffer, p_orig=0.5):
         # check if target buffer is big enough
         assert self.current_size >= buffer.current_size, \
             f"Target buffer too small, must be >= {self.current_size}, is {buffer.current_size}"
 
+        assert self.codec == buffer.codec, f"Buffers store states differently, {self.codec} and {buffer.codec}"
+
         buffer.subset(int(self.current_size * p_orig), self.current_size)
         self.subset(0, int(self.current_size * p_orig), retain_last=False)
 
@@ -110,19 +391,446 @@ class ReplayBuffer():
         self.not_done = np.concatenate((self.not_done, buffer.not_done), axis=0)
 
         self.current_size += buffer.current_size
+        self.capacity = len(self.reward)
+
+        self._sync_tensors()
+
+    def view(self, minimum, maximum):
+        # like subset, but leaves this buffer untouched and copies nothing
+        return BufferView([(self, minimum, maximum)], self.batch_size, sampler=self.sampler)
+
+    def mixed(self, buffer, p_orig=0.5):
+        # same composition as mix, as a view on both buffers instead of a concatenated copy
+        assert self.current_size >= buffer.current_size, \
+            f"Target buffer too small, must be >= {self.current_size}, is {buffer.current_size}"
+
+        split = int(self.current_size * p_orig)
+        return BufferView([(self, 0, split), (buffer, split, self.current_size)], self.batch_size,
+                          sampler=self.sampler)
 
     #####################################
     # Special functions for experiments #
     #####################################
 
-    def calc_remaining_reward(self, discount=1):
-        self.remaining_reward = np.zeros_like(self.reward)
+    def calc_remaining_reward(self, discount=1, cache_dir=None):
+        # results are cached on disk per dataset content and discount, if a cache_dir is given
+        self.remaining_reward = cached_reward_to_go(self.reward, self.not_done, discount, cache_dir)
+        self._sync_tensors()
+
+
+def cached_reward_to_go(reward, not_done, discount, cache_dir=None):
+    # discounted_reward_to_go, loaded from / saved to cache_dir if given
+    if cache_dir is None:
+        return discounted_reward_to_go(reward, not_done, discount)
+
+    key = hashlib.sha1()
+    for array in [reward, not_done]:
+        key.update(np.ascontiguousarray(array).tobytes())
+    key.update(repr(discount).encode())
+    file = os.path.join(cache_dir, f"remaining_reward_{key.hexdigest()}.npy")
+    if os.path.isfile(file):
+        return np.load(file)
+
+    remaining = discounted_reward_to_go(reward, not_done, discount)
+    os.makedirs(cache_dir, exist_ok=True)
+    # a temporary file per writer, several processes may compute the same result at once
+    with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".tmp", delete=False) as f:
+        np.save(f, remaining)
+    os.replace(f.name, file)
+    return remaining
+
+
+def discounted_reward_to_go(reward, not_done, discount):
+    """
+    remaining[i] = reward[i] + discount * remaining[i+1], restarting at every episode end and at the end of the data.
+    Transitions are updated in groups of equal distance to their episode end, so the python loop runs over the
+    longest episode instead of the whole dataset. Every element sees the same float operations as the sequential
+    reverse loop, results are bit-identical.
+    """
+    remaining = np.zeros_like(reward)
+    if len(not_done) == 0:
+        return remaining
+
+    ends = np.invert(np.asarray(not_done, dtype=np.bool_).reshape(-1))
+    ends[-1] = True
+
+    # distance of every transition to the end of its episode
+    positions = np.arange(len(ends))
+    end_positions = np.flatnonzero(ends)
+    distance = end_positions[np.searchsorted(end_positions, positions)] - positions
+
+    order = np.argsort(distance, kind="stable")
+    groups = np.split(order, np.cumsum(np.bincount(distance))[:-1])
+
+    remaining[groups[0]] = reward[groups[0]]
+    for ind in groups[1:]:
+        remaining[ind] = reward[ind] + discount * remaining[ind + 1]
+
+    return remaining
+
+
+class BufferView(ReplayBuffer):
+    """
+    Read-only dataset composed of (buffer, minimum, maximum) segments, nothing is copied.
+    Sampled global indices are translated to the segments. The view is laid out like the result of mix(): the last
+    transition of a segment continues into the first row of the next segment, for sampling as well as in the copies
+    from save() (on disk) and materialize() (a plain ReplayBuffer).
+    """
+    def __init__(self, segments, batch_size, seed=None, sampler="choice"):
+        self.segments = segments
+        self.offsets = np.cumsum([0] + [maximum - minimum for _, minimum, maximum in segments])
+
+        self.buffer_size = int(self.offsets[-1])
+        self.current_size = self.buffer_size
+        self.batch_size = batch_size
+        self.sampler = sampler
+        self.idx = 0
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.rng = np.random.default_rng(seed=seed)
+
+        self.on_device = False
+        self.tensors = None
+
+        codecs = [buffer.codec for buffer, _, _ in segments]
+        assert all(codec == codecs[0] for codec in codecs), f"Segments store states differently, {codecs}"
+        self.codec = codecs[0]
+
+    def _sample_indices(self, minimum, maximum, use_probas):
+        assert not use_probas, "BufferView has no sampling probabilities, materialize it first"
+        return super(BufferView, self)._sample_indices(minimum, maximum, use_probas)
+
+    def _gather(self, ind, use_remaining_reward=False, give_next_action=False):
+        segment = np.searchsorted(self.offsets, ind, side="right") - 1
+
+        positions, batches = [], []
+        for s, (buffer, minimum, _) in enumerate(self.segments):
+            mask = segment == s
+            if np.any(mask):
+                positions.append(np.flatnonzero(mask))
+                batches.append(buffer._gather(ind[mask] - self.offsets[s] + minimum, False, give_next_action))
+
+        # back to the sampled order
+        inverse = torch.from_numpy(np.argsort(np.concatenate(positions)))
+        batch = [torch.cat(fields)[inverse.to(fields[0].device)] for fields in zip(*batches)]
+
+        # next state (and action) of the last transition of a segment are the first row of the next segment
+        for s, (buffer, minimum, _) in enumerate(self.segments[1:]):
+            last = torch.from_numpy(np.flatnonzero(ind == self.offsets[s + 1] - 1))
+            if len(last) > 0:
+                first = buffer._gather(np.array([minimum]), False, give_next_action)
+                batch[2][last.to(batch[2].device)] = first[0]
+                if give_next_action:
+                    batch[3][last.to(batch[3].device)] = first[1]
+
+        # reward is the second to last field
+        if use_remaining_reward:
+            batch[-2] = torch.FloatTensor(self.remaining_reward[ind]).to(self.device)
+
+        return tuple(batch)
+
+    def _parts(self, field):
+        # the field's slices in order, states and actions keep one more row for the last next state
+        parts = [getattr(buffer, field)[minimum:maximum] for buffer, minimum, maximum in self.segments]
+        if field in ("state", "action"):
+            buffer, _, maximum = self.segments[-1]
+            parts.append(getattr(buffer, field)[maximum:maximum + 1])
+        return parts
+
+    def header(self):
+        header = {"buffer_size": self.buffer_size, "batch_size": self.batch_size,
+                  "idx": self.idx, "current_size": self.current_size, "fields": {}}
+        for field in FIELDS:
+            parts = self._parts(field)
+            dtypes = set(part.dtype.str for part in parts)
+            assert len(dtypes) == 1, f"Segments store {field} with different dtypes {dtypes}"
+            header["fields"][field] = {"dtype": dtypes.pop(),
+                                       "shape": [sum(len(part) for part in parts)] + list(parts[0].shape[1:])}
+        if self.codec is not None:
+            header["codec"] = self.codec.to_dict()
+        return header
+
+    def save(self, path):
+        # streams one segment after the other into the files, the concatenation never exists in memory
+        os.makedirs(path, exist_ok=True)
+
+        header = self.header()
+        for field in FIELDS:
+            with open(os.path.join(path, f"{field}.bin"), "wb") as f:
+                for part in self._parts(field):
+                    np.ascontiguousarray(part).tofile(f)
+
+        write_header(path, header)
+
+    def materialize(self):
+        fields = {field: np.concatenate(self._parts(field), axis=0) for field in FIELDS}
+        buffer = ReplayBuffer.from_fields(self.header(), fields)
+        buffer.batch_size, buffer.sampler, buffer.rng = self.batch_size, self.sampler, self.rng
+        return buffer
+
+    def view(self, minimum, maximum):
+        segments = []
+        for (buffer, lower, upper), offset in zip(self.segments, self.offsets):
+            lower, upper = max(lower, lower + minimum - offset), min(upper, lower + maximum - offset)
+            if lower < upper:
+                segments.append((buffer, lower, upper))
+        return BufferView(segments, self.batch_size, sampler=self.sampler)
+
+    def calc_remaining_reward(self, discount=1, cache_dir=None):
+        # only reward and not_done are concatenated, the states stay in their buffers
+        reward, not_done = [np.concatenate(self._parts(field), axis=0) for field in ["reward", "not_done"]]
+        self.remaining_reward = cached_reward_to_go(reward, not_done, discount, cache_dir)
+
+    def add(self, state, action, reward, done):
+        raise NotImplementedError("BufferView is read-only")
+
+    def to_device(self, device=None):
+        raise NotImplementedError("BufferView is read-only, materialize it first")
+
+    def subset(self, minimum, maximum, retain_last=True):
+        raise NotImplementedError("BufferView is read-only, use view instead")
+
+    def rand_subset(self, samples):
+        raise NotImplementedError("BufferView is read-only, materialize it first")
+
+    def mix(self, buffer, p_orig=0.5):
+        raise NotImplementedError("BufferView is read-only, use mixed instead")
+
+
+class DatasetWriter():
+    """
+    Writes a dataset (see ReplayBuffer.save) while its transitions are produced, only chunk_size of them are kept in
+    memory. Full chunks are appended to the field files, then the header is rewritten, so the directory always holds
+    a valid dataset of everything written so far, which load_dataset opens as one buffer. close() marks it complete.
+    With resume, an incomplete dataset is continued after its last complete episode. A pickled DatasetWriter
+    (e.g. in a checkpoint) continues from its own state after truncate() cut the files back to it.
+    """
+    def __init__(self, path, obs_space, batch_size, chunk_size=10000, codec=None, resume=False):
+        self.path = path
+        self.complete = False
+        self.written = 0
+        # encodes and holds the transitions of the current chunk
+        self.chunk = ReplayBuffer(obs_space, chunk_size, batch_size, codec=codec)
+        os.makedirs(path, exist_ok=True)
+
+        if resume and os.path.isfile(os.path.join(path, HEADER)):
+            not_done = ReplayBuffer.open(path).not_done[:, 0]
+            ends = np.flatnonzero(~not_done)
+            self.written = int(ends[-1]) + 1 if len(ends) > 0 else 0
+            self.truncate()
+        elif os.path.isfile(os.path.join(path, HEADER)):
+            # not a dataset until the first chunk is written
+            os.remove(os.path.join(path, HEADER))
+
+    @property
+    def current_size(self):
+        return self.written + self.chunk.current_size
+
+    def add(self, state, action, reward, done):
+        self.chunk.add(state, action, reward, done)
+        if self.chunk.current_size == self.chunk.buffer_size:
+            self.flush()
+
+    def flush(self):
+        n = self.chunk.current_size
+        if n == 0:
+            return
+        # the rows after the written ones are overwritten, states and actions end with an empty row for the
+        # next state of the last transition, like in a full ReplayBuffer
+        for field in FIELDS:
+            array = getattr(self.chunk, field)
+            file = os.path.join(self.path, f"{field}.bin")
+            with open(file, "r+b" if os.path.isfile(file) else "wb") as f:
+                f.seek(self.written * array[:1].nbytes)
+                np.ascontiguousarray(array[:n]).tofile(f)
+                if field in ("state", "action"):
+                    np.zeros_like(array[:1]).tofile(f)
+                f.truncate()
+
+        self.written += n
+        self.chunk.idx, self.chunk.current_size = 0, 0
+        write_header(self.path, self.header())
+
+    def close(self):
+        self.flush()
+        self.complete = True
+        write_header(self.path, self.header())
+
+    def header(self):
+        header = {"buffer_size": self.written, "batch_size": self.chunk.batch_size,
+                  "idx": 0, "current_size": self.written, "fields": {}, "complete": self.complete}
+        for field in FIELDS:
+            array = getattr(self.chunk, field)
+            rows = self.written + 1 if field in ("state", "action") else self.written
+            header["fields"][field] = {"dtype": array.dtype.str, "shape": [rows] + list(array.shape[1:])}
+        if self.chunk.codec is not None:
+            header["codec"] = self.chunk.codec.to_dict()
+        return header
+
+    def truncate(self):
+        # drops everything on disk after the written transitions, the current chunk is kept
+        if self.written == 0:
+            if os.path.isfile(os.path.join(self.path, HEADER)):
+                os.remove(os.path.join(self.path, HEADER))
+            return
+        for field in FIELDS:
+            array = getattr(self.chunk, field)
+            rows = self.written + 1 if field in ("state", "action") else self.written
+            with open(os.path.join(self.path, f"{field}.bin"), "r+b") as f:
+                f.truncate(rows * array[:1].nbytes)
+        write_header(self.path, self.header())
+
+
+class SumTree():
+    """
+    Complete binary tree in a flat array, every node holds the sum of its two children and the leaves hold
+    the priorities. Sampling, prefix sums and updates take O(log N) and are vectorised over batches.
+    """
+    def __init__(self, size):
+        self.size = size
+        # capacity > size, so that prefix(size) still addresses a leaf
+        self.depth = size.bit_length()
+        # root at index 1, leaves at [capacity, 2 * capacity)
+        self.capacity = 1 << self.depth
+        self.nodes = np.zeros(2 * self.capacity)
+
+    def total(self):
+        return self.nodes[1]
+
+    def update(self, ind, priorities):
+        nodes = np.asarray(ind) + self.capacity
+        self.nodes[nodes] = priorities
+
+        # recompute the parents from their children instead of adding deltas, no drift over many updates
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+
+    def prefix(self, ind):
+        # sum of all leaves before ind
+        nodes = np.asarray(ind) + self.capacity
+        total = np.zeros(nodes.shape)
+        for _ in range(self.depth):
+            # right children add the sum of their left sibling
+            total += np.where(nodes % 2 == 1, self.nodes[nodes - 1], 0.)
+            nodes //= 2
+        return total
+
+    def find(self, values):
+        # index of the leaf in which each value falls when all leaves are laid out one after another
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(values.shape, dtype=np.int64)
+        for _ in range(self.depth):
+            left = self.nodes[2 * nodes]
+            right = values >= left
+            values -= np.where(right, left, 0.)
+            nodes = 2 * nodes + right
+        return nodes - self.capacity
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    ReplayBuffer whose use_probas path samples proportional to priorities from a SumTree, in O(log N) per index.
+    Agents feed TD-errors back through update_priorities, which sets the priorities of the last sampled batch
+    to (|td-error| + eps) ** alpha. New transitions get the highest priority seen so far.
+    """
+    def __init__(self, obs_space, buffer_size, batch_size, seed=None, alpha=0.6, eps=1e-6, **kwargs):
+        super(PrioritizedReplayBuffer, self).__init__(obs_space, buffer_size, batch_size, seed=seed, **kwargs)
+
+        self.alpha = alpha
+        self.eps = eps
+        self.reset_priorities()
+
+    @classmethod
+    def from_buffer(cls, buffer, alpha=0.6, eps=1e-6):
+        # shares the arrays of a loaded dataset, every transition starts with the same priority
+        prioritized = cls.__new__(cls)
+        prioritized.__dict__.update(buffer.__dict__)
+        prioritized.alpha = alpha
+        prioritized.eps = eps
+        prioritized.reset_priorities()
+        return prioritized
+
+    def reset_priorities(self):
+        self.tree = SumTree(self.capacity)
+        self.max_priority = 1.
+        self.tree.update(np.arange(self.current_size), self.max_priority)
+        self.last_ind = None
+
+    def add(self, state, action, reward, done):
+        self.tree.update([self.idx], self.max_priority)
+        super(PrioritizedReplayBuffer, self).add(state, action, reward, done)
+
+    def _sample_indices(self, minimum, maximum, use_probas):
+        if not use_probas:
+            return super(PrioritizedReplayBuffer, self)._sample_indices(minimum, maximum, use_probas)
+
+        if minimum != None and maximum != None:
+            low, high = minimum, maximum
+        else:
+            low, high = 0, self.current_size
+
+        # stratified: one draw from each of batch_size equal parts of the window's priority mass
+        lower, upper = self.tree.prefix(np.array([low, high]))
+        bounds = np.linspace(lower, upper, self.batch_size + 1)
+        values = self.rng.uniform(bounds[:-1], bounds[1:])
+
+        # guard against rounding at the window borders
+        self.last_ind = np.clip(self.tree.find(values), low, high - 1)
+        return self.last_ind
+
+    def update_priorities(self, priorities, ind=None):
+        ind = self.last_ind if ind is None else ind
+        priorities = (np.abs(np.asarray(priorities, dtype=np.float64).reshape(-1)) + self.eps) ** self.alpha
+
+        self.tree.update(ind, priorities)
+        self.max_priority = max(self.max_priority, np.max(priorities))
+
+    def subset(self, minimum, maximum, retain_last=True):
+        super(PrioritizedReplayBuffer, self).subset(minimum, maximum, retain_last)
+        self.reset_priorities()
+
+    def rand_subset(self, samples):
+        super(PrioritizedReplayBuffer, self).rand_subset(samples)
+        self.reset_priorities()
+
+    def mix(self, buffer, p_orig=0.5):
+        super(PrioritizedReplayBuffer, self).mix(buffer, p_orig)
+        self.reset_priorities()
+
+
+def as_tensor(array, dtype, device):
+    # torch refuses to share read-only memory (e.g. memory mapped datasets), copy those
+    if not array.flags.writeable:
+        array = np.array(array)
+    return torch.as_tensor(array, dtype=dtype, device=device)
+
+
+def write_header(path, header):
+    # header is written last and atomically, a directory without it is not a dataset
+    with open(os.path.join(path, HEADER + ".tmp"), "w") as f:
+        json.dump(header, f, indent=4)
+    os.replace(os.path.join(path, HEADER + ".tmp"), os.path.join(path, HEADER))
+
+
+def dataset_complete(path):
+    # a dataset that is still being written (see DatasetWriter) is not complete
+    if not os.path.isfile(os.path.join(path, HEADER)):
+        return False
+    with open(os.path.join(path, HEADER), "r") as f:
+        return json.load(f).get("complete", True)
+
+
+def load_dataset(path, mmap=True):
+    # prefer the directory format, fall back to datasets pickled before it existed
+    if os.path.isfile(os.path.join(path, HEADER)):
+        return ReplayBuffer.open(path, mmap=mmap)
+
+    with open(path + ".pkl", "rb") as f:
+        return pickle.load(f)
 
-        cum_reward = 0
-        for i, d in reversed(list(enumerate(self.not_done))):
-            if not d:
-                cum_reward = 0
-            cum_reward = cum_reward + self.reward[i]
-            self.remaining_reward[i] = cum_reward
-            cum_reward *= discount
 
+def convert_dataset(path):
+    # converts the pickled dataset at path + '.pkl' to the directory format at path
+    with open(path + ".pkl", "rb") as f:
+        buffer = pickle.load(f)
+    buffer.save(path)
@@ -0,0 +1,39 @@
+import os
+import glob
+import json
+import hashlib
+import functools
+from .checkpoint import save_checkpoint, load_checkpoint
+
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    # sha1 of all python files of the package, any change to the code invalidates cached results
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    key = hashlib.sha1()
+    for file in sorted(glob.glob(os.path.join(root, "**", "*.py"), recursive=True)):
+        key.update(os.path.relpath(file, root).encode())
+        with open(file, "rb") as f:
+            key.update(f.read())
+    return key.hexdigest()
+
+
+def result_key(checksum, agent_type, seed, **arguments):
+    # a training run is determined by the dataset's content, the agent, its arguments, the seed and the code
+    content = {"dataset": checksum, "agent_type": agent_type, "seed": seed, "arguments": arguments,
+               "code": code_version()}
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def result_path(cache_dir, key):
+    return os.path.join(cache_dir, f"result_{key}.pkl")
+
+
+def load_result(cache_dir, key):
+    # (agent, records of its Logger), None if the run is not cached
+    result = load_checkpoint(result_path(cache_dir, key))
+    return None if result is None else (result["agent"], result["records"])
+
+
+def save_result(cache_dir, key, agent, records):
+    save_checkpoint(result_path(cache_dir, key), {"agent": agent, "records": records})
@@ -0,0 +1,66 @@
+import os
+import copy
+import pickle
+import gym
+from gym.wrappers import TimeLimit
+
+
+def save_checkpoint(path, state):
+    # written to a temporary file and moved into place, a crash never leaves a partial checkpoint behind
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def load_checkpoint(path):
+    # None if there is nothing to resume from
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def remove_checkpoint(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+# attributes that make up the simulation of the environments of the experiments: classic control (state,
+# steps_beyond_done), MiniGrid (grid and agent, the rest is fixed by the environment id) and MinAtar (game)
+SIMULATOR_ATTRIBUTES = ["state", "steps_beyond_done", "grid", "agent_pos", "agent_dir", "carrying", "step_count",
+                        "mission", "goal_pos", "gap_pos", "obstacles", "game"]
+
+
+def env_state(env):
+    """
+    What a freshly made environment of the same id needs to continue exactly where env is: the state of its
+    generator, its simulation and the steps counted by its time limit. The environment itself is not pickled,
+    gym's generators can not be unpickled with NumPy 2.
+    """
+    unwrapped = env.unwrapped
+    # copied in one piece, objects shared by several attributes (e.g. MiniGrid obstacles in the grid) stay shared
+    simulator = copy.deepcopy({key: getattr(unwrapped, key) for key in SIMULATOR_ATTRIBUTES if hasattr(unwrapped, key)})
+    return {"np_random": copy.deepcopy(unwrapped.np_random.bit_generator.state), "simulator": simulator,
+            "elapsed_steps": [wrapper._elapsed_steps for wrapper in _time_limits(env)]}
+
+
+def restore_env_state(env, state):
+    # env is made by make_env for the same id, it is reset once so that the wrappers allow stepping it
+    env.reset()
+    env.unwrapped.np_random.bit_generator.state = state["np_random"]
+    for key, value in copy.deepcopy(state["simulator"]).items():
+        setattr(env.unwrapped, key, value)
+    for wrapper, steps in zip(_time_limits(env), state["elapsed_steps"]):
+        wrapper._elapsed_steps = steps
+
+
+def _time_limits(env):
+    wrappers = []
+    while isinstance(env, gym.Wrapper):
+        if isinstance(env, TimeLimit):
+            wrappers.append(env)
+        env = env.env
+    return wrappers
@@ -0,0 +1,280 @@
+import numpy as np
+from numpy import sin, cos, pi
+from gym import spaces
+
+
+class BatchedClassicControl():
+    """
+    NumPy reimplementation of a gym classic control environment that steps num_envs copies at once,
+    with the VecEnv interface. Every copy draws its start states from its own generator, seeded like gym's
+    env.seed(seed + i), and the dynamics follow gym 0.23 operation for operation, so trajectories match gym for
+    identical seeds and actions. The time limit of the registered environment is included.
+    Unlike VecEnv, step returns the infos as one dict, holding the terminal observations and the indices of the
+    copies that were reset.
+    """
+    max_episode_steps = None
+
+    def __init__(self, num_envs=1):
+        self.num_envs = num_envs
+        # observations are stored as float32
+        self.codec = None
+
+        self.rngs = [np.random.default_rng() for _ in range(num_envs)]
+        self.elapsed = np.zeros(num_envs, dtype=np.int64)
+        self.state = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def seed(self, seed):
+        # copy i is seeded with seed + i
+        self.rngs = [np.random.default_rng(None if seed is None else seed + i) for i in range(self.num_envs)]
+
+    def reset(self):
+        self._reset(np.arange(self.num_envs))
+        self.elapsed[:] = 0
+        return self._observation()
+
+    def step(self, actions):
+        terminal, reward = self._step(np.asarray(actions))
+        self.elapsed += 1
+        truncated = self.elapsed >= self.max_episode_steps
+        done = terminal | truncated
+
+        observation, infos = self._observation(), {}
+        if np.any(done):
+            ind = np.flatnonzero(done)
+            infos = {"ind": ind, "terminal_observation": observation[ind],
+                     "TimeLimit.truncated": truncated[ind] & ~terminal[ind]}
+            self._reset(ind)
+            self.elapsed[ind] = 0
+            observation[ind] = self._observation()[ind]
+
+        return observation, reward, done, infos
+
+    def close(self):
+        pass
+
+    def _reset(self, ind):
+        raise NotImplementedError
+
+    def _step(self, actions):
+        # advances self.state, returns the terminal flags and rewards
+        raise NotImplementedError
+
+    def _observation(self):
+        raise NotImplementedError
+
+
+class CartPole(BatchedClassicControl):
+    """
+    CartPole-v1, see gym.envs.classic_control.CartPoleEnv
+    """
+    max_episode_steps = 500
+
+    gravity = 9.8
+    masscart = 1.0
+    masspole = 0.1
+    total_mass = masspole + masscart
+    length = 0.5
+    polemass_length = masspole * length
+    force_mag = 10.0
+    tau = 0.02
+
+    theta_threshold_radians = 12 * 2 * pi / 360
+    x_threshold = 2.4
+
+    def __init__(self, num_envs=1):
+        super(CartPole, self).__init__(num_envs)
+
+        high = np.array([self.x_threshold * 2, np.finfo(np.float32).max,
+                         self.theta_threshold_radians * 2, np.finfo(np.float32).max], dtype=np.float32)
+        self.action_space = spaces.Discrete(2)
+        self.observation_space = spaces.Box(-high, high, dtype=np.float32)
+        self.state = np.zeros((num_envs, 4))
+
+    def _reset(self, ind):
+        for i in ind:
+            self.state[i] = self.rngs[i].uniform(low=-0.05, high=0.05, size=(4,))
+
+    def _step(self, actions):
+        x, x_dot, theta, theta_dot = self.state.T
+        force = np.where(actions == 1, self.force_mag, -self.force_mag)
+        costheta = cos(theta)
+        sintheta = sin(theta)
+
+        temp = (force + self.polemass_length * theta_dot ** 2 * sintheta) / self.total_mass
+        thetaacc = (self.gravity * sintheta - costheta * temp) / (
+            self.length * (4.0 / 3.0 - self.masspole * costheta ** 2 / self.total_mass)
+        )
+        xacc = temp - self.polemass_length * thetaacc * costheta / self.total_mass
+
+        # euler integration
+        x = x + self.tau * x_dot
+        x_dot = x_dot + self.tau * xacc
+        theta = theta + self.tau * theta_dot
+        theta_dot = theta_dot + self.tau * thetaacc
+
+        self.state = np.stack((x, x_dot, theta, theta_dot), axis=1)
+
+        terminal = (x < -self.x_threshold) | (x > self.x_threshold) | \
+                   (theta < -self.theta_threshold_radians) | (theta > self.theta_threshold_radians)
+        return terminal, np.ones(self.num_envs)
+
+    def _observation(self):
+        return self.state.astype(np.float32)
+
+
+class Acrobot(BatchedClassicControl):
+    """
+    Acrobot-v1, see gym.envs.classic_control.AcrobotEnv
+    """
+    max_episode_steps = 500
+
+    dt = 0.2
+
+    LINK_LENGTH_1 = 1.0
+    LINK_MASS_1 = 1.0
+    LINK_MASS_2 = 1.0
+    LINK_COM_POS_1 = 0.5
+    LINK_COM_POS_2 = 0.5
+    LINK_MOI = 1.0
+
+    MAX_VEL_1 = 4 * pi
+    MAX_VEL_2 = 9 * pi
+
+    AVAIL_TORQUE = np.array([-1.0, 0.0, +1])
+
+    def __init__(self, num_envs=1):
+        super(Acrobot, self).__init__(num_envs)
+
+        high = np.array([1.0, 1.0, 1.0, 1.0, self.MAX_VEL_1, self.MAX_VEL_2], dtype=np.float32)
+        self.action_space = spaces.Discrete(3)
+        self.observation_space = spaces.Box(low=-high, high=high, dtype=np.float32)
+        self.state = np.zeros((num_envs, 4))
+
+    def _reset(self, ind):
+        for i in ind:
+            self.state[i] = self.rngs[i].uniform(low=-0.1, high=0.1, size=(4,)).astype(np.float32)
+
+    def _step(self, actions):
+        s_augmented = np.concatenate((self.state, self.AVAIL_TORQUE[actions][:, None]), axis=1)
+
+        # one step of rk4 over [0, dt]
+        dt, dt2 = self.dt, self.dt / 2.0
+        k1 = self._dsdt(s_augmented)
+        k2 = self._dsdt(s_augmented + dt2 * k1)
+        k3 = self._dsdt(s_augmented + dt2 * k2)
+        k4 = self._dsdt(s_augmented + dt * k3)
+        ns = (s_augmented + dt / 6.0 * (k1 + 2 * k2 + 2 * k3 + k4))[:, :4]
+
+        ns[:, 0] = wrap(ns[:, 0], -pi, pi)
+        ns[:, 1] = wrap(ns[:, 1], -pi, pi)
+        ns[:, 2] = np.minimum(np.maximum(ns[:, 2], -self.MAX_VEL_1), self.MAX_VEL_1)
+        ns[:, 3] = np.minimum(np.maximum(ns[:, 3], -self.MAX_VEL_2), self.MAX_VEL_2)
+        self.state = ns
+
+        terminal = -cos(ns[:, 0]) - cos(ns[:, 1] + ns[:, 0]) > 1.0
+        return terminal, np.where(terminal, 0.0, -1.0)
+
+    def _observation(self):
+        s = self.state
+        return np.stack((cos(s[:, 0]), sin(s[:, 0]), cos(s[:, 1]), sin(s[:, 1]), s[:, 2], s[:, 3]),
+                        axis=1).astype(np.float32)
+
+    def _dsdt(self, s_augmented):
+        m1 = self.LINK_MASS_1
+        m2 = self.LINK_MASS_2
+        l1 = self.LINK_LENGTH_1
+        lc1 = self.LINK_COM_POS_1
+        lc2 = self.LINK_COM_POS_2
+        I1 = self.LINK_MOI
+        I2 = self.LINK_MOI
+        g = 9.8
+        a = s_augmented[:, -1]
+        theta1 = s_augmented[:, 0]
+        theta2 = s_augmented[:, 1]
+        dtheta1 = s_augmented[:, 2]
+        dtheta2 = s_augmented[:, 3]
+        d1 = (
+            m1 * lc1 ** 2
+            + m2 * (l1 ** 2 + lc2 ** 2 + 2 * l1 * lc2 * cos(theta2))
+            + I1
+            + I2
+        )
+        d2 = m2 * (lc2 ** 2 + l1 * lc2 * cos(theta2)) + I2
+        phi2 = m2 * lc2 * g * cos(theta1 + theta2 - pi / 2.0)
+        phi1 = (
+            -m2 * l1 * lc2 * dtheta2 ** 2 * sin(theta2)
+            - 2 * m2 * l1 * lc2 * dtheta2 * dtheta1 * sin(theta2)
+            + (m1 * lc1 + m2 * l1) * g * cos(theta1 - pi / 2)
+            + phi2
+        )
+        # the "book" dynamics, gym's default
+        ddtheta2 = (
+            a + d2 / d1 * phi1 - m2 * l1 * lc2 * dtheta1 ** 2 * sin(theta2) - phi2
+        ) / (m2 * lc2 ** 2 + I2 - d2 ** 2 / d1)
+        ddtheta1 = -(d2 * ddtheta2 + phi1) / d1
+        return np.stack((dtheta1, dtheta2, ddtheta1, ddtheta2, np.zeros(len(a))), axis=1)
+
+
+class MountainCar(BatchedClassicControl):
+    """
+    MountainCar-v0, see gym.envs.classic_control.MountainCarEnv
+    """
+    max_episode_steps = 200
+
+    min_position = -1.2
+    max_position = 0.6
+    max_speed = 0.07
+    goal_position = 0.5
+    goal_velocity = 0
+    force = 0.001
+    gravity = 0.0025
+
+    def __init__(self, num_envs=1):
+        super(MountainCar, self).__init__(num_envs)
+
+        low = np.array([self.min_position, -self.max_speed], dtype=np.float32)
+        high = np.array([self.max_position, self.max_speed], dtype=np.float32)
+        self.action_space = spaces.Discrete(3)
+        self.observation_space = spaces.Box(low, high, dtype=np.float32)
+        self.state = np.zeros((num_envs, 2))
+
+    def _reset(self, ind):
+        for i in ind:
+            self.state[i] = np.array([self.rngs[i].uniform(low=-0.6, high=-0.4), 0])
+
+    def _step(self, actions):
+        position, velocity = self.state.T
+
+        velocity = velocity + ((actions - 1) * self.force + cos(3 * position) * (-self.gravity))
+        velocity = np.clip(velocity, -self.max_speed, self.max_speed)
+        position = position + velocity
+        position = np.clip(position, self.min_position, self.max_position)
+        velocity = np.where((position == self.min_position) & (velocity < 0), 0, velocity)
+
+        self.state = np.stack((position, velocity), axis=1)
+
+        terminal = (position >= self.goal_position) & (velocity >= self.goal_velocity)
+        return terminal, np.full(self.num_envs, -1.0)
+
+    def _observation(self):
+        return self.state.astype(np.float32)
+
+
+def wrap(x, m, M):
+    # like gym's wrap, shifts by the full range until m <= x <= M
+    diff = M - m
+    while np.any(x > M):
+        x = np.where(x > M, x - diff, x)
+    while np.any(x < m):
+        x = np.where(x < m, x + diff, x)
+    return x
+
+
+# environments make_env can simulate with numpy_sim=True
+NUMPY_ENVS = {"CartPole-v1": CartPole, "Acrobot-v1": Acrobot, "MountainCar-v0": MountainCar}
@@ -0,0 +1,36 @@
+import numpy as np
+
+
+class AffineCodec():
+    """
+    Storage codec for observations that only take a few discrete values, like the object and colour indices
+    of MiniGrid or the channel indices of MinAtar. Observations are stored as uint8 codes with
+    obs = code * scale + offset and decoded at sample time through a lookup table.
+    """
+    dtype = np.uint8
+
+    def __init__(self, scale, offset):
+        self.scale = scale
+        self.offset = offset
+
+        # decoded values are float32 like an uncompressed buffer would store them
+        self.lut = (np.arange(np.iinfo(self.dtype).max + 1) * scale + offset).astype(np.float32)
+
+    def __eq__(self, other):
+        return isinstance(other, AffineCodec) and (self.scale, self.offset) == (other.scale, other.offset)
+
+    def __repr__(self):
+        return f"AffineCodec(scale={self.scale}, offset={self.offset})"
+
+    def encode(self, obs):
+        return np.rint((np.asarray(obs) - self.offset) / self.scale).astype(self.dtype)
+
+    def decode(self, codes):
+        return self.lut[codes]
+
+    def to_dict(self):
+        return {"scale": self.scale, "offset": self.offset}
+
+    @classmethod
+    def from_dict(cls, spec):
+        return cls(spec["scale"], spec["offset"])
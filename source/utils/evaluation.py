@@ -1,33 +1,80 @@
 import numpy as np
+import torch
 import warnings
 
 
 def evaluate(env, agent, writer, all_rewards, all_deviations_mean, all_deviations_std, over_episodes=100):
-    done, ep_reward, values, values_std, action_values, entropies, qval_delta = False, [], [], [], [], [], []
+    # an env that steps several copies (VecEnv, NumPy envs) plays one episode per copy, see evaluate_batch
+    if getattr(env, "num_envs", None) is not None:
+        return evaluate_batch(env, agent, writer, all_rewards, all_deviations_mean, all_deviations_std, over_episodes)
+
+    done, ep_reward, values, actions = False, [], [], []
+    stats = RunningStats()
     state = env.reset()
 
     while not done:
         action, value, entropy = agent.policy(state, eval=True)
         state, reward, done, _ = env.step(action)
         ep_reward.append(reward)
-        values.append(value.numpy().mean())
-        values_std.append(value.numpy().std())
-        if len(value.view(-1)) > action:
-            action_values.append(value.view(-1)[action].item())
-        else:
-            action_values.append(np.nan)
+        values.append(value.view(-1))
+        actions.append(action)
+        stats.add(value, entropy, action)
+
+    values, actions = torch.stack(values).numpy(), np.array(actions)
+    log_episode(writer, agent.discount, np.array(ep_reward, dtype=float), action_values_of(values, actions), stats,
+                all_rewards, all_deviations_mean, all_deviations_std, over_episodes)
+
+    return all_rewards, all_deviations_mean, all_deviations_std
+
+
+def evaluate_batch(vec_env, agent, writer, all_rewards, all_deviations_mean, all_deviations_std, over_episodes=100):
+    # every copy of the environment plays one episode, with one policy_batch call per step for all of them.
+    # Each episode is logged like one of evaluate, the copies reset automatically and their further steps are dropped
+    states = vec_env.reset()
+    running, lengths = np.ones(len(states), dtype=bool), np.zeros(len(states), dtype=np.int64)
+    rewards, values, actions, entropies = [], [], [], []
+
+    while running.any():
+        action, value, entropy = agent.policy_batch(states, eval=True)
+        states, reward, done, _ = vec_env.step(action)
+        rewards.append(reward)
+        values.append(value)
+        actions.append(action)
         entropies.append(entropy)
+        lengths += running
+        running &= ~done
 
+    # [steps, copies, ...]
+    rewards, values, actions, entropies = [np.stack(x) for x in (rewards, values, actions, entropies)]
+    for k, length in enumerate(lengths):
+        stats = RunningStats()
+        stats.add_batch(values[:length, k], entropies[:length, k], actions[:length, k])
+        log_episode(writer, agent.discount, rewards[:length, k].astype(float),
+                    action_values_of(values[:length, k], actions[:length, k]), stats,
+                    all_rewards, all_deviations_mean, all_deviations_std, over_episodes)
+
+    return all_rewards, all_deviations_mean, all_deviations_std
+
+
+def action_values_of(values, actions):
+    # value of the taken action, if the agent has action values
+    action_values = np.full(len(actions), np.nan)
+    valid = actions < values.shape[1]
+    action_values[valid] = values[valid, actions[valid]]
+    return action_values
+
+
+def log_episode(writer, discount, ep_reward, action_values, stats, all_rewards, all_deviations_mean,
+                all_deviations_std, over_episodes):
     # calculate target discounted reward
     cum_reward, cr = np.zeros_like(ep_reward), 0
     for i in reversed(range(len(ep_reward))):
         cr = cr + ep_reward[i]
         cum_reward[i] = cr
-        cr *= agent.discount
+        cr *= discount
 
-    for i, qval in enumerate(action_values):
-        # compare action value with real outcome
-        qval_delta.append(qval - cum_reward[i])
+    # compare action value with real outcome
+    qval_delta = action_values - cum_reward
 
     all_rewards.append(sum(ep_reward))
     all_deviations_mean.append(np.mean(qval_delta))
@@ -43,13 +90,111 @@ def evaluate(env, agent, writer, all_rewards, all_deviations_mean, all_deviation
         writer.add_scalar("eval/Action-Value deviation (std)", np.nanstd(qval_delta), len(all_rewards))
         writer.add_scalar("eval/Action-Value deviation (std) (SMA)", np.nanmean(all_deviations_std[-over_episodes:]),
                           len(all_rewards))
-        writer.add_scalar("eval/Max-Action-Value (mean)", np.nanmean(action_values), len(all_rewards))
-        writer.add_scalar("eval/Max-Action-Value (std)", np.nanstd(action_values), len(all_rewards))
-        writer.add_scalar("eval/Values", np.nanmean(values), len(all_rewards))
-        writer.add_scalar("eval/Action-Values std", np.nanmean(values_std), len(all_rewards))
-        writer.add_scalar("eval/Entropy", np.nanmean(entropies), len(all_rewards))
+        writer.add_scalar("eval/Max-Action-Value (mean)", stats.mean("action_values"), len(all_rewards))
+        writer.add_scalar("eval/Max-Action-Value (std)", stats.std("action_values"), len(all_rewards))
+        writer.add_scalar("eval/Values", stats.mean("values"), len(all_rewards))
+        writer.add_scalar("eval/Action-Values std", stats.mean("values_std"), len(all_rewards))
+        writer.add_scalar("eval/Entropy", stats.mean("entropies"), len(all_rewards))
 
-    return all_rewards, all_deviations_mean, all_deviations_std
+
+class RunningStats():
+    """
+    NaN-aware running mean and standard deviation (Welford) of the per step statistics of a policy: mean, std and
+    max (or the value of the taken action) of the values it returns, and its entropy. Each step only copies the
+    values into a preallocated chunk, without conversions to NumPy. The chunk is reduced and merged into the running
+    moments with the parallel form of Welford's algorithm once it is full or the statistics are read.
+    Steps without values (random actions) or entropy are skipped, like np.nanmean and np.nanstd would, and a
+    statistic without any entries has mean and std NaN.
+    """
+    names = ["values", "values_std", "action_values", "entropies"]
+
+    def __init__(self, chunk=1000):
+        self.chunk = chunk
+        self.count = torch.zeros(len(self.names), dtype=torch.float64)
+        self._mean = torch.zeros(len(self.names), dtype=torch.float64)
+        self._m2 = torch.zeros(len(self.names), dtype=torch.float64)
+
+        # steps of the current chunk, the values are allocated with the first tensor, their size is known then
+        self.n = 0
+        self.values = None
+        self.actions = np.zeros(chunk, dtype=np.int64)
+        self.entropies = np.zeros(chunk)
+
+    def reset(self):
+        self.n = 0
+        self.count.zero_()
+        self._mean.zero_()
+        self._m2.zero_()
+
+    def add(self, value, entropy, action=None):
+        # the value of action is used instead of the max if given
+        if isinstance(value, torch.Tensor):
+            value = value.view(-1)
+            if self.values is None or len(value) != self.values.shape[1]:
+                self._merge()
+                self.values = torch.empty((self.chunk, len(value)), dtype=torch.float64)
+            self.values[self.n] = value
+        elif self.values is not None:
+            self.values[self.n] = np.nan
+        else:
+            self.values = torch.full((self.chunk, 1), np.nan, dtype=torch.float64)
+
+        self.actions[self.n] = -1 if action is None else action
+        self.entropies[self.n] = entropy
+        self.n += 1
+        if self.n == self.chunk:
+            self._merge()
+
+    def add_batch(self, values, entropies, actions=None):
+        # several steps at once, values [steps, actions] with NaN rows for steps without values, like policy_batch
+        values = torch.as_tensor(values, dtype=torch.float64)
+        if self.values is None or values.shape[1] != self.values.shape[1]:
+            self._merge()
+            self.values = torch.empty((self.chunk, values.shape[1]), dtype=torch.float64)
+
+        i = 0
+        while i < len(values):
+            n = min(len(values) - i, self.chunk - self.n)
+            self.values[self.n:self.n + n] = values[i:i + n]
+            self.actions[self.n:self.n + n] = -1 if actions is None else actions[i:i + n]
+            self.entropies[self.n:self.n + n] = entropies[i:i + n]
+            self.n, i = self.n + n, i + n
+            if self.n == self.chunk:
+                self._merge()
+
+    def mean(self, name):
+        self._merge()
+        i = self.names.index(name)
+        return self._mean[i].item() if self.count[i] > 0 else np.nan
+
+    def std(self, name):
+        self._merge()
+        i = self.names.index(name)
+        return np.sqrt(self._m2[i].item() / self.count[i].item()) if self.count[i] > 0 else np.nan
+
+    def _merge(self):
+        if self.n == 0:
+            return
+        values, actions = self.values[:self.n], torch.from_numpy(self.actions[:self.n])
+        action_values = values.gather(1, actions.clamp(0, values.shape[1] - 1).view(-1, 1)).view(-1)
+        action_values = torch.where(actions < 0, values.max(dim=1).values,
+                                    torch.where(actions < values.shape[1], action_values,
+                                                torch.full_like(action_values, np.nan)))
+        x = torch.stack((values.mean(dim=1), values.std(dim=1, unbiased=False), action_values,
+                         torch.from_numpy(self.entropies[:self.n])), dim=1)
+        self.n = 0
+
+        # moments of the chunk, then combined with the running ones
+        valid = ~torch.isnan(x)
+        count = valid.sum(dim=0)
+        mean = torch.where(valid, x, torch.zeros_like(x)).sum(dim=0) / count.clamp(min=1)
+        m2 = torch.where(valid, x - mean, torch.zeros_like(x)).pow(2).sum(dim=0)
+
+        total = self.count + count
+        delta = mean - self._mean
+        self._mean += delta * count / total.clamp(min=1)
+        self._m2 += m2 + delta ** 2 * self.count * count / total.clamp(min=1)
+        self.count = total
 
 
 def entropy(values):
@@ -58,3 +203,11 @@ def entropy(values):
     if np.min(probs) < 1e-5:
         return 0
     return -np.sum(probs * np.log(probs))
+
+
+def entropy_batch(values):
+    # entropy of every row, like entropy
+    probs = values.detach().cpu().numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ent = -np.sum(probs * np.log(probs), axis=1)
+    return np.where(np.min(probs, axis=1) < 1e-5, 0., ent)
@@ -0,0 +1,181 @@
+import time
+import queue
+import threading
+import numpy as np
+import torch
+from torch.utils.tensorboard import SummaryWriter
+
+
+class Logger():
+    """
+    Stand-in for SummaryWriter.add_scalar and add_histogram that keeps the caller's thread free of the
+    serialisation. Scalars are written to preallocated arrays, which a background thread hands to a SummaryWriter
+    once they are full, every flush_secs seconds, or on flush() and close(). Tensors and histograms take a row as
+    well, they are kept in a list next to the arrays, so everything is written in the order it was logged. Tensors
+    are only converted on that thread, so agents may log a loss without .item() and without waiting for the device.
+
+    downsample ({tag: k}) keeps every k-th value of a tag, aggregate ({tag: k}) logs the mean of every k values
+    at the step of the last one. Tags match if they start with the given key.
+    Without a log_dir the Logger does nothing, e.g. for benchmarks. With record, everything written is also kept in
+    records, as (kind, tag, value, step), so it can be written again later with replay().
+    """
+    def __init__(self, log_dir=None, capacity=4096, flush_secs=10, downsample=None, aggregate=None, record=False):
+        self.log_dir = log_dir
+        self.record = record
+        self.records = []
+        self.capacity = capacity
+        self.flush_secs = flush_secs
+        self.downsample = downsample or {}
+        self.aggregate = aggregate or {}
+        if log_dir is None:
+            return
+
+        self.tags, self.tag_ids = [], {}
+        # two sets of arrays, one is filled while the other one is written
+        self.free = queue.Queue()
+        for _ in range(2):
+            self.free.put(self._allocate())
+        self.current, self.n = self.free.get(), 0
+        self.lock = threading.Lock()
+
+        # per tag count and sum of values for downsample and aggregate, kept across flushes
+        self.counts, self.sums = {}, {}
+        self.error = None
+
+        self.writer = SummaryWriter(log_dir=log_dir)
+        self.pending = queue.Queue()
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._consume, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add_scalar(self, tag, value, step):
+        if self.log_dir is None:
+            return
+        # keep tensors as they are until the background thread writes them
+        if isinstance(value, torch.Tensor):
+            self._add(tag, step, np.nan, ("scalar", value.detach()))
+        else:
+            self._add(tag, step, value, None)
+
+    def add_histogram(self, tag, values, step):
+        if self.log_dir is None:
+            return
+        # copied, the caller may reuse its tensor or array
+        values = values.detach().clone() if isinstance(values, torch.Tensor) else np.array(values)
+        self._add(tag, step, np.nan, ("histogram", values))
+
+    def flush(self):
+        # returns once everything logged so far is written
+        if self.log_dir is None:
+            return
+        with self.lock:
+            self._swap()
+        self.pending.join()
+        self.writer.flush()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        if self.log_dir is None or self.stop.is_set():
+            return
+        self.flush()
+        self.stop.set()
+        self.thread.join()
+        self.writer.close()
+
+    def _allocate(self):
+        # tag ids, steps, float values and, for tensors and histograms, (kind, value) in a list
+        return (np.zeros(self.capacity, dtype=np.int32), np.zeros(self.capacity, dtype=np.int64),
+                np.zeros(self.capacity, dtype=np.float64), [None] * self.capacity)
+
+    def _add(self, tag, step, value, item):
+        with self.lock:
+            if tag not in self.tag_ids:
+                self.tag_ids[tag] = len(self.tags)
+                self.tags.append(tag)
+            tags, steps, values, items = self.current
+            tags[self.n], steps[self.n], values[self.n], items[self.n] = self.tag_ids[tag], step, value, item
+            self.n += 1
+            if self.n == self.capacity:
+                self._swap()
+
+    def _swap(self):
+        # hand the filled arrays to the background thread, waits for a free set if it is behind
+        self.pending.put((self.current, self.n))
+        self.current, self.n = self.free.get(), 0
+
+    def _consume(self):
+        last = time.perf_counter()
+        while not self.stop.is_set():
+            try:
+                (tags, steps, values, items), n = self.pending.get(timeout=0.1)
+            except queue.Empty:
+                if time.perf_counter() - last > self.flush_secs:
+                    with self.lock:
+                        if self.n > 0:
+                            self._swap()
+                    last = time.perf_counter()
+                continue
+
+            try:
+                for tag_id, step, value, item in zip(tags[:n].tolist(), steps[:n].tolist(), values[:n].tolist(),
+                                                     items[:n]):
+                    if item is None:
+                        self._write(self.tags[tag_id], value, step)
+                    elif item[0] == "scalar":
+                        self._write(self.tags[tag_id], item[1].item(), step)
+                    else:
+                        self._write_histogram(self.tags[tag_id], item[1], step)
+            except Exception as e:
+                self.error = e
+            # the tensors are not kept alive until the row is used again
+            items[:n] = [None] * n
+            self.free.put((tags, steps, values, items))
+            self.pending.task_done()
+            last = time.perf_counter()
+
+    def _write(self, tag, value, step):
+        count = self.counts.get(tag, 0) + 1
+        self.counts[tag] = count
+
+        k = match(tag, self.aggregate)
+        if k is not None:
+            self.sums[tag] = self.sums.get(tag, 0.) + value
+            if count % k == 0:
+                self._write_scalar(tag, self.sums.pop(tag) / k, step)
+            return
+
+        k = match(tag, self.downsample)
+        if k is None or (count - 1) % k == 0:
+            self._write_scalar(tag, value, step)
+
+    def _write_scalar(self, tag, value, step):
+        self.writer.add_scalar(tag, value, step)
+        if self.record:
+            self.records.append(("scalar", tag, value, step))
+
+    def _write_histogram(self, tag, values, step):
+        self.writer.add_histogram(tag, values, step)
+        if self.record:
+            self.records.append(("histogram", tag, values.cpu().numpy() if isinstance(values, torch.Tensor) else values,
+                                 step))
+
+    def replay(self, records):
+        # writes records of another Logger as they are, e.g. of a cached run
+        for kind, tag, value, step in records:
+            if kind == "scalar":
+                self.add_scalar(tag, value, step)
+            else:
+                self.add_histogram(tag, value, step)
+
+
+def match(tag, rules):
+    # k of the longest key the tag starts with, None if there is none
+    keys = [key for key in rules if tag.startswith(key)]
+    return rules[max(keys, key=len)] if len(keys) > 0 else None
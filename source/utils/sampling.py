@@ -0,0 +1,175 @@
+import time
+import queue
+import threading
+
+
+class Prefetcher():
+    """
+    Draws batches from a ReplayBuffer on a background thread and keeps up to `depth` of them ready.
+    Agents use it like the buffer itself, sample() returns the next prefetched batch. The (minimum, maximum)
+    window of every future call has to be known in advance and is passed as `windows`, the remaining sample
+    arguments are taken from the first call. Batches are drawn in order with the buffer's rng, so the
+    sequence is the same as sampling on the main thread.
+    """
+    def __init__(self, buffer, windows, depth=4):
+        self.buffer = buffer
+        self.windows = iter(windows)
+        self.depth = depth
+        self.batch_size = buffer.batch_size
+
+        self.queue = queue.Queue(maxsize=depth)
+        # guards index sampling against concurrent priority updates
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.thread = None
+        self.kwargs = None
+        self.last_ind = None
+
+        # timing, in seconds: time spent drawing batches, and time the consumer had to wait for them
+        self.sample_time = 0.
+        self.wait_time = 0.
+        self.batches = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def sample(self, minimum=None, maximum=None, use_probas=False, use_remaining_reward=False,
+               give_next_action=False):
+        kwargs = {"use_probas": use_probas, "use_remaining_reward": use_remaining_reward,
+                  "give_next_action": give_next_action}
+        if self.thread is None:
+            self.kwargs = kwargs
+            self.thread = threading.Thread(target=self._produce, daemon=True)
+            self.thread.start()
+        assert kwargs == self.kwargs, f"Prefetcher was started with {self.kwargs}, got {kwargs}"
+
+        start = time.perf_counter()
+        item = self.queue.get()
+        self.wait_time += time.perf_counter() - start
+
+        if isinstance(item, Exception):
+            raise item
+        window, ind, batch = item
+        assert window == (minimum, maximum), f"Expected a batch for window {window}, got {(minimum, maximum)}"
+
+        self.last_ind = ind
+        return batch
+
+    def update_priorities(self, priorities, ind=None):
+        # the batch currently trained on is not the one the buffer sampled last
+        with self.lock:
+            self.buffer.update_priorities(priorities, self.last_ind if ind is None else ind)
+
+    def _produce(self):
+        try:
+            for minimum, maximum in self.windows:
+                start = time.perf_counter()
+                with self.lock:
+                    ind = self.buffer._sample_indices(minimum, maximum, self.kwargs["use_probas"])
+                batch = self.buffer._gather(ind, self.kwargs["use_remaining_reward"],
+                                            self.kwargs["give_next_action"])
+                self.sample_time += time.perf_counter() - start
+                self.batches += 1
+
+                if not self._put(((minimum, maximum), ind, batch)):
+                    return
+            self._put(StopIteration("Prefetcher ran out of windows"))
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        # do not block forever on a full queue once the consumer is gone
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def stats(self):
+        # share of the sampling time that ran in parallel to training
+        hidden = 1. - self.wait_time / self.sample_time if self.sample_time > 0 else 0.
+        return {"batches": self.batches,
+                "sample_ms": 1e3 * self.sample_time / max(self.batches, 1),
+                "wait_ms": 1e3 * self.wait_time / max(self.batches, 1),
+                "hidden": max(hidden, 0.)}
+
+    def close(self):
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+class BlockSampler():
+    """
+    Draws k batches at once with ReplayBuffer.sample_many and hands them out one per sample() call.
+    A new block is drawn when the current one is used up, or when the window or the sample arguments change,
+    so with a window that moves every iteration (progression) it falls back to one batch per block.
+    """
+    def __init__(self, buffer, k):
+        self.buffer = buffer
+        self.k = k
+        self.batch_size = buffer.batch_size
+
+        self.key = None
+        self.block = None
+        self.ind = None
+        self.pos = k
+        self.last_ind = None
+
+    def sample(self, minimum=None, maximum=None, use_probas=False, use_remaining_reward=False,
+               give_next_action=False):
+        key = (minimum, maximum, use_probas, use_remaining_reward, give_next_action)
+        if self.pos == self.k or key != self.key:
+            self.ind = self.buffer._sample_indices_many(self.k, minimum, maximum, use_probas)
+            self.block = self.buffer._gather_many(self.ind, use_remaining_reward, give_next_action)
+            self.key, self.pos = key, 0
+
+        self.last_ind = self.ind[self.pos]
+        batch = tuple(field[self.pos] for field in self.block)
+        self.pos += 1
+        return batch
+
+    def update_priorities(self, priorities, ind=None):
+        self.buffer.update_priorities(priorities, self.last_ind if ind is None else ind)
+
+
+class SharedSampler():
+    """
+    Hands the same batch to several agents trained in lock-step. advance() draws the indices of the next
+    iteration, every sample() call until the next advance() returns the transitions at these indices. Agents that
+    ask for different fields (remaining reward, next action) get them gathered once per iteration as well.
+    Every call returns copies of the gathered tensors, so an agent that changes its batch in place does not change
+    the batch of the next one.
+    """
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.batch_size = buffer.batch_size
+
+        self.window = None
+        self.use_probas = False
+        self.ind = None
+        self.batches = {}
+
+    def advance(self, minimum=None, maximum=None, use_probas=False):
+        self.window, self.use_probas = (minimum, maximum), use_probas
+        self.ind = self.buffer._sample_indices(minimum, maximum, use_probas)
+        self.batches = {}
+
+    def sample(self, minimum=None, maximum=None, use_probas=False, use_remaining_reward=False,
+               give_next_action=False):
+        assert self.ind is not None, "Call advance() before the first sample()"
+        assert (minimum, maximum) == self.window and use_probas == self.use_probas, \
+            f"SharedSampler drew a batch for window {self.window}, got {(minimum, maximum)}"
+
+        key = (use_remaining_reward, give_next_action)
+        if key not in self.batches:
+            self.batches[key] = self.buffer._gather(self.ind, use_remaining_reward, give_next_action)
+        return tuple(field.clone() for field in self.batches[key])
+
+    def update_priorities(self, priorities, ind=None):
+        self.buffer.update_priorities(priorities, self.ind if ind is None else ind)
@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import traceback
+import torch
+import multiprocessing
+import multiprocessing.pool
+
+
+class Manifest():
+    """
+    Records finished jobs, one json line per job key, e.g. (experiment, envid, agent_type, buffer_type, run).
+    Only the process that schedules the jobs writes to it, lines are appended and flushed as soon as a job is done,
+    so an interrupted experiment loses at most the jobs that were still running.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.finished = set()
+        # the next line has to start on a new line after a line cut off by a crash
+        self.partial = False
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    self.partial = not line.endswith("\n")
+                    # a line cut off by a crash belongs to a job that counts as not done
+                    try:
+                        self.finished.add(tuple(json.loads(line)["job"]))
+                    except (json.JSONDecodeError, KeyError):
+                        pass
+
+    def done(self, key):
+        return tuple(key) in self.finished
+
+    def complete(self, key, seconds=None):
+        key = tuple(key)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(("\n" if self.partial else "") + json.dumps({"job": list(key), "seconds": seconds}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.finished.add(key)
+        self.partial = False
+
+
+class NonDaemonProcess(multiprocessing.Process):
+    # a process that may start processes of its own
+    @property
+    def daemon(self):
+        return False
+
+    @daemon.setter
+    def daemon(self, value):
+        pass
+
+
+class NonDaemonContext(type(multiprocessing.get_context())):
+    Process = NonDaemonProcess
+
+
+class NestablePool(multiprocessing.pool.Pool):
+    """
+    Pool whose workers are not daemonic, so a job can open a pool of its own, e.g.
+    train_online(parallel_datasets=True). Workers are still terminated with the pool.
+    """
+    def __init__(self, *args, **kwargs):
+        super(NestablePool, self).__init__(*args, context=NonDaemonContext(), **kwargs)
+
+
+def manifest_path(experiment):
+    return os.path.join("data", f"ex{experiment}", "manifest.jsonl")
+
+
+def run_jobs(fn, jobs, manifest, processes=None, threads=1):
+    """
+    Runs fn(args) for every job (keys, args) that has a key not yet in the manifest, on a pool of processes that
+    each use `threads` torch threads. By default the pool fills the machine. A job may cover several keys (e.g.
+    all agents trained on one dataset), fn can return the keys that failed, all others are marked as done.
+    A job that raises is reported and left out of the manifest, the remaining jobs continue.
+    Returns the keys that did not finish.
+    """
+    jobs = [(keys, args) for keys, args in jobs if not all(manifest.done(key) for key in keys)]
+    if processes is None:
+        processes = max(1, (os.cpu_count() or 1) // threads)
+    processes = min(processes, len(jobs))
+
+    failed = []
+    if processes == 0:
+        return failed
+
+    with NestablePool(processes, initializer=torch.set_num_threads, initargs=(threads, ), maxtasksperchild=1) as p:
+        for keys, seconds, failed_keys, error in p.imap_unordered(_run_job, [(fn, keys, args) for keys, args in jobs]):
+            if error is not None:
+                print(f"Job {keys} failed:\n{error}")
+                failed.extend(keys)
+                continue
+            failed_keys = set(tuple(key) for key in failed_keys or [])
+            for key in keys:
+                if tuple(key) in failed_keys:
+                    failed.append(key)
+                elif not manifest.done(key):
+                    manifest.complete(key, seconds)
+
+    return failed
+
+
+def _run_job(job):
+    # runs in the worker, exceptions are returned as their traceback, they are not necessarily picklable
+    fn, keys, args = job
+    start = time.perf_counter()
+    try:
+        failed_keys, error = fn(args), None
+    except Exception:
+        failed_keys, error = None, traceback.format_exc()
+    return keys, time.perf_counter() - start, failed_keys, error
+
+
+def grid(experiment, envs, agent_types, buffer_types, runs):
+    # job keys of an experiment, every agent on every dataset in every run
+    return [(experiment, envid, agent_type, buffer_type, run)
+            for envid in envs for run in runs for buffer_type in buffer_types for agent_type in agent_types]
+
+
+def by_dataset(keys, manifest):
+    # unfinished keys grouped by (experiment, envid, buffer_type, run), for agents trained together on one dataset
+    groups = {}
+    for key in keys:
+        if not manifest.done(key):
+            experiment, envid, _, buffer_type, run = key
+            groups.setdefault((experiment, envid, buffer_type, run), []).append(key)
+    return groups
@@ -0,0 +1,82 @@
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from .buffer import ReplayBuffer, FIELDS, load_dataset
+
+
+class SharedDataset():
+    """
+    Picklable handle to a dataset that a DatasetBroker placed in shared memory.
+    Pass it to pool workers and call attach() there to get a zero-copy ReplayBuffer.
+    """
+    def __init__(self, name, header, blocks):
+        self.name = name
+        self.header = header
+        # field -> name of the shared memory block
+        self.blocks = blocks
+
+    def attach(self, seed=None):
+        segments, fields = [], {}
+        for field, block in self.blocks.items():
+            spec = self.header["fields"][field]
+            segment = shared_memory.SharedMemory(name=block)
+            array = np.ndarray(tuple(spec["shape"]), dtype=np.dtype(spec["dtype"]), buffer=segment.buf)
+            # every job attaches to the same memory, nobody may write into it
+            array.flags.writeable = False
+
+            segments.append(segment)
+            fields[field] = array
+
+        buffer = ReplayBuffer.from_fields(self.header, fields, seed=seed)
+        # the arrays are only valid as long as the segments are open
+        buffer.shared_segments = segments
+        return buffer
+
+
+class DatasetBroker():
+    """
+    Loads every dataset once into multiprocessing.shared_memory and hands out SharedDataset handles by name.
+    The shared memory is released when the broker is closed, so close it only after all workers are done.
+    Create the broker before the worker pool.
+    """
+    def __init__(self):
+        self.datasets = {}
+        self.segments = []
+
+        # workers started from now on share this resource tracker. Workers with their own tracker
+        # would unlink every segment they attached to as soon as they exit.
+        resource_tracker.ensure_running()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def share(self, name, buffer):
+        if name in self.datasets:
+            return self.datasets[name]
+
+        blocks, header = {}, buffer.header()
+        for field in FIELDS:
+            # the buffer may not have allocated all rows yet, the rest stays zero
+            array, shape = getattr(buffer, field), tuple(header["fields"][field]["shape"])
+            segment = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * array.itemsize, 1))
+            np.ndarray(shape, dtype=array.dtype, buffer=segment.buf)[:len(array)] = array
+
+            self.segments.append(segment)
+            blocks[field] = segment.name
+
+        self.datasets[name] = SharedDataset(name, header, blocks)
+        return self.datasets[name]
+
+    def load(self, path):
+        # the dataset is read from disk only the first time it is requested
+        if path not in self.datasets:
+            self.share(path, load_dataset(path))
+        return self.datasets[path]
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+            segment.unlink()
+        self.segments, self.datasets = [], {}
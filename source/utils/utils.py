@@ -1,9 +1,12 @@
+import os
+import functools
 import numpy as np
 import gym
 import gym_minigrid
-import gym_minatar
 from gym_minigrid.wrappers import FullyObsWrapper
 from .wrappers import FlatImgObsWrapper, RestrictMiniGridActionWrapper, MinAtarObsWrapper
+from .vec_env import VecEnv
+from .classic_control import NUMPY_ENVS
 from ..agents.dqn import DQN
 from ..agents.rem import REM
 from ..agents.uqn import UQN
@@ -48,7 +51,19 @@ def get_agent(agent_type, obs_space, num_actions, discount, lr, seed):
         return Random(obs_space, num_actions, discount, lr, seed=seed)
 
 
-def make_env(envid):
+def make_env(envid, num_envs=None, asynchronous=False, numpy_sim=False):
+    # classic control environments can be simulated in numpy, always batched, see classic_control
+    if numpy_sim:
+        assert envid in NUMPY_ENVS, f"No numpy simulation of {envid}, only of {list(NUMPY_ENVS)}"
+        return NUMPY_ENVS[envid](1 if num_envs is None else num_envs)
+
+    # num_envs copies stepped together, see VecEnv
+    if num_envs is not None:
+        return VecEnv([functools.partial(make_env, envid)] * num_envs, asynchronous=asynchronous)
+
+    if "MinAtar" in envid:
+        # registers the MinAtar environments, only needed for them
+        import gym_minatar
     env = gym.make(envid)
     if "MiniGrid" in envid:
         env = FlatImgObsWrapper(RestrictMiniGridActionWrapper(env))
@@ -57,6 +72,19 @@ def make_env(envid):
     return env
 
 
+def get_codec(env):
+    # storage codec for the observations of an environment from make_env, None stores them as float32
+    return getattr(env, "codec", None)
+
+
+def dataset_path(experiment, envid, run, buffer_type):
+    return os.path.join("data", f"ex{experiment}", f"{envid}_run{run}_{buffer_type}")
+
+
+def checkpoint_path(experiment, envid, run):
+    return os.path.join("data", f"ex{experiment}", "checkpoints", f"{envid}_run{run}.pkl")
+
+
 def cosine_similarity(s1, s2):
     assert len(s1.shape) == 1 and len(s2.shape) == 1, \
         f"s1 and s2 must be vectors, found shapes {s1.shape} and {s2.shape}"
@@ -0,0 +1,131 @@
+import numpy as np
+import multiprocessing as mp
+from tqdm import tqdm
+
+
+class VecEnv():
+    """
+    Steps several copies of an environment with one call, either in this process or in one worker process per
+    copy (asynchronous). Finished episodes are reset automatically, step then returns the first observation of
+    the next episode for that copy. Observations are stacked as they come from the environment, without
+    casting them to the dtype of the observation space as the gym vector envs do.
+    """
+    def __init__(self, env_fns, asynchronous=False):
+        self.num_envs = len(env_fns)
+        self.asynchronous = asynchronous
+        self.closed = False
+
+        if asynchronous:
+            self.remotes, self.processes = [], []
+            for env_fn in env_fns:
+                remote, worker_remote = mp.Pipe()
+                process = mp.Process(target=_worker, args=(worker_remote, env_fn), daemon=True)
+                process.start()
+                worker_remote.close()
+                self.remotes.append(remote)
+                self.processes.append(process)
+            self.remotes[0].send(("spaces", None))
+            self.observation_space, self.action_space, self.codec = self.remotes[0].recv()
+        else:
+            self.envs = [env_fn() for env_fn in env_fns]
+            self.observation_space, self.action_space = self.envs[0].observation_space, self.envs[0].action_space
+            # storage codec of the observations, see utils.get_codec
+            self.codec = getattr(self.envs[0], "codec", None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _call(self, command, args):
+        # one argument per copy of the environment
+        if self.asynchronous:
+            for remote, arg in zip(self.remotes, args):
+                remote.send((command, arg))
+            return [remote.recv() for remote in self.remotes]
+        return [_execute(env, command, arg) for env, arg in zip(self.envs, args)]
+
+    def seed(self, seed):
+        # copy i is seeded with seed + i
+        self._call("seed", [None if seed is None else seed + i for i in range(self.num_envs)])
+
+    def reset(self):
+        return np.stack(self._call("reset", [None] * self.num_envs))
+
+    def step(self, actions):
+        observations, rewards, dones, infos = zip(*self._call("step", actions))
+        return np.stack(observations), np.array(rewards), np.array(dones), infos
+
+    def close(self):
+        if self.closed:
+            return
+        if self.asynchronous:
+            for remote in self.remotes:
+                remote.send(("close", None))
+            for process in self.processes:
+                process.join()
+        else:
+            for env in self.envs:
+                env.close()
+        self.closed = True
+
+
+def collect(vec_env, buffer, transitions, policy, desc=None):
+    """
+    Fills buffer with transitions from all copies of vec_env, policy maps a batch of states to actions.
+    Each episode is written in one piece once it is done, so episodes stay contiguous in the buffer.
+    The last written episode is cut off at `transitions`, unfinished episodes are dropped.
+    """
+    episodes = [[] for _ in range(vec_env.num_envs)]
+    added = 0
+
+    states = vec_env.reset()
+    with tqdm(total=transitions, desc=desc) as pbar:
+        while added < transitions:
+            actions = policy(states)
+            next_states, rewards, dones, _ = vec_env.step(actions)
+
+            for i in range(vec_env.num_envs):
+                episodes[i].append((states[i], actions[i], rewards[i], dones[i]))
+                if dones[i]:
+                    episode = episodes[i][:transitions - added]
+                    for transition in episode:
+                        buffer.add(*transition)
+                    added += len(episode)
+                    pbar.update(len(episode))
+                    episodes[i] = []
+
+            states = next_states
+
+
+def _execute(env, command, arg):
+    if command == "seed":
+        return env.seed(arg)
+    if command == "reset":
+        return env.reset()
+    if command == "step":
+        observation, reward, done, info = env.step(arg)
+        if done:
+            info["terminal_observation"] = observation
+            observation = env.reset()
+        return observation, reward, done, info
+    raise ValueError(f"Unknown command {command}")
+
+
+def _worker(remote, env_fn):
+    env = env_fn()
+    try:
+        while True:
+            command, arg = remote.recv()
+            if command == "close":
+                break
+            if command == "spaces":
+                remote.send((env.observation_space, env.action_space, getattr(env, "codec", None)))
+            else:
+                remote.send(_execute(env, command, arg))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        env.close()
+        remote.close()
@@ -1,6 +1,7 @@
 import gym
 from gym import spaces
 import numpy as np
+from .codec import AffineCodec
 
 
 class MinAtarObsWrapper(gym.core.ObservationWrapper):
@@ -15,6 +16,9 @@ class MinAtarObsWrapper(gym.core.ObservationWrapper):
             dtype='uint8'
         )
 
+        # observations are channel index / channels - 0.5, stored as the channel index
+        self.codec = AffineCodec(1 / obs_shape[2], -0.5)
+
     def observation(self, obs):
         # division by 10 as the first dimension can hold up to 5 different colors
         # and the second channel can hold up to 10 different objects
@@ -42,6 +46,9 @@ class FlatImgObsWrapper(gym.core.ObservationWrapper):
             dtype='uint8'
         )
 
+        # observations are object or colour index / 10 - 0.5, stored as the index
+        self.codec = AffineCodec(1 / 10, -0.5)
+
     def observation(self, obs):
         # division by 10 as the first dimension can hold up to 5 different colors
         # and the second channel can hold up to 10 different objects
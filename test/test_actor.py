@@ -0,0 +1,66 @@
+import queue
+import gym
+import torch
+from source.agents.dqn import DQN
+from source.utils.actor import Actor, drain
+import unittest
+
+
+class ActorTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.seed = 42
+        self.envid = "CartPole-v1"
+        self.steps = 300
+
+    def make_actor(self, transitions):
+        env = gym.make(self.envid)
+        env.seed(self.seed)
+        agent = DQN(4, 2, 0.99, 1e-4, seed=self.seed)
+        return Actor(0, env, agent, transitions, self.steps, seed=self.seed)
+
+    def test_allow(self):
+        transitions = queue.SimpleQueue()
+        actor = self.make_actor(transitions)
+        actor.allow(100)
+        actor.start()
+
+        items = []
+        while len(items) < 100:
+            items.extend(drain(transitions))
+        # the actor waits until it is allowed to continue
+        assert transitions.empty() and actor.is_alive() and actor.done_steps == 100
+
+        actor.allow(None)
+        actor.join()
+        items.extend(drain(transitions, block=False))
+        assert len(items) == self.steps
+
+    def test_close(self):
+        transitions = queue.SimpleQueue()
+        actor = self.make_actor(transitions)
+        actor.allow(10)
+        actor.start()
+        items = []
+        while len(items) < 10:
+            items.extend(drain(transitions))
+
+        # closing wakes up the waiting actor, which stops without further steps
+        actor.close()
+        assert not actor.is_alive() and actor.error is None
+        assert transitions.empty() and actor.done_steps == 10
+
+    def test_sync(self):
+        transitions = queue.SimpleQueue()
+        actor = self.make_actor(transitions)
+        agent = DQN(4, 2, 0.99, 1e-4, seed=self.seed + 1)
+        agent.iterations = 500
+        actor.sync(agent)
+
+        # the weights of the policy network and the iterations are copied, not the networks themselves
+        assert actor.policy.Q is not agent.Q and actor.policy.iterations == 500
+        for param, synced in zip(agent.Q.parameters(), actor.policy.Q.parameters()):
+            assert torch.equal(param, synced)
+        # the target network is left alone
+        assert not all(torch.equal(param, synced) for param, synced in
+                       zip(agent.Q_target.parameters(), actor.policy.Q_target.parameters()))
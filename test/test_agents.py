@@ -0,0 +1,92 @@
+import numpy as np
+import torch
+from source.agents.dqn import DQN
+from source.agents.rem import REM
+from source.agents.uqn import UQN
+from source.agents.qrdqn import QRDQN
+from source.agents.bcq import BCQ
+from source.agents.sac import SAC
+from source.agents.mce import MCE
+from source.agents.crr import CRR
+from source.agents.cql import CQL
+from source.agents.bc import BehavioralCloning
+from source.agents.bve import BVE
+from source.agents.random import Random
+from source.utils.buffer import ReplayBuffer, PrioritizedReplayBuffer
+from source.utils.logger import Logger
+import unittest
+
+
+class AgentTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.seed = 42
+        self.obs_space = 5
+        self.action_space = 3
+        self.batch_size = 10
+        self.discount = 0.99
+        self.lr = 1e-4
+
+        self.states = np.random.default_rng(self.seed).normal(size=(self.batch_size, self.obs_space))
+
+    def make_agents(self):
+        return [DQN(self.obs_space, self.action_space, self.discount, self.lr, seed=self.seed),
+                REM(self.obs_space, self.action_space, self.discount, self.lr, heads=4, seed=self.seed),
+                UQN(self.obs_space, self.action_space, self.discount, self.lr, heads=4, seed=self.seed),
+                QRDQN(self.obs_space, self.action_space, self.discount, self.lr, quantiles=5, seed=self.seed),
+                BCQ(self.obs_space, self.action_space, self.discount, self.lr, seed=self.seed),
+                SAC(self.obs_space, self.action_space, self.discount, self.lr, seed=self.seed),
+                MCE(self.obs_space, self.action_space, self.discount, self.lr, seed=self.seed),
+                CRR(self.obs_space, self.action_space, self.discount, self.lr, seed=self.seed),
+                CQL(self.obs_space, self.action_space, self.discount, self.lr, seed=self.seed),
+                BehavioralCloning(self.obs_space, self.action_space, self.discount, self.lr, seed=self.seed),
+                BVE(self.obs_space, self.action_space, self.discount, self.lr, seed=self.seed),
+                Random(self.obs_space, self.action_space, self.discount, self.lr, seed=self.seed)]
+
+    def test_policy_batch_shapes(self):
+        for agent in self.make_agents():
+            for eval in [True, False]:
+                actions, values, entropies = agent.policy_batch(self.states, eval=eval)
+
+                assert actions.shape == (self.batch_size, ), agent.get_name()
+                assert np.all((0 <= actions) & (actions < self.action_space)), agent.get_name()
+                assert values.shape == (self.batch_size, self.action_space), agent.get_name()
+                assert entropies.shape == (self.batch_size, ), agent.get_name()
+
+    def test_policy_batch_greedy(self):
+        # greedy evaluation is deterministic for value based agents, batched and single policy agree
+        for agent in self.make_agents():
+            if agent.get_name() in ["SoftActorCritic", "CriticRegularizedRegression", "BehavioralCloning", "Random"]:
+                continue
+            agent.eval_eps = 0.
+            actions, values, _ = agent.policy_batch(self.states, eval=True)
+
+            for state, action, value in zip(self.states, actions, values):
+                single_action, single_value, _ = agent.policy(state, eval=True)
+                assert action == single_action, agent.get_name()
+                assert np.allclose(value, single_value.numpy().reshape(-1), atol=1e-6), agent.get_name()
+
+    def test_policy_batch_explore(self):
+        agent = DQN(self.obs_space, self.action_space, self.discount, self.lr, seed=self.seed)
+        agent.eval_eps = 1.
+        actions, values, _ = agent.policy_batch(np.repeat(self.states, 100, axis=0), eval=True)
+
+        # random actions carry no value estimate
+        assert np.all(np.isnan(values))
+        assert len(np.unique(actions)) == self.action_space
+
+    def test_priorities(self):
+        # every agent that learns feeds its errors back into a prioritized buffer
+        rng = np.random.default_rng(self.seed)
+        buffer = ReplayBuffer(self.obs_space, 100, self.batch_size, seed=self.seed)
+        for i in range(100):
+            buffer.add(rng.normal(size=self.obs_space), rng.integers(self.action_space), rng.normal(), i % 10 == 9)
+        buffer.calc_remaining_reward(discount=self.discount)
+        writer = Logger()
+
+        for agent in self.make_agents():
+            if agent.get_name() == "Random":
+                continue
+            prioritized = PrioritizedReplayBuffer.from_buffer(buffer)
+            agent.train(prioritized, writer, use_probas=True)
+            assert prioritized.tree.total() != len(buffer.reward), agent.get_name()
@@ -0,0 +1,51 @@
+import gym
+import numpy as np
+from source.agents.dqn import DQN
+from source.train_online import train_async
+from source.utils.buffer import ReplayBuffer
+from source.utils.logger import Logger
+import unittest
+
+
+class Counter(gym.Env):
+    # observes (environment and episode, step in the episode), episodes end after 7 steps
+    observation_space = gym.spaces.Box(0, np.inf, (2,), dtype=np.float32)
+    action_space = gym.spaces.Discrete(2)
+
+    def seed(self, seed=None):
+        self.id = seed
+        self.episode = 0
+
+    def reset(self):
+        self.episode, self.t = self.episode + 1, 0
+        return np.array([self.id * 1000 + self.episode, self.t], dtype=np.float32)
+
+    def step(self, action):
+        self.t += 1
+        return np.array([self.id * 1000 + self.episode, self.t], dtype=np.float32), 1., self.t == 7, {}
+
+
+gym.envs.registration.register(id="Counter-v0", entry_point=Counter)
+
+
+class AsyncTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.seed = 42
+        self.transitions = 200
+
+    def test_next_state(self):
+        # transitions of several actors, every state that is not terminal is followed by its next state
+        agent = DQN(2, 2, 0.99, 1e-4, seed=self.seed)
+        buffer = ReplayBuffer(2, self.transitions, 32, seed=self.seed)
+        er_buffer = ReplayBuffer(2, self.transitions, 32, seed=self.seed)
+        train_async(agent, buffer, er_buffer, None, Logger(), "Counter-v0", self.transitions, actors=3,
+                    replay_ratio=1, sync_every=10, train_start_iter=50, evaluate_every=10 ** 9, mean_over=1,
+                    seed=self.seed)
+
+        for b in (buffer, er_buffer):
+            assert b.current_size == self.transitions
+            state, not_done = b.state[:self.transitions], b.not_done[:self.transitions, 0].astype(bool)
+            assert np.array_equal(state[1:][not_done[:-1]], state[:-1][not_done[:-1]] + [0, 1])
+            # the actors end with unfinished episodes, these are marked terminal
+            assert (~not_done).sum() > self.transitions // 7
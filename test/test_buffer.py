@@ -0,0 +1,362 @@
+import os
+import pickle
+import tempfile
+import numpy as np
+import torch
+import gym
+import gym_minigrid
+from source.utils.wrappers import FlatImgObsWrapper, RestrictMiniGridActionWrapper
+from source.utils.buffer import ReplayBuffer, PrioritizedReplayBuffer, SumTree, DatasetWriter, dataset_complete, \
+    load_dataset
+from source.utils.shared import DatasetBroker
+import unittest
+
+
+class BufferTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.seed = 42
+        self.obs_space = 4
+        self.buffer_size = 200
+        self.batch_size = 16
+
+        self.buffer = self.filled_buffer()
+
+    def filled_buffer(self, **kwargs):
+        buffer = ReplayBuffer(self.obs_space, self.buffer_size, self.batch_size, seed=self.seed, **kwargs)
+        rng = np.random.default_rng(self.seed)
+        for i in range(self.buffer_size):
+            buffer.add(rng.normal(size=self.obs_space), rng.integers(3), rng.normal(), i % 17 == 16)
+        return buffer
+
+    def assert_batches_equal(self, batch_1, batch_2):
+        assert len(batch_1) == len(batch_2)
+        for t1, t2 in zip(batch_1, batch_2):
+            assert t1.dtype == t2.dtype
+            assert t1.shape == t2.shape
+            assert torch.equal(t1, t2)
+
+    def test_device_storage(self):
+        device_buffer = self.filled_buffer(on_device=True)
+
+        for kwargs in [{}, {"give_next_action": True}, {"minimum": 10, "maximum": 50}]:
+            self.assert_batches_equal(self.buffer.sample(**kwargs), device_buffer.sample(**kwargs))
+
+    def test_device_storage_experiments(self):
+        device_buffer = self.filled_buffer()
+        device_buffer.to_device()
+
+        for buffer in [self.buffer, device_buffer]:
+            buffer.calc_remaining_reward(discount=0.9)
+            buffer.subset(20, 120)
+
+        self.assert_batches_equal(self.buffer.sample(use_remaining_reward=True),
+                                  device_buffer.sample(use_remaining_reward=True))
+
+        buffer, device_buffer = self.filled_buffer(), self.filled_buffer(on_device=True)
+        buffer.mix(self.filled_buffer(), p_orig=0.5)
+        device_buffer.mix(self.filled_buffer(on_device=True), p_orig=0.5)
+
+        self.assert_batches_equal(buffer.sample(), device_buffer.sample())
+
+    def test_pickle(self):
+        device_buffer = pickle.loads(pickle.dumps(self.filled_buffer(on_device=True)))
+
+        assert device_buffer.on_device
+        self.assert_batches_equal(self.buffer.sample(), device_buffer.sample())
+
+        # datasets saved before device storage existed
+        state = self.filled_buffer().__dict__.copy()
+        del state["on_device"], state["tensors"]
+        old_buffer = ReplayBuffer.__new__(ReplayBuffer)
+        old_buffer.__setstate__(state)
+
+        assert not old_buffer.on_device
+        self.assert_batches_equal(self.filled_buffer().sample(), old_buffer.sample())
+
+    def test_samplers(self):
+        for sampler in ["choice", "uniform", "rejection"]:
+            buffer = self.filled_buffer(sampler=sampler)
+            for minimum, maximum in [(None, None), (30, 80), (100, 100 + self.batch_size)]:
+                ind = buffer._sample_indices(minimum, maximum, use_probas=False)
+                low, high = (0, self.buffer_size) if minimum is None else (minimum, maximum)
+
+                assert ind.shape == (self.batch_size, )
+                assert np.all((low <= ind) & (ind < high))
+                if sampler != "uniform":
+                    assert len(np.unique(ind)) == self.batch_size
+
+    def test_sample_many(self):
+        for sampler in ["choice", "uniform", "rejection"]:
+            for kwargs in [{}, {"minimum": 30, "maximum": 80, "give_next_action": True}]:
+                buffer, reference = self.filled_buffer(sampler=sampler), self.filled_buffer(sampler=sampler)
+                block = buffer.sample_many(5, **kwargs)
+
+                assert all(field.shape[:2] == (5, self.batch_size) and field.is_contiguous() for field in block)
+                if sampler == "rejection":
+                    ind = buffer._rejection_sample(30, 80, k=50)
+                    assert all(len(np.unique(row)) == self.batch_size for row in ind)
+                else:
+                    # same random stream as sampling the batches one after the other
+                    for i in range(5):
+                        self.assert_batches_equal(reference.sample(**kwargs), tuple(field[i] for field in block))
+
+        # a single batch is drawn the same way as before
+        buffer, reference = self.filled_buffer(sampler="rejection"), self.filled_buffer(sampler="rejection")
+        assert np.array_equal(buffer._rejection_sample(30, 80), reference._rejection_sample(30, 80, k=1)[0])
+
+    def test_save_open(self):
+        with tempfile.TemporaryDirectory() as path:
+            self.buffer.save(path)
+
+            for mmap in [True, False]:
+                buffer = ReplayBuffer.open(path, mmap=mmap, seed=self.seed)
+
+                assert buffer.current_size == self.buffer.current_size
+                for field in ["state", "action", "reward", "not_done"]:
+                    assert np.array_equal(getattr(buffer, field), getattr(self.buffer, field))
+                self.assert_batches_equal(self.filled_buffer().sample(), buffer.sample())
+
+            buffer.calc_remaining_reward(discount=0.9)
+            buffer.subset(20, 120)
+            buffer.to_device()
+            buffer.sample(use_remaining_reward=True)
+
+    def test_lazy_allocation(self):
+        capacity, transitions = 10 ** 7, 3000
+        buffer = ReplayBuffer(self.obs_space, capacity, self.batch_size, seed=self.seed)
+        rng = np.random.default_rng(self.seed)
+        for i in range(transitions):
+            buffer.add(rng.normal(size=self.obs_space), rng.integers(3), rng.normal(), i % 17 == 16)
+
+        # memory follows the filled part, not the capacity
+        assert transitions <= len(buffer.reward) <= 2 * transitions and len(buffer.state) == len(buffer.reward) + 1
+        assert buffer._probas is None
+        buffer.sample()
+        assert buffer.probas.shape == (capacity, )
+
+        # saved with all rows of the capacity, like an eagerly allocated buffer
+        with tempfile.TemporaryDirectory() as path:
+            buffer.save(path)
+            loaded = ReplayBuffer.open(path)
+            assert loaded.state.shape == (capacity + 1, self.obs_space)
+            assert np.array_equal(loaded.state[:len(buffer.state)], buffer.state)
+            assert not np.any(loaded.state[len(buffer.state):len(buffer.state) + 1000])
+
+        # a full buffer ends up with exactly buffer_size rows, and wraps around
+        for i in range(2 * self.buffer_size):
+            self.buffer.add(rng.normal(size=self.obs_space), rng.integers(3), rng.normal(), False)
+        assert self.buffer.state.shape == (self.buffer_size + 1, self.obs_space)
+        assert self.buffer.reward.shape == (self.buffer_size, 1)
+
+    def test_dataset_writer(self):
+        transitions = [(self.buffer.state[i], self.buffer.action[i, 0], self.buffer.reward[i, 0],
+                        not self.buffer.not_done[i, 0]) for i in range(self.buffer_size)]
+
+        with tempfile.TemporaryDirectory() as path:
+            # the same files as ReplayBuffer.save, whatever the chunk size
+            writer = DatasetWriter(path, self.obs_space, self.batch_size, chunk_size=30)
+            for transition in transitions:
+                writer.add(*transition)
+            writer.close()
+            assert dataset_complete(path)
+            buffer = load_dataset(path)
+            for field in ["state", "action", "reward", "not_done"]:
+                assert np.array_equal(getattr(buffer, field), getattr(self.buffer, field))
+
+            # interrupted after 100 transitions, 90 of them written and readable
+            writer = DatasetWriter(path, self.obs_space, self.batch_size, chunk_size=30)
+            for transition in transitions[:100]:
+                writer.add(*transition)
+            assert not dataset_complete(path) and load_dataset(path).current_size == 90
+
+            # continued after the last complete episode, episodes end every 17 transitions
+            writer = DatasetWriter(path, self.obs_space, self.batch_size, chunk_size=30, resume=True)
+            assert writer.written == 85 and load_dataset(path).current_size == 85
+            for transition in transitions[85:]:
+                writer.add(*transition)
+            writer.close()
+            assert np.array_equal(load_dataset(path, mmap=False).state, self.buffer.state)
+
+            # a pickled writer cuts the files back to what it had written, its chunk continues from there
+            writer = DatasetWriter(path, self.obs_space, self.batch_size, chunk_size=30)
+            for transition in transitions[:40]:
+                writer.add(*transition)
+            state = pickle.dumps(writer)
+            for transition in transitions[40:70]:
+                writer.add(*transition)
+            writer = pickle.loads(state)
+            assert load_dataset(path).current_size == 60
+            writer.truncate()
+            assert load_dataset(path).current_size == 30
+            for transition in transitions[40:]:
+                writer.add(*transition)
+            writer.close()
+            assert np.array_equal(load_dataset(path).reward, self.buffer.reward)
+
+    def test_shared_memory(self):
+        with DatasetBroker() as broker:
+            handle = pickle.loads(pickle.dumps(broker.share("test", self.buffer)))
+            buffer = handle.attach(seed=self.seed)
+
+            for field in ["state", "action", "reward", "not_done"]:
+                assert np.array_equal(getattr(buffer, field), getattr(self.buffer, field))
+                assert not getattr(buffer, field).flags.writeable
+            self.assert_batches_equal(self.filled_buffer().sample(), buffer.sample())
+
+    def test_views(self):
+        buffer, other = self.filled_buffer(), self.filled_buffer()
+        other.reward *= -1
+        view = buffer.mixed(other, p_orig=0.3)
+
+        # the sources are left untouched
+        assert buffer.current_size == other.current_size == self.buffer_size
+
+        # reference, mix works in place on both buffers
+        other, buffer = self.filled_buffer(), self.filled_buffer()
+        other.reward *= -1
+        buffer.mix(other, p_orig=0.3)
+        with tempfile.TemporaryDirectory() as path:
+            view.save(path)
+            saved = ReplayBuffer.open(path, seed=self.seed)
+            for field in ["state", "action", "reward", "not_done"]:
+                assert np.array_equal(getattr(saved, field), getattr(buffer, field))
+                assert np.array_equal(getattr(view.materialize(), field), getattr(buffer, field))
+
+        # away from the segment border, samples match the concatenated buffer
+        view.rng, buffer.rng = np.random.default_rng(self.seed), np.random.default_rng(self.seed)
+        for kwargs in [{"minimum": 0, "maximum": 59}, {"minimum": 60, "maximum": 200, "give_next_action": True}]:
+            self.assert_batches_equal(buffer.sample(**kwargs), view.sample(**kwargs))
+
+        view.calc_remaining_reward(discount=0.9)
+        buffer.calc_remaining_reward(discount=0.9)
+        with tempfile.TemporaryDirectory() as path:
+            view.calc_remaining_reward(discount=0.9, cache_dir=path)
+            view.calc_remaining_reward(discount=0.9, cache_dir=path)
+            # one result, no temporary file left behind
+            assert [file.endswith(".npy") for file in os.listdir(path)] == [True]
+            assert np.array_equal(view.remaining_reward, buffer.remaining_reward)
+        view.rng, buffer.rng = np.random.default_rng(self.seed), np.random.default_rng(self.seed)
+        self.assert_batches_equal(buffer.sample(minimum=70, maximum=150, use_remaining_reward=True),
+                                  view.sample(minimum=70, maximum=150, use_remaining_reward=True))
+
+        sub = view.view(50, 70)
+        assert [(s[1], s[2]) for s in sub.segments] == [(50, 60), (60, 70)]
+        assert np.array_equal(sub.materialize().reward, buffer.reward[50:70])
+
+        # at the segment border as well, the next state is the first one of the next segment in the view, in its
+        # materialized copy and in mix(). The batch covers the whole window, the border at 59 included.
+        other, buffer = self.filled_buffer(), self.filled_buffer()
+        other.state *= -1
+        view = buffer.mixed(other, p_orig=0.3)
+        materialized = view.materialize()
+        mixed, other = self.filled_buffer(), self.filled_buffer()
+        other.state *= -1
+        mixed.mix(other, p_orig=0.3)
+        for kwargs in [{}, {"give_next_action": True}]:
+            batches = []
+            for source in [view, materialized, mixed]:
+                source.rng = np.random.default_rng(self.seed)
+                batches.append(source.sample(minimum=52, maximum=68, **kwargs))
+            self.assert_batches_equal(batches[0], batches[1])
+            self.assert_batches_equal(batches[0], batches[2])
+
+    def test_checksum(self):
+        buffer, other = self.filled_buffer(), self.filled_buffer()
+        assert buffer.checksum() == other.checksum()
+
+        # the content counts, not where it is stored
+        view = buffer.mixed(other, p_orig=0.3)
+        assert view.checksum() == view.materialize().checksum()
+        with tempfile.TemporaryDirectory() as path:
+            buffer.save(path)
+            assert ReplayBuffer.open(path).checksum() == buffer.checksum()
+
+        other.reward[5] += 1
+        assert buffer.checksum() != other.checksum()
+
+    def test_codec(self):
+        env = FlatImgObsWrapper(RestrictMiniGridActionWrapper(gym.make("MiniGrid-LavaGapS6-v0")))
+        env.seed(self.seed)
+        obs_space, rng = env.observation_space.shape[0], np.random.default_rng(self.seed)
+
+        buffers = [ReplayBuffer(obs_space, self.buffer_size, self.batch_size, seed=self.seed),
+                   ReplayBuffer(obs_space, self.buffer_size, self.batch_size, seed=self.seed, codec=env.codec),
+                   ReplayBuffer(obs_space, self.buffer_size, self.batch_size, seed=self.seed, codec=env.codec,
+                                on_device=True)]
+        state, done = env.reset(), False
+        for _ in range(self.buffer_size):
+            action = rng.integers(env.action_space.n)
+            next_state, reward, done, _ = env.step(action)
+            for buffer in buffers:
+                buffer.add(state, action, reward, done)
+            state = env.reset() if done else next_state
+
+        # the row after the last transition was never written, zeros decode to another value there
+        assert buffers[1].state.dtype == np.uint8
+        assert np.array_equal(buffers[0].state[:-1], buffers[1].decoded_state()[:-1])
+        for buffer in buffers[1:]:
+            buffers[0].set_seed(self.seed), buffer.set_seed(self.seed)
+            self.assert_batches_equal(buffers[0].sample(0, self.buffer_size - 1, give_next_action=True),
+                                      buffer.sample(0, self.buffer_size - 1, give_next_action=True))
+
+        with tempfile.TemporaryDirectory() as path:
+            buffers[1].save(path)
+            buffer = ReplayBuffer.open(path)
+            assert buffer.codec == env.codec
+            assert os.path.getsize(os.path.join(path, "state.bin")) * 4 == buffers[0].state.nbytes
+            assert np.array_equal(buffers[0].state[:-1], buffer.decoded_state()[:-1])
+
+    def test_remaining_reward(self):
+        rng = np.random.default_rng(self.seed)
+        for ends in [0.0, 0.05, 0.5, 1.0]:
+            buffer = self.filled_buffer()
+            buffer.not_done[:] = rng.uniform(size=buffer.not_done.shape) > ends
+
+            # reference implementation, sequential reverse loop
+            remaining, cum_reward = np.zeros_like(buffer.reward), 0
+            for i, d in reversed(list(enumerate(buffer.not_done))):
+                if not d:
+                    cum_reward = 0
+                cum_reward = cum_reward + buffer.reward[i]
+                remaining[i] = cum_reward
+                cum_reward *= 0.99
+
+            buffer.calc_remaining_reward(discount=0.99)
+            assert np.array_equal(buffer.remaining_reward, remaining)
+
+            with tempfile.TemporaryDirectory() as path:
+                buffer.calc_remaining_reward(discount=0.99, cache_dir=path)
+                buffer.calc_remaining_reward(discount=0.9, cache_dir=path)
+                assert len(os.listdir(path)) == 2
+
+                buffer.calc_remaining_reward(discount=0.99, cache_dir=path)
+                assert np.array_equal(buffer.remaining_reward, remaining)
+
+    def test_sum_tree(self):
+        rng = np.random.default_rng(self.seed)
+        for size in [1, 7, 64, 100]:
+            tree = SumTree(size)
+            priorities = rng.exponential(size=size)
+            tree.update(np.arange(size), priorities)
+
+            cumsum = np.concatenate(([0.], np.cumsum(priorities)))
+            assert np.allclose(tree.prefix(np.arange(size + 1)), cumsum)
+            assert np.isclose(tree.total(), cumsum[-1])
+
+            values = rng.uniform(0, cumsum[-1], size=1000)
+            assert np.array_equal(tree.find(values), np.searchsorted(cumsum, values, side="right") - 1)
+
+    def test_prioritized(self):
+        buffer = PrioritizedReplayBuffer.from_buffer(self.filled_buffer())
+
+        # all priority on the first half of the window
+        buffer.update_priorities(np.where(np.arange(self.buffer_size) < 60, 1., 0.), np.arange(self.buffer_size))
+        for _ in range(10):
+            buffer.sample(minimum=20, maximum=120, use_probas=True)
+            assert np.all((20 <= buffer.last_ind) & (buffer.last_ind < 60))
+
+        # updates only touch the last batch
+        buffer.update_priorities(np.full(self.batch_size, 100.))
+        assert np.isclose(buffer.tree.prefix(self.buffer_size), buffer.tree.total())
+        assert buffer.max_priority == (100. + buffer.eps) ** buffer.alpha
@@ -0,0 +1,35 @@
+import os
+import tempfile
+from source.agents.dqn import DQN
+from source.utils.cache import code_version, result_key, load_result, save_result
+import unittest
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.checksum = "0" * 40
+        self.arguments = {"envid": "CartPole-v1", "discount": 0.95, "transitions": 1000, "lr": 1e-4}
+
+    def test_keys(self):
+        key = result_key(self.checksum, "DQN", 42, **self.arguments)
+        assert key == result_key(self.checksum, "DQN", 42, **dict(reversed(list(self.arguments.items()))))
+        assert len(code_version()) == 40
+
+        # every part of the key matters
+        assert key != result_key("1" * 40, "DQN", 42, **self.arguments)
+        assert key != result_key(self.checksum, "REM", 42, **self.arguments)
+        assert key != result_key(self.checksum, "DQN", 43, **self.arguments)
+        assert key != result_key(self.checksum, "DQN", 42, **dict(self.arguments, lr=1e-3))
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            key = result_key(self.checksum, "DQN", 42, **self.arguments)
+            assert load_result(cache_dir, key) is None
+
+            agent, records = DQN(4, 2, 0.95, seed=42), [("scalar", "eval/Reward", 1., 0)]
+            save_result(os.path.join(cache_dir), key, agent, records)
+            cached, cached_records = load_result(cache_dir, key)
+            assert cached_records == records
+            for p, q in zip(agent.Q.parameters(), cached.Q.parameters()):
+                assert (p == q).all()
@@ -0,0 +1,124 @@
+import os
+import sys
+import time
+import pickle
+import tempfile
+import subprocess
+import numpy as np
+import gym
+import gym_minigrid
+from source.utils.checkpoint import env_state, restore_env_state, SIMULATOR_ATTRIBUTES
+from source.utils.classic_control import NUMPY_ENVS
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the environments of the experiments, MinAtar ones if it is installed
+ENVS = list(NUMPY_ENVS) + ["MiniGrid-LavaGapS7-v0", "MiniGrid-SimpleCrossingS9N1-v0",
+                           "MiniGrid-Dynamic-Obstacles-8x8-v0"]
+# gym 0.23's Acrobot uses np.float_, which NumPy 2 removed
+if np.lib.NumpyVersion(np.__version__) >= "2.0.0":
+    ENVS.remove("Acrobot-v1")
+try:
+    import gym_minatar
+    ENVS += [envid for envid in ["Breakout-MinAtar-v0", "Space_invaders-MinAtar-v0"]
+             if envid in gym.envs.registry.env_specs]
+except ImportError:
+    pass
+
+
+def train(cwd, **kwargs):
+    # train_online in its own process, it writes to data/ and runs/ below cwd
+    code = f"from source.train_online import train_online; train_online(**{kwargs!r})"
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT] + os.environ.get("PYTHONPATH", "").split(os.pathsep)))
+    return subprocess.Popen([sys.executable, "-c", code], cwd=cwd, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def attributes(env):
+    # the attributes of an environment in comparable form
+    return {key: pickle.dumps(value) for key, value in vars(env.unwrapped).items()}
+
+
+def assert_observations_equal(a, b):
+    if isinstance(a, dict):
+        assert a.keys() == b.keys()
+        for key in a:
+            assert np.array_equal(a[key], b[key])
+    else:
+        assert np.array_equal(a, b)
+
+
+def dataset_files(cwd):
+    files = {}
+    for root, _, names in os.walk(os.path.join(cwd, "data")):
+        for name in names:
+            with open(os.path.join(root, name), "rb") as f:
+                files[os.path.relpath(os.path.join(root, name), cwd)] = f.read()
+    return files
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.seed = 42
+        self.kwargs = dict(experiment=1, envid="CartPole-v1", transitions=1000, buffer_size=1000, seed=self.seed,
+                           checkpoint_every=200, chunk_size=150, resume=True)
+
+    def test_env_state(self):
+        rng = np.random.default_rng(self.seed)
+        for envid in ENVS:
+            env = gym.make(envid)
+            env.seed(self.seed)
+            env.reset()
+            for _ in range(5):
+                env.step(rng.integers(env.action_space.n))
+
+            # continued on a fresh environment, through the end of the episode and the next reset
+            restored = gym.make(envid)
+            restore_env_state(restored, pickle.loads(pickle.dumps(env_state(env))))
+            for _ in range(300):
+                action = rng.integers(env.action_space.n)
+                state, reward, done, _ = env.step(action)
+                restored_state, restored_reward, restored_done, _ = restored.step(action)
+                assert_observations_equal(state, restored_state)
+                assert reward == restored_reward and done == restored_done, envid
+                if done:
+                    assert_observations_equal(env.reset(), restored.reset())
+
+    def test_simulator_attributes(self):
+        # every attribute that changes while an environment runs has to be saved by env_state
+        rng = np.random.default_rng(self.seed)
+        for envid in ENVS:
+            env = gym.make(envid)
+            env.seed(self.seed)
+            env.reset()
+            changed, before = set(), attributes(env)
+            for _ in range(300):
+                _, _, done, _ = env.step(rng.integers(env.action_space.n))
+                # compared after the step and, at the end of an episode, after the reset as well
+                for reset in ([False, True] if done else [False]):
+                    if reset:
+                        env.reset()
+                    after = attributes(env)
+                    changed |= {key for key, value in after.items() if before.get(key) != value}
+                    before = after
+            missing = changed - set(SIMULATOR_ATTRIBUTES) - {"_np_random"}
+            assert len(missing) == 0, f"{envid} changes {missing}, which SIMULATOR_ATTRIBUTES does not cover"
+
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as uninterrupted, tempfile.TemporaryDirectory() as interrupted:
+            assert train(uninterrupted, **self.kwargs).wait() == 0
+
+            # killed during behavioural training, once there is a checkpoint to resume from
+            checkpoint = os.path.join(interrupted, "data", "ex1", "checkpoints", "CartPole-v1_run1.pkl")
+            process = train(interrupted, **self.kwargs)
+            while not os.path.exists(checkpoint) and process.poll() is None:
+                time.sleep(0.01)
+            process.kill()
+            process.wait()
+            assert os.path.exists(checkpoint)
+
+            assert train(interrupted, **self.kwargs).wait() == 0
+            assert not os.path.exists(checkpoint)
+            assert dataset_files(interrupted) == dataset_files(uninterrupted)
@@ -0,0 +1,46 @@
+import numpy as np
+import gym
+from source.utils.classic_control import NUMPY_ENVS
+import unittest
+
+
+class ClassicControlTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.seed = 42
+        self.num_envs = 4
+        self.steps = 2000
+
+    def test_against_gym(self):
+        for envid, cls in NUMPY_ENVS.items():
+            # gym 0.23 integrates Acrobot with np.float_, which NumPy 2 removed
+            if envid == "Acrobot-v1" and not hasattr(np, "float_"):
+                continue
+
+            batched = cls(self.num_envs)
+            batched.seed(self.seed)
+            envs = [gym.make(envid) for _ in range(self.num_envs)]
+            for i, env in enumerate(envs):
+                env.seed(self.seed + i)
+
+            assert batched.observation_space == envs[0].observation_space
+            assert batched.action_space == envs[0].action_space
+
+            rng, episodes = np.random.default_rng(self.seed), 0
+            assert np.array_equal(batched.reset(), np.stack([env.reset() for env in envs])), envid
+            for _ in range(self.steps):
+                actions = rng.integers(batched.action_space.n, size=self.num_envs)
+                observation, reward, done, infos = batched.step(actions)
+
+                for i, env in enumerate(envs):
+                    obs, r, d, info = env.step(int(actions[i]))
+                    assert d == done[i] and r == reward[i], envid
+                    if d:
+                        j = list(infos["ind"]).index(i)
+                        assert np.array_equal(obs, infos["terminal_observation"][j]), envid
+                        assert info.get("TimeLimit.truncated", False) == infos["TimeLimit.truncated"][j], envid
+                        obs, episodes = env.reset(), episodes + 1
+                    assert np.array_equal(obs, observation[i]), envid
+
+            # every environment went through a few resets
+            assert episodes >= self.num_envs, envid
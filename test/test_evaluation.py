@@ -0,0 +1,99 @@
+import functools
+import numpy as np
+import torch
+import gym
+from source.agents.dqn import DQN
+from source.utils.evaluation import RunningStats, evaluate
+from source.utils.vec_env import VecEnv
+from source.utils.classic_control import NUMPY_ENVS
+import unittest
+
+
+class ScalarWriter():
+    # keeps what would be logged
+    def __init__(self):
+        self.scalars = {}
+
+    def add_scalar(self, tag, value, step):
+        self.scalars.setdefault(tag, []).append((step, value))
+
+
+class EvaluationTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.seed = 42
+        self.steps = 500
+        self.actions = 3
+
+    def test_running_stats(self):
+        rng = np.random.default_rng(self.seed)
+        values = rng.normal(loc=3., scale=2., size=(self.steps, self.actions))
+        entropies = rng.uniform(size=self.steps)
+        # random actions come without values, some agents without entropy
+        values[rng.uniform(size=self.steps) < 0.3] = np.nan
+        entropies[rng.uniform(size=self.steps) < 0.5] = np.nan
+        actions = rng.integers(self.actions + 1, size=self.steps)
+
+        # a small chunk, the moments of several chunks are merged
+        stats, action_stats = RunningStats(chunk=64), RunningStats(chunk=64)
+        for value, entropy, action in zip(values, entropies, actions):
+            value = np.nan if np.isnan(value[0]) else torch.FloatTensor(value).view(1, -1)
+            stats.add(value, entropy)
+            action_stats.add(value, entropy, action)
+
+        values = values.astype(np.float32).astype(np.float64)
+        action_values = np.where(actions < self.actions, values[np.arange(self.steps),
+                                                                 np.minimum(actions, self.actions - 1)], np.nan)
+        for name, x in [("values", values.mean(axis=1)), ("values_std", values.std(axis=1)),
+                        ("action_values", values.max(axis=1)), ("entropies", entropies)]:
+            assert np.isclose(stats.mean(name), np.nanmean(x)), name
+            assert np.isclose(stats.std(name), np.nanstd(x)), name
+        assert np.isclose(action_stats.mean("action_values"), np.nanmean(action_values))
+        assert np.isclose(action_stats.std("action_values"), np.nanstd(action_values))
+
+    def test_reset(self):
+        stats = RunningStats()
+        stats.add(torch.FloatTensor([1., 2.]), np.nan)
+        assert stats.mean("values") == 1.5
+        # nothing but NaN
+        assert np.isnan(stats.mean("entropies")) and np.isnan(stats.std("entropies"))
+
+        stats.reset()
+        assert np.isnan(stats.mean("values"))
+
+    def test_add_batch(self):
+        rng = np.random.default_rng(self.seed)
+        values = rng.normal(size=(self.steps, self.actions))
+        values[rng.uniform(size=self.steps) < 0.3] = np.nan
+        entropies, actions = rng.uniform(size=self.steps), rng.integers(self.actions, size=self.steps)
+
+        stats, batch_stats = RunningStats(chunk=64), RunningStats(chunk=64)
+        for value, entropy, action in zip(values, entropies, actions):
+            stats.add(torch.from_numpy(value), entropy, action)
+        batch_stats.add_batch(values[:100], entropies[:100], actions[:100])
+        batch_stats.add_batch(values[100:], entropies[100:], actions[100:])
+        for name in RunningStats.names:
+            assert np.isclose(stats.mean(name), batch_stats.mean(name)), name
+            assert np.isclose(stats.std(name), batch_stats.std(name)), name
+
+    def test_evaluate_batch(self):
+        envid, episodes = "CartPole-v1", 4
+        agent = DQN(4, 2, 0.95, seed=self.seed)
+
+        # greedy episodes of copies i match single episodes seeded with seed + i
+        writer, results = ScalarWriter(), ([], [], [])
+        for i in range(episodes):
+            env = gym.make(envid)
+            env.seed(self.seed + i)
+            results = evaluate(env, agent, writer, *results)
+
+        for vec_env in [VecEnv([functools.partial(gym.make, envid)] * episodes), NUMPY_ENVS[envid](episodes)]:
+            vec_env.seed(self.seed)
+            batch_writer = ScalarWriter()
+            batch_results = evaluate(vec_env, agent, batch_writer, [], [], [])
+
+            assert batch_results[0] == results[0]
+            for tag, scalars in writer.scalars.items():
+                assert [step for step, _ in batch_writer.scalars[tag]] == list(range(1, episodes + 1))
+                assert np.allclose([v for _, v in scalars], [v for _, v in batch_writer.scalars[tag]],
+                                   equal_nan=True), tag
@@ -0,0 +1,72 @@
+import tempfile
+import numpy as np
+import torch
+from tensorboard.backend.event_processing.event_accumulator import EventAccumulator
+from source.utils.logger import Logger
+import unittest
+
+
+class LoggerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.steps = 1000
+
+    def read(self, log_dir):
+        events = EventAccumulator(log_dir)
+        events.Reload()
+        return {tag: [(e.step, e.value) for e in events.Scalars(tag)] for tag in events.Tags()["scalars"]}
+
+    def test_scalars(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            # a small capacity, the arrays are handed over several times
+            with Logger(log_dir, capacity=64, downsample={"train/": 10}, aggregate={"train/mean": 4}) as writer:
+                for i in range(self.steps):
+                    writer.add_scalar("eval/value", float(i), i)
+                    writer.add_scalar("eval/tensor", torch.tensor(2. * i), i)
+                    writer.add_scalar("train/value", float(i), i)
+                    writer.add_scalar("train/mean", float(i), i)
+            scalars = self.read(log_dir)
+
+        assert scalars["eval/value"] == [(i, float(i)) for i in range(self.steps)]
+        assert scalars["eval/tensor"] == [(i, 2. * i) for i in range(self.steps)]
+        assert scalars["train/value"] == [(i, float(i)) for i in range(0, self.steps, 10)]
+        # the longest matching key wins
+        assert scalars["train/mean"] == [(i + 3, i + 1.5) for i in range(0, self.steps, 4)]
+
+    def test_order(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            # floats and tensors of one tag, downsampled and aggregated in the order they were logged
+            with Logger(log_dir, capacity=64, downsample={"train/value": 3}, aggregate={"train/mean": 2},
+                        record=True) as writer:
+                for i in range(self.steps):
+                    value = float(i) if i % 2 == 0 else torch.tensor(float(i))
+                    writer.add_scalar("train/value", value, i)
+                    writer.add_scalar("train/mean", value, i)
+                    if i % 100 == 0:
+                        writer.add_histogram("train/states", torch.arange(10.), i)
+            scalars = self.read(log_dir)
+
+        assert scalars["train/value"] == [(i, float(i)) for i in range(0, self.steps, 3)]
+        assert scalars["train/mean"] == [(i + 1, i + .5) for i in range(0, self.steps, 2)]
+        assert [step for _, _, _, step in writer.records] == sorted(step for _, _, _, step in writer.records)
+
+    def test_record_replay(self):
+        with tempfile.TemporaryDirectory() as log_dir, tempfile.TemporaryDirectory() as other_dir:
+            with Logger(log_dir, aggregate={"train/mean": 4}, record=True) as writer:
+                for i in range(100):
+                    writer.add_scalar("eval/value", float(i), i)
+                    writer.add_scalar("train/mean", torch.tensor(float(i)), i)
+                writer.add_histogram("train/states", torch.arange(10.), 0)
+
+            # what was written, after aggregation
+            assert len(writer.records) == 100 + 25 + 1
+            with Logger(other_dir) as other:
+                other.replay(writer.records)
+            assert self.read(other_dir) == self.read(log_dir)
+
+    def test_noop(self):
+        writer = Logger()
+        writer.add_scalar("eval/value", 1., 0)
+        writer.add_histogram("train/states", np.zeros(10), 0)
+        writer.flush()
+        writer.close()
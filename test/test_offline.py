@@ -0,0 +1,40 @@
+import os
+import copy
+import tempfile
+import numpy as np
+import torch
+from source.train_offline import train_offline
+from source.utils.buffer import ReplayBuffer
+import unittest
+
+
+class OfflineTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.seed = 42
+        self.buffer = ReplayBuffer(4, 500, 32, seed=self.seed)
+        rng = np.random.default_rng(self.seed)
+        for i in range(500):
+            self.buffer.add(rng.normal(size=4), rng.integers(2), rng.normal(), i % 50 == 49)
+
+        # runs are written below the working directory
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self) -> None:
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_serial_seeds(self):
+        # agents StackedCritic cannot stack train their seeds one after the other
+        kwargs = dict(experiment=1, envid="CartPole-v1", agent_type="BC", transitions=20, use_subset=True, lower=0,
+                      upper=300)
+        agents = train_offline(seed=self.seed, seeds=2, dataset=self.buffer, **kwargs)
+        # every seed trained on its own copy of the dataset
+        assert len(agents) == 2 and len(self.buffer.reward) == 500
+        for i, agent in enumerate(agents):
+            other = train_offline(seed=self.seed + i, dataset=copy.copy(self.buffer), **kwargs)
+            for p, q in zip(agent.actor.parameters(), other.actor.parameters()):
+                assert torch.equal(p, q)
+        assert os.path.isdir(os.path.join("runs", "ex1", "CartPole-v1", "er", "BC", "run2"))
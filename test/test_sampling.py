@@ -0,0 +1,98 @@
+import numpy as np
+import torch
+from source.utils.buffer import ReplayBuffer, PrioritizedReplayBuffer
+from source.utils.sampling import Prefetcher, BlockSampler, SharedSampler
+import unittest
+
+
+class SamplingTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.seed = 42
+        self.obs_space = 4
+        self.buffer_size = 200
+        self.batch_size = 16
+
+    def filled_buffer(self, cls=ReplayBuffer):
+        buffer = cls(self.obs_space, self.buffer_size, self.batch_size, seed=self.seed)
+        rng = np.random.default_rng(self.seed)
+        for i in range(self.buffer_size):
+            buffer.add(rng.normal(size=self.obs_space), rng.integers(3), rng.normal(), i % 17 == 16)
+        return buffer
+
+    def assert_batches_equal(self, batch_1, batch_2):
+        assert len(batch_1) == len(batch_2)
+        for t1, t2 in zip(batch_1, batch_2):
+            assert torch.equal(t1, t2)
+
+    def test_prefetcher(self):
+        windows = [(None, None), (10, 50), (20, 60)] * 20
+        for kwargs in [{}, {"give_next_action": True}, {"use_remaining_reward": True}]:
+            buffer, reference = self.filled_buffer(), self.filled_buffer()
+            for b in [buffer, reference]:
+                b.calc_remaining_reward(discount=0.9)
+
+            with Prefetcher(buffer, windows, depth=3) as prefetcher:
+                for minimum, maximum in windows:
+                    self.assert_batches_equal(reference.sample(minimum, maximum, **kwargs),
+                                              prefetcher.sample(minimum, maximum, **kwargs))
+
+                stats = prefetcher.stats()
+                assert stats["batches"] == len(windows)
+                assert 0. <= stats["hidden"] <= 1.
+
+                # nothing left to prefetch
+                with self.assertRaises(StopIteration):
+                    prefetcher.sample(**kwargs)
+
+    def test_prefetcher_priorities(self):
+        buffer = PrioritizedReplayBuffer.from_buffer(self.filled_buffer())
+        windows = [(None, None)] * 10
+
+        with Prefetcher(buffer, windows, depth=4) as prefetcher:
+            for _ in windows:
+                prefetcher.sample(use_probas=True)
+                # priorities go to the batch trained on, not to the one sampled last
+                prefetcher.update_priorities(np.zeros(self.batch_size))
+                assert np.all(buffer.tree.nodes[buffer.tree.capacity + prefetcher.last_ind] == buffer.eps ** buffer.alpha)
+
+    def test_prefetcher_close(self):
+        # the producer must not hang on a full queue
+        prefetcher = Prefetcher(self.filled_buffer(), [(None, None)] * 100, depth=1)
+        prefetcher.sample()
+        prefetcher.close()
+        assert not prefetcher.thread.is_alive()
+
+    def test_block_sampler(self):
+        buffer, reference = self.filled_buffer(), self.filled_buffer()
+        sampler = BlockSampler(buffer, 4)
+
+        for _ in range(6):
+            self.assert_batches_equal(reference.sample(), sampler.sample())
+
+        # a window change starts a new block, the rest of the current one is dropped
+        reference.sample_many(2)
+        for _ in range(3):
+            self.assert_batches_equal(reference.sample(10, 50), sampler.sample(10, 50))
+
+    def test_shared_sampler(self):
+        buffer, reference = self.filled_buffer(), self.filled_buffer()
+        for b in [buffer, reference]:
+            b.calc_remaining_reward(discount=0.9)
+        sampler = SharedSampler(buffer)
+
+        for minimum, maximum in [(None, None), (10, 50)] * 3:
+            sampler.advance(minimum, maximum)
+            batch = reference.sample(minimum, maximum)
+            # every agent gets the same batch until the next advance, other fields at the same indices
+            for _ in range(3):
+                self.assert_batches_equal(batch, sampler.sample(minimum, maximum))
+            # copies, an agent changing its batch in place leaves the others' batches alone
+            first = sampler.sample(minimum, maximum)
+            first[0].add_(1.)
+            self.assert_batches_equal(batch, sampler.sample(minimum, maximum))
+            self.assert_batches_equal(reference._gather(sampler.ind, use_remaining_reward=True),
+                                      sampler.sample(minimum, maximum, use_remaining_reward=True))
+
+        with self.assertRaises(AssertionError):
+            sampler.sample(20, 60)
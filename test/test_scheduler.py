@@ -0,0 +1,64 @@
+import os
+import tempfile
+from multiprocessing import Pool
+from source.utils.scheduler import Manifest, run_jobs, grid, by_dataset
+import unittest
+
+
+def job(args):
+    name, fail = args
+    if fail == "raise":
+        raise RuntimeError(name)
+    # keys of the job that failed
+    return [(name, "b")] if fail == "partial" else None
+
+
+def square(x):
+    return x * x
+
+
+def nested(args):
+    # a job with a pool of its own, like train_online(parallel_datasets=True)
+    name, n = args
+    with Pool(2) as p:
+        assert p.map(square, range(n)) == [i * i for i in range(n)]
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_run_jobs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "ex1", "manifest.jsonl")
+            jobs = [([("ok", "a")], ("ok", None)),
+                    ([("raise", "a")], ("raise", "raise")),
+                    ([("partial", "a"), ("partial", "b")], ("partial", "partial"))]
+
+            failed = run_jobs(job, jobs, Manifest(path), processes=2)
+            assert sorted(failed) == [("partial", "b"), ("raise", "a")]
+
+            # a re-run only schedules the jobs with unfinished keys, a line cut off by a crash is ignored
+            with open(path, "a") as f:
+                f.write('{"job": ["raise", ')
+            manifest = Manifest(path)
+            assert manifest.finished == {("ok", "a"), ("partial", "a")}
+            jobs[1] = ([("raise", "a")], ("raise", None))
+            assert run_jobs(job, jobs, manifest) == [("partial", "b")]
+            assert Manifest(path).done(("raise", "a")) and not Manifest(path).done(("partial", "b"))
+
+    def test_by_dataset(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest = Manifest(os.path.join(tmp, "manifest.jsonl"))
+            keys = grid(1, ["CartPole-v1"], ["BC", "DQN"], ["er", "fully"], range(1, 3))
+            assert len(keys) == 8
+            manifest.complete((1, "CartPole-v1", "DQN", "er", 1))
+
+            groups = by_dataset(keys, manifest)
+            assert len(groups) == 4
+            assert groups[(1, "CartPole-v1", "er", 1)] == [(1, "CartPole-v1", "BC", "er", 1)]
+            assert len(groups[(1, "CartPole-v1", "fully", 2)]) == 2
+
+    def test_nested(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest = Manifest(os.path.join(tmp, "manifest.jsonl"))
+            assert run_jobs(nested, [([("a", 1)], ("a", 3)), ([("b", 1)], ("b", 4))], manifest, processes=2) == []
+            assert manifest.done(("a", 1)) and manifest.done(("b", 1))
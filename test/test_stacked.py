@@ -0,0 +1,83 @@
+import copy
+import numpy as np
+import torch
+from source.agents.dqn import DQN
+from source.agents.bve import BVE
+from source.agents.mce import MCE
+from source.agents.cql import CQL
+from source.agents.stacked import StackedCritic
+from source.utils.buffer import ReplayBuffer
+from source.utils.logger import Logger
+import unittest
+
+
+class StackedTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.seeds = [42, 43, 44]
+        self.obs_space = 4
+        self.batch_size = 16
+        # more than target_update_freq, so the target networks are copied as well
+        self.iterations = 150
+
+        self.buffer = ReplayBuffer(self.obs_space, 1000, self.batch_size, seed=self.seeds[0])
+        rng = np.random.default_rng(self.seeds[0])
+        for i in range(1000):
+            self.buffer.add(rng.normal(size=self.obs_space), rng.integers(2), rng.normal(), i % 50 == 49)
+        # for MCE
+        self.buffer.calc_remaining_reward(discount=0.99)
+
+    def make(self, agent_type):
+        agents, buffers = [], []
+        for seed in self.seeds:
+            agents.append(agent_type(self.obs_space, 2, 0.99, 1e-3, seed=seed))
+            buffers.append(copy.copy(self.buffer))
+            buffers[-1].set_seed(seed)
+        return agents, buffers
+
+    def test_against_serial(self):
+        writer = Logger()
+        for agent_type in [DQN, BVE, MCE, CQL]:
+            serial, buffers = self.make(agent_type)
+            for agent, buffer in zip(serial, buffers):
+                for _ in range(self.iterations):
+                    agent.train(buffer, writer)
+
+            agents, buffers = self.make(agent_type)
+            stacked = StackedCritic(agents)
+            for _ in range(self.iterations):
+                stacked.train(buffers, [writer] * len(agents))
+            stacked.close()
+
+            # every seed trains as it would on its own, up to the rounding of the batched matmuls. With CQL, these
+            # differences of about 1e-7 flip a near tie of the greedy next action once the target network is
+            # copied, which moves the parameters by about 1e-4.
+            atol = 1e-3 if agent_type is CQL else 1e-5
+            for agent, other in zip(serial, agents):
+                assert agent.iterations == other.iterations
+                params = [list(agent.Q.parameters()), list(other.Q.parameters())]
+                if agent_type in (DQN, CQL):
+                    params = [params[0] + list(agent.Q_target.parameters()),
+                              params[1] + list(other.Q_target.parameters())]
+                for p, q in zip(*params):
+                    assert np.allclose(p.detach().numpy(), q.detach().numpy(), atol=atol), agent_type.__name__
+
+                # the agent's own optimizer holds its slice of the stacked Adam state
+                for p, q in zip(agent.Q.parameters(), other.Q.parameters()):
+                    state, other_state = agent.optimizer.state[p], other.optimizer.state[q]
+                    assert state.keys() == other_state.keys() and int(state["step"]) == int(other_state["step"])
+                    for key in ("exp_avg", "exp_avg_sq"):
+                        assert np.allclose(state[key].numpy(), other_state[key].numpy(), atol=atol)
+
+                state = self.buffer.state[0]
+                assert agent.policy(state, eval=True)[0] == other.policy(state, eval=True)[0]
+
+            # after close(), every agent trains on its own parameters
+            before = [[param.detach().clone() for param in agent.Q.parameters()] for agent in agents[:2]]
+            agents[0].train(buffers[0], writer)
+            assert all(not torch.equal(p, q) for p, q in zip(before[0], agents[0].Q.parameters()))
+            assert all(torch.equal(p, q) for p, q in zip(before[1], agents[1].Q.parameters()))
+
+        # agents of different types do not share a training step
+        with self.assertRaises(AssertionError):
+            StackedCritic([DQN(self.obs_space, 2, 0.99, seed=0), CQL(self.obs_space, 2, 0.99, seed=0)])
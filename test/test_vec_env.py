@@ -0,0 +1,44 @@
+import functools
+import numpy as np
+import gym
+from source.utils.buffer import ReplayBuffer
+from source.utils.vec_env import VecEnv, collect
+import unittest
+
+
+class VecEnvTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.seed = 42
+        self.envid = "CartPole-v1"
+        self.num_envs = 3
+
+    def make_vec_env(self, asynchronous):
+        vec_env = VecEnv([functools.partial(gym.make, self.envid)] * self.num_envs, asynchronous=asynchronous)
+        vec_env.seed(self.seed)
+        return vec_env
+
+    def test_sync_async(self):
+        rng = np.random.default_rng(self.seed)
+        with self.make_vec_env(False) as sync_env, self.make_vec_env(True) as async_env:
+            assert np.array_equal(sync_env.reset(), async_env.reset())
+            for _ in range(100):
+                actions = rng.integers(2, size=self.num_envs)
+                for s, a in zip(sync_env.step(actions)[:3], async_env.step(actions)[:3]):
+                    assert np.array_equal(s, a)
+
+    def test_collect(self):
+        transitions, rng = 1000, np.random.default_rng(self.seed)
+        buffer = ReplayBuffer(4, transitions, 32, seed=self.seed)
+
+        with self.make_vec_env(False) as vec_env:
+            collect(vec_env, buffer, transitions, lambda states: rng.integers(2, size=len(states)))
+        assert buffer.current_size == transitions
+
+        # within an episode, every state is the successor of the one before
+        env = gym.make(self.envid).unwrapped
+        env.reset()
+        for t in np.flatnonzero(buffer.not_done[:-1, 0]):
+            env.state = buffer.state[t].astype(np.float64)
+            next_state, _, _, _ = env.step(int(buffer.action[t, 0]))
+            assert np.allclose(next_state, buffer.state[t + 1], atol=1e-5)